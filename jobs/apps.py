@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
+
+
+class JobsConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "jobs"
+
+    def ready(self):
+        # 导入各应用的 tasks 模块, 注册其中的后台任务
+        autodiscover_modules("tasks")
+        # 注册检查工作进程是否在运行的系统检查
+        from . import checks  # noqa: F401
@@ -0,0 +1,27 @@
+from django.core.checks import Tags, Warning, register
+from django.db import DatabaseError
+
+from .queue import oldest_overdue_job
+
+
+@register(Tags.database)
+def check_worker_running(app_configs, databases=None, **kwargs):
+    """
+    到期很久仍未被领取的任务说明没有运行 run_jobs 工作进程
+
+    需要查询数据库, 只在 `manage.py check --database default` 时执行
+    """
+    if not databases or 'default' not in databases:
+        return []
+    try:
+        job = oldest_overdue_job()
+    except DatabaseError:
+        # 尚未执行迁移
+        return []
+    if job is None:
+        return []
+    return [Warning(
+        f'任务 {job.name} #{job.pk} 自 {job.run_at:%Y-%m-%d %H:%M:%S} 起仍未执行',
+        hint='启动 `python manage.py run_jobs` 工作进程; 没有工作进程时设备游标、快照和缩略图都不会更新',
+        id='jobs.W001',
+    )]
@@ -0,0 +1,31 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from jobs.queue import Worker
+
+
+class Command(BaseCommand):
+    help = (
+        '启动后台任务工作进程, 领取并执行 jobs 队列中的任务; 必须至少运行一个, '
+        '设备同步游标、墓碑清理、快照重建和缩略图都依赖它'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=None,
+            help='同时执行的任务数, 默认取 settings.JOBS_WORKER_CONCURRENCY',
+        )
+        parser.add_argument('--poll-interval', type=float, default=None, help='队列为空时的轮询间隔 (秒)')
+        parser.add_argument('--once', action='store_true', help='执行完当前所有到期的任务后退出, 可由 cron 调用')
+        parser.add_argument('--max-jobs', type=int, default=None, help='执行这么多个任务后退出')
+
+    def handle(self, *args, **options):
+        worker = Worker(concurrency=options['concurrency'], poll_interval=options['poll_interval'])
+        # 收到终止信号后不再领取新任务, 等正在执行的任务结束再退出
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: worker.stop())
+        if not options['once']:
+            self.stdout.write(f'工作进程 {worker.worker_id} 已启动, 并发数 {worker.concurrency}')
+        worker.run(once=options['once'], max_jobs=options['max_jobs'])
+        self.stdout.write(self.style.SUCCESS(f'已执行 {worker.processed} 个任务, 失败 {worker.failed} 个'))
@@ -0,0 +1,51 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """
+    后台任务模型
+    由 jobs.queue.enqueue 写入, run_jobs 工作进程按 run_at 顺序领取执行;
+    成功的任务直接删除, 重试次数用尽的任务以失败状态保留, 便于排查
+    unique_key 非空时同一个键最多只有一个排队中的任务, 用于合并重复的请求
+    """
+    QUEUED = 0
+    RUNNING = 1
+    FAILED = 2
+    STATUS_CHOICES = (
+        (QUEUED, '排队中'),
+        (RUNNING, '执行中'),
+        (FAILED, '失败'),
+    )
+
+    name = models.CharField(max_length=100)
+    args = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    unique_key = models.CharField(max_length=200, blank=True, default='')
+    status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = '后台任务'
+        verbose_name_plural = '后台任务'
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+            models.Index(fields=['unique_key', 'status'], name='job_unique_key_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['unique_key'],
+                condition=Q(status=0) & ~Q(unique_key=''),
+                name='job_queued_unique_key_uniq',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} - {self.get_status_display()}"
@@ -0,0 +1,266 @@
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# 周期任务使用的 unique_key 前缀
+PERIODIC_KEY_PREFIX = 'periodic:'
+
+
+@dataclass(frozen=True)
+class Task:
+    name: str
+    func: object
+    max_attempts: int
+    retry_delay: timedelta
+    concurrency: int | None
+    eager: bool
+
+
+registry = {}
+
+
+def task(name=None, max_attempts=3, retry_delay=timedelta(seconds=10), concurrency=None, eager=False):
+    """
+    把函数注册为后台任务
+
+    任务名默认为 "<应用>.<函数名>"; 参数必须可以 JSON 序列化。
+
+    Args:
+        max_attempts: 最多执行次数, 失败后按 retry_delay 指数退避重试
+        concurrency: 所有工作进程中同时执行该任务的上限, None 表示不限制
+        eager: settings.JOBS_EAGER 为 True 时是否在请求中直接执行, 只适合开销很小的记录类任务;
+            为 False 的任务 (快照重建、缩略图等) 始终入队, 由工作进程执行
+    """
+    def decorator(func):
+        task_name = name or f"{func.__module__.split('.')[0]}.{func.__name__}"
+        registry[task_name] = Task(task_name, func, max_attempts, retry_delay, concurrency, eager)
+        func.task_name = task_name
+        return func
+    return decorator
+
+
+def _queue_job(name, args, unique_key, replace, run_at):
+    queued = Job.objects.filter(unique_key=unique_key, status=Job.QUEUED)
+    if unique_key:
+        if replace and queued.update(args=args, run_at=run_at):
+            return None
+        # 合并到已有任务时保留较早的执行时间
+        if not replace and (queued.filter(run_at__gt=run_at).update(run_at=run_at) or queued.exists()):
+            return None
+    try:
+        with transaction.atomic():
+            return Job.objects.create(
+                name=name, args=args, unique_key=unique_key, run_at=run_at,
+                max_attempts=registry[name].max_attempts,
+            )
+    except IntegrityError:
+        # 并发的请求先写入了同一个键的任务
+        if replace:
+            queued.update(args=args, run_at=run_at)
+        return None
+
+
+def enqueue(name, *args, unique_key='', replace=False, delay=None):
+    """
+    把任务加入队列, 由 run_jobs 工作进程在后台执行
+
+    在事务中调用时随事务一起提交。settings.JOBS_EAGER 为 True 时, 以 eager=True 注册的任务
+    不入队, 而是在当前事务提交后直接执行 (此时忽略 unique_key 和 delay); 其他任务仍然入队。
+
+    Args:
+        name: 任务名, 也可以直接传入 @task 注册的函数
+        unique_key: 非空时同一个键最多只有一个排队中的任务, 已有时不再新建, 只把执行时间提前
+        replace: 与 unique_key 一起使用, 已有排队中的任务时用新的参数和执行时间覆盖它
+        delay: timedelta, 延迟执行的时间; 延迟期间的重复请求被合并
+
+    Returns:
+        新建的 Job; 被合并、或以 eager 模式执行时为 None
+    """
+    name = getattr(name, 'task_name', name)
+    if name not in registry:
+        raise KeyError(f'未注册的任务: {name}')
+    args = list(args)
+    if settings.JOBS_EAGER and registry[name].eager:
+        transaction.on_commit(lambda: _run_eager(name, args))
+        return None
+    run_at = timezone.now() + (delay or timedelta(0))
+    return _queue_job(name, args, unique_key, replace, run_at)
+
+
+def oldest_overdue_job(older_than=None):
+    """
+    返回到期超过 older_than (默认 JOBS_LOCK_TIMEOUT) 仍未被领取的最早任务
+
+    有这样的任务通常说明没有运行 run_jobs 工作进程
+    """
+    cutoff = timezone.now() - (older_than or settings.JOBS_LOCK_TIMEOUT)
+    return Job.objects.filter(status=Job.QUEUED, run_at__lt=cutoff).order_by('run_at', 'id').first()
+
+
+def _run_eager(name, args):
+    try:
+        registry[name].func(*args)
+    except Exception:
+        logger.exception(f"任务执行失败: {name}")
+
+
+class Worker:
+    """
+    任务执行器
+    在线程池中并发执行领取到的任务; 领取在一个写事务中完成,
+    多个工作进程共用一个数据库时不会领到同一个任务
+    """
+
+    def __init__(self, concurrency=None, poll_interval=None, worker_id=None):
+        self.concurrency = concurrency or settings.JOBS_WORKER_CONCURRENCY
+        self.poll_interval = poll_interval if poll_interval is not None else settings.JOBS_POLL_INTERVAL
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = threading.Event()
+        self.processed = 0
+        self.failed = 0
+        self._next_maintenance = 0
+
+    def claim(self):
+        """领取一个到期的任务, 跳过已达到并发上限的任务类型; 没有可执行的任务时返回 None"""
+        now = timezone.now()
+        with transaction.atomic():
+            running = dict(
+                Job.objects.filter(status=Job.RUNNING).values_list('name').annotate(count=Count('id')).order_by()
+            )
+            blocked = [
+                name for name, count in running.items()
+                if name in registry and registry[name].concurrency and count >= registry[name].concurrency
+            ]
+            job = (
+                Job.objects.filter(status=Job.QUEUED, run_at__lte=now)
+                .exclude(name__in=blocked).order_by('run_at', 'id').first()
+            )
+            if job is None:
+                return None
+            Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(
+                status=Job.RUNNING, locked_by=self.worker_id, locked_at=now, attempts=F('attempts') + 1,
+            )
+        job.refresh_from_db()
+        return job
+
+    def execute(self, job):
+        """执行一个已领取的任务并记录结果, 返回是否成功"""
+        close_old_connections()
+        try:
+            current = registry.get(job.name)
+            try:
+                if current is None:
+                    raise LookupError(f'未注册的任务: {job.name}')
+                started = time.perf_counter()
+                current.func(*job.args)
+            except Exception:
+                self.fail(job, current, traceback.format_exc())
+                return False
+            logger.info(f"任务完成: {job.name} #{job.pk}, 用时 {time.perf_counter() - started:.2f}s")
+            Job.objects.filter(pk=job.pk).delete()
+            self.reschedule_periodic(job)
+            return True
+        finally:
+            close_old_connections()
+
+    def fail(self, job, current, error):
+        logger.error(f"任务失败: {job.name} #{job.pk} 第 {job.attempts} 次: {error}")
+        if current is not None and job.attempts < job.max_attempts:
+            run_at = timezone.now() + current.retry_delay * 2 ** (job.attempts - 1)
+            requeue(job, run_at, error)
+            return
+        Job.objects.filter(pk=job.pk).update(status=Job.FAILED, last_error=error, locked_by='', locked_at=None)
+        self.reschedule_periodic(job)
+
+    def reschedule_periodic(self, job):
+        if job.unique_key.startswith(PERIODIC_KEY_PREFIX):
+            interval = settings.JOBS_PERIODIC.get(job.name)
+            if interval is not None:
+                _queue_job(job.name, [], job.unique_key, False, timezone.now() + interval)
+
+    def requeue_stale(self):
+        """把超过 JOBS_LOCK_TIMEOUT 仍未结束的任务 (工作进程异常退出) 重新排队"""
+        stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=timezone.now() - settings.JOBS_LOCK_TIMEOUT)
+        for job in stale:
+            logger.warning(f"任务超时, 重新排队: {job.name} #{job.pk}, 原执行者 {job.locked_by}")
+            if job.attempts < job.max_attempts:
+                requeue(job, timezone.now(), '执行超时')
+            else:
+                Job.objects.filter(pk=job.pk).update(status=Job.FAILED, last_error='执行超时')
+
+    def ensure_periodic(self):
+        """为 settings.JOBS_PERIODIC 中还没有排队的周期任务补上一个立即执行的任务"""
+        for name, interval in settings.JOBS_PERIODIC.items():
+            if name not in registry:
+                logger.warning(f"JOBS_PERIODIC 中的任务未注册: {name}")
+                continue
+            key = PERIODIC_KEY_PREFIX + name
+            if not Job.objects.filter(unique_key=key, status__in=[Job.QUEUED, Job.RUNNING]).exists():
+                _queue_job(name, [], key, False, timezone.now())
+
+    def maintain(self):
+        if time.monotonic() < self._next_maintenance:
+            return
+        self._next_maintenance = time.monotonic() + 60
+        self.requeue_stale()
+        self.ensure_periodic()
+
+    def run(self, once=False, max_jobs=None):
+        """
+        持续领取并执行任务, 直到 stop() 被调用
+
+        Args:
+            once: 为 True 时执行完当前所有到期的任务后返回
+            max_jobs: 执行这么多个任务后返回
+        """
+        running = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='job') as pool:
+            while not self.stopping.is_set():
+                self.maintain()
+                while len(running) < self.concurrency and (max_jobs is None or self.processed + len(running) < max_jobs):
+                    job = self.claim()
+                    if job is None:
+                        break
+                    running.add(pool.submit(self.execute, job))
+                if not running:
+                    if once or (max_jobs is not None and self.processed >= max_jobs):
+                        break
+                    self.stopping.wait(self.poll_interval)
+                    continue
+                done, running = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.processed += 1
+                    self.failed += not future.result()
+            # 收到停止信号后等正在执行的任务结束
+            for future in running:
+                self.processed += 1
+                self.failed += not future.result()
+
+    def stop(self):
+        self.stopping.set()
+
+
+def requeue(job, run_at, error):
+    """把任务放回队列; 同一个键已有排队中的任务时直接删除, 由排队中的任务代替它"""
+    try:
+        with transaction.atomic():
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.QUEUED, run_at=run_at, last_error=error, locked_by='', locked_at=None,
+            )
+    except IntegrityError:
+        Job.objects.filter(pk=job.pk).delete()
@@ -0,0 +1,193 @@
+import io
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import SystemCheckError
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from journal_data.models import JournalEntry
+from sync.models import SyncRecord
+from sync.snapshots import snapshot_path
+from users.models import User
+from .checks import check_worker_running
+from .models import Job
+from .queue import Worker, enqueue, oldest_overdue_job, task
+
+# 测试生成的快照写到临时目录, 不影响也不读取开发环境的快照
+SNAPSHOT_ROOT = tempfile.mkdtemp(prefix='journal-snapshots-')
+
+
+_job_calls = []
+_job_running = {'now': 0, 'max': 0}
+_job_lock = threading.Lock()
+
+
+@task(name='tests.record', retry_delay=timedelta(0))
+def record_job(value=None, fail_times=0):
+    _job_calls.append(value)
+    if _job_calls.count(value) <= fail_times:
+        raise RuntimeError(f'失败: {value}')
+
+
+def _track_concurrency():
+    with _job_lock:
+        _job_running['now'] += 1
+        _job_running['max'] = max(_job_running['max'], _job_running['now'])
+    time.sleep(0.05)
+    with _job_lock:
+        _job_running['now'] -= 1
+
+
+@task(name='tests.serial', concurrency=1)
+def serial_job():
+    _track_concurrency()
+
+
+@task(name='tests.parallel')
+def parallel_job():
+    _track_concurrency()
+
+
+@task(name='tests.bookkeeping', eager=True)
+def bookkeeping_job(value=None):
+    _job_calls.append(value)
+
+
+@override_settings(JOBS_PERIODIC={})
+class JobQueueTests(TransactionTestCase):
+    """后台任务队列: 合并, 重试, 并发上限, 超时重新排队和周期任务"""
+
+    def setUp(self):
+        _job_calls.clear()
+        _job_running.update(now=0, max=0)
+
+    def run_worker(self, **kwargs):
+        worker = Worker(poll_interval=0.01, **kwargs)
+        worker.run(once=True)
+        return worker
+
+    def test_enqueue_coalesces(self):
+        enqueue('tests.record', 'a', unique_key='k')
+        enqueue(record_job, 'b', unique_key='k')
+        self.assertEqual(list(Job.objects.values_list('args', flat=True)), [['a']])
+        enqueue('tests.record', 'c', unique_key='k', replace=True)
+        enqueue('tests.record', 'd')
+        self.assertEqual(sorted(Job.objects.values_list('args', flat=True)), [['c'], ['d']])
+        with self.assertRaises(KeyError):
+            enqueue('tests.missing')
+        # 延迟执行的任务到期前不会被领取
+        enqueue('tests.record', 'e', delay=timedelta(hours=1))
+        worker = self.run_worker()
+        self.assertEqual((sorted(_job_calls), worker.processed), (['c', 'd'], 2))
+        self.assertEqual(Job.objects.get().args, ['e'])
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager(self):
+        # 只有 eager=True 的任务在事务提交后直接执行, 其他任务仍然入队
+        with transaction.atomic():
+            self.assertIsNone(enqueue('tests.bookkeeping', 'now', unique_key='k'))
+            self.assertIsNotNone(enqueue('tests.record', 'later'))
+            self.assertEqual(_job_calls, [])
+        self.assertEqual(_job_calls, ['now'])
+        self.assertEqual(list(Job.objects.values_list('name', flat=True)), ['tests.record'])
+
+    def test_retries(self):
+        enqueue('tests.record', 'flaky', 2)
+        enqueue('tests.record', 'broken', 5)
+        worker = self.run_worker()
+        self.assertEqual(_job_calls.count('flaky'), 3)
+        self.assertEqual(_job_calls.count('broken'), 3)
+        self.assertEqual(worker.failed, 5)
+        failed = Job.objects.get()
+        self.assertEqual((failed.args, failed.status, failed.attempts), (['broken', 5], Job.FAILED, 3))
+        self.assertIn('RuntimeError', failed.last_error)
+
+    def test_concurrency_limit(self):
+        for _ in range(4):
+            enqueue('tests.serial')
+        self.run_worker(concurrency=4)
+        self.assertEqual(_job_running['max'], 1)
+        for _ in range(4):
+            enqueue('tests.parallel')
+        self.run_worker(concurrency=4)
+        self.assertGreater(_job_running['max'], 1)
+
+    @override_settings(JOBS_PERIODIC={'tests.record': timedelta(hours=1)})
+    def test_stale_and_periodic(self):
+        stale = Job.objects.create(
+            name='tests.record', args=['stale'], status=Job.RUNNING, attempts=1,
+            locked_by='gone:1', locked_at=datetime.now() - timedelta(hours=1),
+        )
+        self.run_worker()
+        self.assertIn('stale', _job_calls)
+        self.assertFalse(Job.objects.filter(pk=stale.pk).exists())
+        # 周期任务执行后按间隔排好下一次
+        self.assertEqual(_job_calls.count(None), 1)
+        periodic = Job.objects.get(unique_key='periodic:tests.record')
+        self.assertGreater(periodic.run_at, datetime.now() + timedelta(minutes=59))
+
+    @override_settings(JOURNAL_SNAPSHOT_ROOT=SNAPSHOT_ROOT)
+    def test_sync_bookkeeping(self):
+        user = User.objects.create_user(username='jobs', email='jobs@example.com', password='jobs-password')
+        client = APIClient()
+        client.force_authenticate(user)
+        JournalEntry.objects.create(user=user, date=datetime(2024, 1, 1), text='x')
+        for cursor in (0, 1):
+            response = client.get('/sync/pull/', {'cursor': cursor}, HTTP_X_DEVICE_ID='phone')
+            self.assertEqual(response.status_code, 200)
+        # 拉取不再同步写入同步记录, 同一设备的两次更新合并为一个任务
+        self.assertFalse(SyncRecord.objects.exists())
+        self.assertEqual(Job.objects.filter(name='sync.record_device_sync').count(), 1)
+        # 条目变更触发的快照重建延迟执行
+        rebuild = Job.objects.get(name='sync.rebuild_snapshot')
+        self.assertGreater(rebuild.run_at, datetime.now() + timedelta(seconds=10))
+        call_command('run_jobs', '--once', stdout=io.StringIO())
+        record = SyncRecord.objects.get(user=user, device_id='phone')
+        self.assertEqual((record.cursor, record.sync_status), (1, 2))
+        self.assertEqual(list(Job.objects.values_list('pk', flat=True)), [rebuild.pk])
+
+    @override_settings(JOURNAL_SNAPSHOT_ROOT=SNAPSHOT_ROOT)
+    def test_shipped_settings(self):
+        # 按发布的配置, 请求只入队, 快照和同步记录都不在请求中生成
+        user = User.objects.create_user(username='shipped', email='shipped@example.com', password='x')
+        client = APIClient()
+        client.force_authenticate(user)
+        for eager in (settings.JOBS_EAGER, True):
+            with self.subTest(eager=eager), override_settings(JOBS_EAGER=eager):
+                Job.objects.all().delete()
+                response = client.post('/journals/entries/', {'date': '2024-01-01T00:00:00', 'text': 'x'}, format='json')
+                self.assertEqual(response.status_code, 201, response.content)
+                self.assertEqual(client.get('/sync/pull/', {'cursor': 0}, HTTP_X_DEVICE_ID='phone').status_code, 200)
+                rebuild = Job.objects.get(name='sync.rebuild_snapshot')
+                self.assertGreater(rebuild.run_at, datetime.now() + timedelta(seconds=10))
+                self.assertFalse(snapshot_path(user.pk).exists())
+                # eager 模式只直接执行同步记录这类开销很小的任务
+                self.assertEqual(Job.objects.filter(name='sync.record_device_sync').exists(), not eager)
+                self.assertEqual(SyncRecord.objects.filter(user=user).exists(), eager)
+        self.assertFalse(settings.JOBS_EAGER)
+
+    def test_overdue_warning(self):
+        err = io.StringIO()
+        call_command('purge_tombstones', stdout=io.StringIO(), stderr=err)
+        self.assertEqual(err.getvalue(), '')
+        # 到期很久仍未被领取的任务说明没有运行工作进程
+        job = enqueue('tests.record', 'late')
+        Job.objects.filter(pk=job.pk).update(run_at=datetime.now() - timedelta(hours=1))
+        self.assertEqual(oldest_overdue_job(), Job.objects.get(pk=job.pk))
+        call_command('purge_tombstones', stdout=io.StringIO(), stderr=err)
+        self.assertIn('run_jobs', err.getvalue())
+
+        # 系统检查只在指定数据库时查询任务表
+        self.assertEqual(check_worker_running(None), [])
+        warnings = check_worker_running(None, databases=['default'])
+        self.assertEqual([warning.id for warning in warnings], ['jobs.W001'])
+        with self.assertRaises(SystemCheckError):
+            call_command('check', '--database', 'default', '--fail-level', 'WARNING', stdout=io.StringIO(), stderr=io.StringIO())
+        Job.objects.all().delete()
+        self.assertEqual(check_worker_running(None, databases=['default']), [])
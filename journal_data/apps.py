@@ -1,6 +1,28 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
+
+def restore_search_triggers(sender, using, **kwargs):
+    from .search import ensure_search_triggers
+
+    ensure_search_triggers(using)
+
+
+def install_search_functions(sender, connection, **kwargs):
+    from .search import register_search_functions
+
+    register_search_functions(connection)
 
 
 class JournalDataConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "journal_data"
+
+    def ready(self):
+        # 注册条目缓存的失效处理
+        from . import cache  # noqa: F401
+
+        post_migrate.connect(restore_search_triggers, sender=self)
+        # bigram 索引的触发器在每个连接上调用 Python 实现的分词函数
+        connection_created.connect(install_search_functions)
@@ -0,0 +1,82 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.dispatch import receiver
+
+from .serializers import entry_representation
+from .signals import entries_changed
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def entry_cache():
+    """返回条目缓存使用的缓存后端, 由 settings.JOURNAL_ENTRY_CACHE 指定 CACHES 中的别名"""
+    return caches[settings.JOURNAL_ENTRY_CACHE]
+
+
+def entry_cache_key(user_id, entry_id):
+    return f'entry:{user_id}:{entry_id}'
+
+
+def _record(hits, misses):
+    with _stats_lock:
+        _stats['hits'] += hits
+        _stats['misses'] += misses
+
+
+def cache_stats():
+    """返回本进程的条目缓存命中统计"""
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else None,
+    }
+
+
+def serialize_entries(entries):
+    """
+    序列化一组条目, 优先使用缓存中的序列化结果
+
+    缓存值为 (seq, 序列化结果), seq 与条目当前的 seq 一致时才算命中,
+    因此即使漏掉了失效通知也不会返回过期数据。未命中的条目用快速路径序列化并写回缓存。
+
+    Args:
+        entries: .values(*ENTRY_VALUE_FIELDS) 查询得到的条目字典列表
+
+    Returns:
+        与输入顺序一致的序列化结果列表
+    """
+    entries = list(entries)
+    if not entries:
+        return []
+    cache = entry_cache()
+    keys = [entry_cache_key(entry['user_id'], entry['id']) for entry in entries]
+    cached = cache.get_many(keys)
+
+    data = [None] * len(entries)
+    missing = []
+    for index, (key, entry) in enumerate(zip(keys, entries)):
+        value = cached.get(key)
+        if value is not None and value[0] == entry['seq']:
+            data[index] = value[1]
+        else:
+            missing.append(index)
+
+    if missing:
+        for index in missing:
+            data[index] = entry_representation(entries[index])
+        cache.set_many({keys[index]: (entries[index]['seq'], data[index]) for index in missing})
+
+    _record(len(entries) - len(missing), len(missing))
+    return data
+
+
+@receiver(entries_changed)
+def invalidate_changed_entries(sender, user_id, entry_ids=(), **kwargs):
+    if entry_ids:
+        entry_cache().delete_many([entry_cache_key(user_id, entry_id) for entry_id in entry_ids])
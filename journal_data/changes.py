@@ -0,0 +1,115 @@
+from collections import namedtuple
+
+from django.conf import settings
+
+from .models import EntrySequence, EntryTombstone, JournalEntry
+from .serializers import ENTRY_VALUE_FIELDS
+
+ChangeSet = namedtuple('ChangeSet', ['entries', 'deleted', 'cursor', 'has_more', 'reset'])
+ChangeSet.__doc__ = """
+增量拉取结果
+
+Attributes:
+    entries: 游标之后新建或修改过的条目字典 (ENTRY_VALUE_FIELDS), 按 seq 升序
+    deleted: 游标之后被删除的条目, 每项包含 id 和 uuid
+    cursor: 下一次拉取使用的游标
+    has_more: 是否还有未返回的变更
+    reset: 客户端游标早于已清理的墓碑, 需要丢弃本地数据按全量结果重建
+"""
+
+
+def parse_cursor(value):
+    """
+    解析客户端提交的同步游标
+
+    Args:
+        value: 查询参数中的游标字符串, 为空表示从头同步
+
+    Returns:
+        非负整数游标
+
+    Raises:
+        ValueError: 游标不是非负整数, 或超出 64 位整数范围
+    """
+    if value in (None, ''):
+        return 0
+    cursor = int(value)
+    if not 0 <= cursor < 2**63:
+        raise ValueError('cursor out of range')
+    return cursor
+
+
+def _change_querysets(user, cursor, limit):
+    entries = (
+        JournalEntry.objects.filter(user_id=user.pk, seq__gt=cursor)
+        .order_by('seq')
+        .values(*ENTRY_VALUE_FIELDS)[:limit + 1]
+    )
+    tombstones = (
+        EntryTombstone.objects.filter(user_id=user.pk, seq__gt=cursor)
+        .order_by('seq')
+        .values_list('seq', 'entry_id', 'entry_uuid')[:limit + 1]
+    )
+    return entries, tombstones
+
+
+def _merge_changes(entries, tombstones, cursor, limit, reset):
+    changes = [(entry['seq'], entry, None) for entry in entries]
+    changes += [(seq, None, {'id': entry_id, 'uuid': entry_uuid}) for seq, entry_id, entry_uuid in tombstones]
+    changes.sort(key=lambda change: change[0])
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    return ChangeSet(
+        entries=[change[1] for change in changes if change[1] is not None],
+        deleted=[change[2] for change in changes if change[1] is None],
+        cursor=changes[-1][0] if changes else cursor,
+        has_more=has_more,
+        reset=reset,
+    )
+
+
+def changes_since(user, cursor, limit=None):
+    """
+    获取用户在游标之后的变更, 包括修改过的条目和删除墓碑
+
+    两类变更都走 (user, seq) 索引并按 seq 合并, 代价只与变更条数相关。
+    如果游标之前的墓碑已被清理, 无法确定客户端漏掉了哪些删除, 此时从头返回并标记 reset。
+
+    Args:
+        user: 条目所属用户, 只用到 pk, 也可以是 TokenUser
+        cursor: 客户端上次同步得到的游标
+        limit: 单次最多返回的变更数, 默认取 settings.JOURNAL_SYNC_PULL_LIMIT
+
+    Returns:
+        ChangeSet
+    """
+    limit = limit or getattr(settings, 'JOURNAL_SYNC_PULL_LIMIT', 1000)
+
+    reset = False
+    if cursor:
+        purged_seq = EntrySequence.objects.filter(user_id=user.pk).values_list('purged_seq', flat=True).first()
+        if purged_seq and cursor < purged_seq:
+            cursor = 0
+            reset = True
+
+    entries, tombstones = _change_querysets(user, cursor, limit)
+    # 从头同步时客户端本地没有数据, 不需要墓碑
+    return _merge_changes(list(entries), list(tombstones) if cursor else [], cursor, limit, reset)
+
+
+async def achanges_since(user, cursor, limit=None):
+    """changes_since() 的异步版本, 使用异步 ORM 查询"""
+    limit = limit or getattr(settings, 'JOURNAL_SYNC_PULL_LIMIT', 1000)
+
+    reset = False
+    if cursor:
+        purged_seq = await EntrySequence.objects.filter(user_id=user.pk).values_list('purged_seq', flat=True).afirst()
+        if purged_seq and cursor < purged_seq:
+            cursor = 0
+            reset = True
+
+    entries, tombstones = _change_querysets(user, cursor, limit)
+    entries = [entry async for entry in entries]
+    tombstones = [tombstone async for tombstone in tombstones] if cursor else []
+    return _merge_changes(entries, tombstones, cursor, limit, reset)
@@ -0,0 +1,86 @@
+import hashlib
+from functools import wraps
+
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from journal_server.middleware import mark_compressible
+from .models import EntrySequence
+
+
+def _etag_for_version(request, version):
+    value, purged_seq = version or (0, 0)
+    key = f"{request.user.pk}:{value}:{purged_seq}:{request.get_full_path()}:{request.META.get('HTTP_ACCEPT', '')}"
+    return '"%s"' % hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def entries_etag(request):
+    """
+    根据用户的条目版本生成强 ETag
+
+    版本取自 EntrySequence: 任何条目写入或删除都会递增 value, 清理墓碑会改变 purged_seq。
+    同一版本下不同的查询参数 (游标、分页) 与 Accept 对应不同的响应, 一并计入摘要。
+    """
+    version = EntrySequence.objects.filter(user_id=request.user.pk).values_list("value", "purged_seq").first()
+    return _etag_for_version(request, version)
+
+
+async def aentries_etag(request):
+    """entries_etag() 的异步版本"""
+    version = await EntrySequence.objects.filter(user_id=request.user.pk).values_list("value", "purged_seq").afirst()
+    return _etag_for_version(request, version)
+
+
+def etag_matches(if_none_match, etag):
+    """按 If-None-Match 的弱比较规则判断 ETag 是否匹配"""
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    if "*" in etags:
+        return True
+    target = etag.removeprefix("W/")
+    return any(candidate.removeprefix("W/") == target for candidate in etags)
+
+
+def _finalize_conditional(response, etag):
+    if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+        response["ETag"] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+    if response.status_code == status.HTTP_304_NOT_MODIFIED:
+        # 对应的 200 响应是 JSON / NDJSON, 由压缩中间件按 Accept-Encoding 处理 ETag
+        mark_compressible(response)
+    return response
+
+
+def entries_condition(view_method):
+    """
+    为读取条目的 GET 方法加上条件请求支持
+
+    在查询任何条目之前计算 ETag, 与 If-None-Match 匹配时直接返回 304,
+    只需一次按用户的索引查询; 否则执行原方法并在响应上附加 ETag。
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        etag = entries_etag(request)
+        if etag_matches(request.META.get("HTTP_IF_NONE_MATCH"), etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = view_method(self, request, *args, **kwargs)
+        return _finalize_conditional(response, etag)
+    return wrapper
+
+
+def aentries_condition(view_method):
+    """entries_condition 的异步版本, 用于异步视图的 GET 方法"""
+    @wraps(view_method)
+    async def wrapper(self, request, *args, **kwargs):
+        etag = await aentries_etag(request)
+        if etag_matches(request.META.get("HTTP_IF_NONE_MATCH"), etag):
+            response = HttpResponseNotModified()
+        else:
+            response = await view_method(self, request, *args, **kwargs)
+        return _finalize_conditional(response, etag)
+    return wrapper
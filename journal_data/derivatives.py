@@ -0,0 +1,191 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.urls import reverse
+
+try:
+    from PIL import Image as PILImage
+    from PIL import ImageOps
+except ImportError:  # pragma: no cover
+    PILImage = ImageOps = None
+
+from .images import image_path, parse_images_json
+
+logger = logging.getLogger(__name__)
+
+# 工作进程处理多少张图片后重启, 限制 Pillow 解码大图时的内存碎片
+TASKS_PER_WORKER = 200
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def derivatives_available():
+    """是否可以生成缩略图, 需要安装 Pillow"""
+    return PILImage is not None
+
+
+def derivative_path(sha256, name):
+    """缩略图的缓存路径, 与原图一样按内容哈希寻址, 不同用户的相同图片共用"""
+    return Path(settings.JOURNAL_IMAGE_ROOT) / 'derivatives' / name / sha256[:2] / f'{sha256}.jpg'
+
+
+@lru_cache(maxsize=1)
+def _image_url_prefix():
+    return reverse('image-detail', args=['0' * 64])[:-65]
+
+
+def image_urls(sha256):
+    """图片原图和各尺寸缩略图的地址, 无需查询数据库"""
+    url = f'{_image_url_prefix()}{sha256}/'
+    return {'sha256': sha256, 'url': url, **{name: f'{url}{name}/' for name in settings.JOURNAL_IMAGE_DERIVATIVES}}
+
+
+def entry_images(images_json):
+    """条目 images_json 中以 sha256 引用的图片及其缩略图地址, 供列表和同步接口返回"""
+    return [image_urls(sha256) for sha256, source in parse_images_json(images_json) if sha256]
+
+
+def render_derivatives(source, targets, quality):
+    """
+    在工作进程中为一张图片生成缩略图
+
+    按从大到小的顺序缩放, 每个尺寸写入临时文件后原子地移动到位。只使用 Pillow 和文件路径,
+    不依赖 Django, 可以在独立的进程中执行。
+
+    Args:
+        source: 原图路径
+        targets: (缩略图路径, 最长边像素数) 列表
+        quality: JPEG 质量
+
+    Returns:
+        生成的缩略图数
+    """
+    targets = sorted(targets, key=lambda target: target[1], reverse=True)
+    with PILImage.open(source) as image:
+        # JPEG 可以直接按接近目标的比例解码, 大幅减少解码大图的时间和内存
+        image.draft('RGB', (targets[0][1], targets[0][1]))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        for path, max_edge in targets:
+            image.thumbnail((max_edge, max_edge), PILImage.Resampling.LANCZOS)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    image.save(f, 'JPEG', quality=quality, optimize=True, progressive=True)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+    return len(targets)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn 的工作进程不继承父进程的数据库连接和线程
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.JOURNAL_DERIVATIVE_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                max_tasks_per_child=TASKS_PER_WORKER,
+            )
+        return _executor
+
+
+def _reset_executor():
+    # 工作进程异常退出后进程池不可再用, 下次提交时重新创建
+    global _executor
+    with _executor_lock:
+        _executor = None
+
+
+def missing_derivatives(sha256):
+    """图片尚未生成的缩略图, 返回 (缩略图路径, 最长边像素数) 列表"""
+    return [
+        (str(path), max_edge)
+        for name, max_edge in settings.JOURNAL_IMAGE_DERIVATIVES.items()
+        if not (path := derivative_path(sha256, name)).exists()
+    ]
+
+
+def _submit(sha256):
+    targets = missing_derivatives(sha256)
+    if not targets:
+        return None
+    return _get_executor().submit(
+        render_derivatives, str(image_path(sha256)), targets, settings.JOURNAL_DERIVATIVE_QUALITY
+    )
+
+
+def render_missing_derivatives(sha256):
+    """
+    在进程池中为图片生成缺失的缩略图并等待完成
+
+    由后台任务 journal_data.generate_derivatives 调用, 进程池只在 run_jobs 工作进程中创建,
+    Web 进程不持有图片解码的进程和内存。
+
+    Returns:
+        生成的缩略图数
+    """
+    if not derivatives_available():
+        return 0
+    future = _submit(sha256)
+    if future is None:
+        return 0
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        _reset_executor()
+        raise
+
+
+def schedule_derivatives(sha256):
+    """
+    安排后台任务生成图片缺失的缩略图, 不阻塞请求
+
+    同一图片排队中的任务只保留一个; 未安装 Pillow 或缩略图都已存在时什么也不做。
+
+    Returns:
+        新建的 Job; 已在排队或没有需要生成的缩略图时为 None
+    """
+    # 进程池的工作进程导入本模块时 Django 尚未初始化, 任务队列在这里才导入
+    from jobs.queue import enqueue
+
+    if not derivatives_available() or not missing_derivatives(sha256):
+        return None
+    return enqueue('journal_data.generate_derivatives', sha256, unique_key=f'derivatives:{sha256}')
+
+
+def build_derivatives(hashes):
+    """
+    在进程池中为一组图片生成缺失的缩略图并等待完成, 供 build_derivatives 命令批量补齐
+
+    Returns:
+        (提交的图片数, 失败的图片数) 二元组
+    """
+    futures = {}
+    for sha256 in hashes:
+        future = _submit(sha256)
+        if future is not None:
+            futures[future] = sha256
+    wait(futures)
+    failed = 0
+    for future, sha256 in futures.items():
+        error = future.exception()
+        if error is not None:
+            failed += 1
+            logger.error(f"缩略图生成失败: sha256={sha256}: {error!r}")
+            if isinstance(error, BrokenProcessPool):
+                _reset_executor()
+    return len(futures), failed
@@ -0,0 +1,197 @@
+import math
+
+from django.db.models import Avg, Count
+from django.db.models.functions import Substr
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# 条目保存的 geohash 精度, 9 位约为 4.8m x 4.8m
+GEOHASH_PRECISION = 9
+
+# 覆盖一个视口最多使用的 geohash 单元数, 每个单元对应一次 (user, geohash) 索引范围查找
+MAX_COVER_CELLS = 16
+
+# 比任何 geohash 字符都大的字符, prefix 到 prefix + GEOHASH_UPPER_BOUND 即该前缀下的全部 geohash
+GEOHASH_UPPER_BOUND = '{'
+
+EARTH_RADIUS = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """
+    计算坐标的 geohash
+
+    Returns:
+        geohash 字符串; 坐标为空时返回空字符串
+    """
+    if latitude is None or longitude is None:
+        return ''
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                value = value * 2 + 1
+                lon_range[0] = mid
+            else:
+                value = value * 2
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                value = value * 2 + 1
+                lat_range[0] = mid
+            else:
+                value = value * 2
+                lat_range[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """返回指定精度下 geohash 单元的 (纬度跨度, 经度跨度), 单位为度"""
+    bits = 5 * precision
+    return 180 / 2 ** (bits // 2), 360 / 2 ** ((bits + 1) // 2)
+
+
+def split_antimeridian(south, west, north, east):
+    """west 大于 east 表示视口跨越 180 度经线, 拆成两个不跨越的矩形"""
+    if west <= east:
+        return [(south, west, north, east)]
+    return [(south, west, north, 180.0), (south, -180.0, north, east)]
+
+
+def _cell_range(low, high, origin, size, count):
+    first = min(int((low - origin) // size), count - 1)
+    last = min(int((high - origin) // size), count - 1)
+    return range(max(first, 0), max(last, 0) + 1)
+
+
+def covering_cells(boxes, max_cells=MAX_COVER_CELLS):
+    """
+    选择能用不超过 max_cells 个单元覆盖全部矩形的最高精度
+
+    Args:
+        boxes: (south, west, north, east) 矩形列表, 均不跨越 180 度经线
+
+    Returns:
+        (precision, cells) 二元组, cells 为 (geohash 前缀, 所属矩形) 列表
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = geohash_cell_size(precision)
+        lat_count, lon_count = round(180 / height), round(360 / width)
+        spans = [
+            (box, _cell_range(box[0], box[2], -90, height, lat_count), _cell_range(box[1], box[3], -180, width, lon_count))
+            for box in boxes
+        ]
+        if sum(len(lats) * len(lons) for box, lats, lons in spans) <= max_cells or precision == 1:
+            break
+
+    cells = {}
+    for box, lats, lons in spans:
+        for i in lats:
+            for j in lons:
+                prefix = encode_geohash(-90 + (i + 0.5) * height, -180 + (j + 0.5) * width, precision)
+                cells.setdefault(prefix, box)
+    return precision, list(cells.items())
+
+
+def radius_box(latitude, longitude, radius):
+    """包含以 (latitude, longitude) 为圆心、radius 米为半径的圆的矩形"""
+    lat_delta = radius / METERS_PER_DEGREE
+    south, north = max(latitude - lat_delta, -90.0), min(latitude + lat_delta, 90.0)
+    cos_lat = math.cos(math.radians(max(abs(south), abs(north))))
+    if cos_lat < 1e-9 or radius / (METERS_PER_DEGREE * cos_lat) >= 180:
+        return south, -180.0, north, 180.0
+    lon_delta = radius / (METERS_PER_DEGREE * cos_lat)
+    west = (longitude - lon_delta + 180) % 360 - 180
+    east = (longitude + lon_delta + 180) % 360 - 180
+    return south, west, north, east
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """两点间的球面距离, 单位为米"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _cell_querysets(queryset, cells):
+    for prefix, (south, west, north, east) in cells:
+        # geohash 范围走 (user, geohash) 索引, 经纬度条件再去掉单元中落在矩形外的条目
+        yield queryset.filter(
+            geohash__gte=prefix,
+            geohash__lt=prefix + GEOHASH_UPPER_BOUND,
+            latitude__gte=south,
+            latitude__lte=north,
+            longitude__gte=west,
+            longitude__lte=east,
+        )
+
+
+def _union(querysets):
+    first, *rest = querysets
+    # 每个单元单独一个 SELECT 再 UNION ALL, 保证每个单元都是一次索引范围查找,
+    # 不依赖查询优化器是否选择 OR 优化
+    return first.union(*rest, all=True) if rest else first
+
+
+def entries_in_boxes(queryset, boxes, limit):
+    """
+    查询落在矩形内的条目, 按 (date, id) 倒序返回至多 limit 条
+
+    Args:
+        queryset: 已按用户过滤的条目 values() 查询集, 需包含 date 和 id
+        boxes: (south, west, north, east) 矩形列表, 均不跨越 180 度经线
+
+    Returns:
+        queryset 对应的字典列表
+    """
+    precision, cells = covering_cells(boxes)
+    return list(_union(list(_cell_querysets(queryset, cells))).order_by('-date', '-id')[:limit])
+
+
+def entry_clusters(queryset, boxes, precision=None):
+    """
+    按 geohash 单元聚合矩形内的条目
+
+    Args:
+        queryset: 已按用户过滤的条目查询集
+        boxes: (south, west, north, east) 矩形列表, 均不跨越 180 度经线
+        precision: 聚合单元的 geohash 精度, 默认比覆盖视口的单元高一级 (每个覆盖单元最多分成 32 个聚合单元)
+
+    Returns:
+        列表, 每项包含 geohash, count 以及单元内条目的平均 latitude / longitude
+    """
+    cover_precision, cells = covering_cells(boxes)
+    precision = precision or cover_precision + 1
+    # 聚合单元不能比覆盖单元大, 否则同一个聚合单元会分散在多个子查询中
+    precision = min(max(precision, cover_precision), GEOHASH_PRECISION)
+    querysets = [
+        qs.annotate(cell=Substr('geohash', 1, precision))
+        .values('cell')
+        .annotate(count=Count('id'), avg_latitude=Avg('latitude'), avg_longitude=Avg('longitude'))
+        .order_by()
+        for qs in _cell_querysets(queryset, cells)
+    ]
+    return [
+        {
+            'geohash': row['cell'],
+            'count': row['count'],
+            'latitude': row['avg_latitude'],
+            'longitude': row['avg_longitude'],
+        }
+        for row in _union(querysets)
+    ]
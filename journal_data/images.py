@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# images_json 中对象形式的引用可能使用的键
+HASH_KEYS = ('sha256', 'hash')
+SOURCE_KEYS = ('url', 'path', 'uri', 'name')
+
+# 上传时每次从请求体读取的字节数
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class ImageUploadError(Exception):
+    """
+    图片上传失败
+    status 为应返回的 HTTP 状态码, 此时不会保存任何数据
+    """
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def is_sha256(value):
+    return isinstance(value, str) and bool(SHA256_PATTERN.match(value))
+
+
+def _parse_reference(item):
+    if isinstance(item, str):
+        value = item.strip()
+        return (value.lower(), '') if is_sha256(value.lower()) else ('', value)
+    if isinstance(item, dict):
+        sha256 = next((str(item[key]).lower() for key in HASH_KEYS if item.get(key)), '')
+        source = next((str(item[key]) for key in SOURCE_KEYS if item.get(key)), '')
+        return (sha256 if is_sha256(sha256) else '', source)
+    return '', ''
+
+
+def parse_images_json(value):
+    """
+    解析条目的 images_json, 提取其中的图片引用
+
+    images_json 是客户端自由填写的文本, 支持以下形式:
+    字符串列表 (sha256 或图片地址), 对象列表 (sha256 / hash 与 url / path / uri / name 键),
+    以及带 images 键的对象; 无法按 JSON 解析的非空文本整体视为一个图片地址。
+
+    Returns:
+        按出现顺序排列的 (sha256, source) 列表, 无法识别的项被跳过
+    """
+    if not value or not value.strip():
+        return []
+    try:
+        data = json.loads(value)
+    except ValueError:
+        return [('', value.strip())]
+    if isinstance(data, dict):
+        data = data.get('images', [data])
+    if not isinstance(data, list):
+        data = [data]
+    references = [_parse_reference(item) for item in data]
+    return [(sha256, source) for sha256, source in references if sha256 or source]
+
+
+def image_path(sha256):
+    """图片内容的存储路径, 按 sha256 寻址, 相同内容在磁盘上只保存一份"""
+    return Path(settings.JOURNAL_IMAGE_ROOT) / sha256[:2] / sha256
+
+
+def _move_into_store(tmp_path, sha256):
+    # 磁盘上已有相同内容 (例如其他用户上传过) 时直接丢弃临时文件
+    path = image_path(sha256)
+    if path.exists():
+        os.unlink(tmp_path)
+    else:
+        os.replace(tmp_path, path)
+
+
+def store_image(chunks, sha256, max_size=None):
+    """
+    边读边校验地保存图片内容
+
+    内容先写入临时文件并计算 sha256, 与客户端声明的一致后再原子地移动到位。
+
+    Args:
+        chunks: 产出 bytes 的可迭代对象
+        sha256: 客户端声明的内容哈希
+        max_size: 允许的最大字节数, 默认取 settings.JOURNAL_IMAGE_MAX_SIZE
+
+    Returns:
+        内容的字节数
+
+    Raises:
+        ImageUploadError: 内容为空、超过大小上限或哈希不一致
+    """
+    max_size = max_size or settings.JOURNAL_IMAGE_MAX_SIZE
+    path = image_path(sha256)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{sha256}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    raise ImageUploadError(f'图片超过 {max_size} 字节', status=413)
+                digest.update(chunk)
+                f.write(chunk)
+        if not size:
+            raise ImageUploadError('图片内容为空')
+        if digest.hexdigest() != sha256:
+            raise ImageUploadError('图片内容与 sha256 不一致')
+        _move_into_store(tmp_path, sha256)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return size
+
+
+def upload_part_path(session_id):
+    """分块上传会话的临时文件路径, 与图片存储在同一文件系统上, 提交时可以直接移动"""
+    return Path(settings.JOURNAL_IMAGE_ROOT) / 'uploads' / f'{session_id}.part'
+
+
+def write_chunk(path, offset, chunks, sha256, max_size):
+    """
+    把一个分块写入上传临时文件的 offset 处
+
+    边写边计算分块的 sha256, 不一致或超过 max_size 时把文件截断回 offset,
+    已接收的部分不受影响, 客户端可以从 offset 重传该分块。
+
+    Returns:
+        分块的字节数
+
+    Raises:
+        ImageUploadError: 临时文件短于 offset (status 409), 分块为空、过大或哈希不一致
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    with open(os.open(path, os.O_RDWR | os.O_CREAT, 0o600), 'r+b') as f:
+        if os.fstat(f.fileno()).st_size < offset:
+            raise ImageUploadError('已接收的数据不完整', status=409)
+        f.seek(offset)
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    raise ImageUploadError(f'分块超过 {max_size} 字节', status=413)
+                digest.update(chunk)
+                f.write(chunk)
+            if not size:
+                raise ImageUploadError('分块内容为空')
+            if digest.hexdigest() != sha256:
+                raise ImageUploadError('分块内容与 sha256 不一致')
+        except BaseException:
+            f.truncate(offset)
+            raise
+        # 丢弃此前失败的写入留在 offset + size 之后的数据
+        f.truncate(offset + size)
+    return size
+
+
+def file_sha256(path):
+    """流式计算文件的 sha256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def commit_upload(path, sha256):
+    """
+    校验上传完成的临时文件并移入图片存储
+
+    Raises:
+        ImageUploadError: 文件内容与 sha256 不一致, 此时临时文件被删除
+    """
+    if file_sha256(path) != sha256:
+        os.unlink(path)
+        raise ImageUploadError('图片内容与 sha256 不一致')
+    image_path(sha256).parent.mkdir(parents=True, exist_ok=True)
+    _move_into_store(path, sha256)
+
+
+def parse_byte_range(header, size):
+    """
+    解析 Range 请求头, 只支持单个字节区间
+
+    Returns:
+        (start, end) 闭区间; 没有 Range 头或为不支持的形式 (多区间等) 时为 None, 应返回完整内容
+
+    Raises:
+        ValueError: 区间无法满足, 应返回 416
+    """
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', header or '')
+    if not match or not any(match.groups()):
+        return None
+    start, end = match.groups()
+    if not start:
+        # bytes=-n 表示最后 n 个字节
+        length = int(end)
+        if not length:
+            raise ValueError('无效的区间')
+        return max(size - length, 0), size - 1
+    start = int(start)
+    if end and int(end) < start:
+        # 语法无效的区间按没有 Range 头处理
+        return None
+    if start >= size:
+        raise ValueError('区间超出文件范围')
+    return start, min(int(end), size - 1) if end else size - 1
+
+
+def iter_file_range(f, start, length):
+    """从已打开的文件中逐块读出 [start, start + length) 的内容, 读完后关闭文件"""
+    with f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(UPLOAD_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
@@ -0,0 +1,174 @@
+from django.conf import settings
+from django.db import transaction
+
+from .geo import encode_geohash
+from .models import EntryImage, EntrySequence, EntryTombstone, JournalEntry
+from .serializers import EntrySerializer
+from .signals import send_entries_changed
+
+# 可被客户端批量写入的字段
+WRITABLE_FIELDS = ['is_mark', 'date', 'text', 'location_name', 'latitude', 'longitude', 'images_json']
+
+
+class IngestValidationError(Exception):
+    """
+    批量写入校验失败
+    携带每个无效条目的下标和错误信息, 此时不会写入任何数据
+    """
+    def __init__(self, errors):
+        super().__init__('无效的条目数据')
+        self.errors = errors
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def parse_entry_id(value):
+    """客户端提交的条目 id: 整数或十进制数字字符串, 超出 64 位整数范围或无法解析时返回 None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, int) and 0 < value < 2**63:
+        return value
+    return None
+
+
+def bulk_write_entries(user, created=(), updated=(), deleted=(), update_fields=None, chunk_size=None):
+    """
+    在一个事务内批量写入一组条目变更
+
+    为所有变更一次性分配连续的变更序号, 新建条目按块 bulk_create, 修改条目按修改的字段
+    分组 bulk_update, 只写入各自修改过的字段, 不会用实例上的旧值覆盖其他字段;
+    删除条目一条语句删除并批量写入墓碑; 新建和 images_json 有修改的条目重建图片引用。
+
+    Args:
+        user: 条目所属用户
+        created: 尚未保存的 JournalEntry 实例列表
+        updated: 已修改字段的 JournalEntry 实例列表
+        deleted: 要删除的 JournalEntry 实例列表
+        update_fields: 与 updated 一一对应的修改字段列表, 为 None 时写入所有可写字段
+        chunk_size: 每个批量语句处理的条目数, 默认取 settings.JOURNAL_INGEST_CHUNK_SIZE
+
+    Returns:
+        本批分配到的 (首个序号, 最大序号), 没有任何变更时为 None
+    """
+    chunk_size = chunk_size or getattr(settings, 'JOURNAL_INGEST_CHUNK_SIZE', 500)
+    count = len(created) + len(updated) + len(deleted)
+    if not count:
+        return None
+
+    with transaction.atomic():
+        last_seq = EntrySequence.allocate(user.pk, count)
+        seq = last_seq - count
+        for entry in [*created, *updated]:
+            seq += 1
+            entry.seq = seq
+            entry.geohash = encode_geohash(entry.latitude, entry.longitude)
+
+        for chunk in _chunks(list(created), chunk_size):
+            JournalEntry.objects.bulk_create(chunk)
+        groups = {}
+        for index, entry in enumerate(updated):
+            fields = WRITABLE_FIELDS if update_fields is None else update_fields[index]
+            groups.setdefault(tuple(field for field in WRITABLE_FIELDS if field in fields), []).append(entry)
+        for fields, entries in groups.items():
+            extra = ['seq', 'geohash'] if {'latitude', 'longitude'} & set(fields) else ['seq']
+            JournalEntry.objects.bulk_update(entries, [*fields, *extra], batch_size=chunk_size)
+        for chunk in _chunks(list(created), chunk_size):
+            EntryImage.replace_for(chunk, created=True, batch_size=chunk_size)
+        images_changed = [
+            entries for fields, entries in groups.items() if 'images_json' in fields
+        ]
+        for chunk in _chunks([entry for entries in images_changed for entry in entries], chunk_size):
+            EntryImage.replace_for(chunk, batch_size=chunk_size)
+        if deleted:
+            tombstones = []
+            for entry in deleted:
+                seq += 1
+                tombstones.append(EntryTombstone(user=user, entry_id=entry.pk, entry_uuid=entry.uuid, seq=seq))
+            JournalEntry.objects.filter(pk__in=[entry.pk for entry in deleted]).delete(tombstones=False)
+            EntryTombstone.objects.bulk_create(tombstones, batch_size=chunk_size)
+
+        send_entries_changed(user.pk, [entry.pk for entry in [*created, *updated, *deleted]])
+
+    return last_seq - count + 1, last_seq
+
+
+def ingest_entries(user, entries_data, chunk_size=None):
+    """
+    批量校验并写入日记条目
+
+    在一个事务内读取要更新的条目并用 EntrySerializer 校验整批数据, 全部通过后按固定大小分块
+    执行 bulk_create / bulk_update。带有属于该用户的 id 的条目视为更新, 其余视为新建;
+    更新只写入客户端提交的字段。
+
+    Args:
+        user: 条目所属用户
+        entries_data: 客户端提交的条目字典列表
+        chunk_size: 每个批量语句处理的条目数, 默认取 settings.JOURNAL_INGEST_CHUNK_SIZE
+
+    Returns:
+        与输入顺序一致的结果列表, 每项包含 index, id 和 status (created / updated)
+
+    Raises:
+        IngestValidationError: 任一条目校验失败
+    """
+    chunk_size = chunk_size or getattr(settings, 'JOURNAL_INGEST_CHUNK_SIZE', 500)
+
+    errors = []
+    entry_ids = {}
+    for index, data in enumerate(entries_data):
+        if isinstance(data, dict) and data.get('id'):
+            entry_id = parse_entry_id(data['id'])
+            if entry_id is None:
+                errors.append({'index': index, 'errors': {'id': ['id 必须是整数']}})
+            else:
+                entry_ids[index] = entry_id
+    if errors:
+        raise IngestValidationError(errors)
+    with transaction.atomic():
+        # 在写事务内读取要更新的条目, 校验和写入都基于最新版本
+        existing = {}
+        if entry_ids:
+            existing = JournalEntry.objects.select_for_update().filter(user=user).in_bulk(set(entry_ids.values()))
+
+        plan = []
+        for index, data in enumerate(entries_data):
+            if not isinstance(data, dict):
+                errors.append({'index': index, 'errors': {'non_field_errors': ['条目必须是对象']}})
+                continue
+            instance = existing.get(entry_ids.get(index))
+            serializer = EntrySerializer(instance=instance, data=data)
+            if not serializer.is_valid():
+                errors.append({'index': index, 'errors': serializer.errors})
+                continue
+            plan.append((index, instance, serializer.validated_data))
+
+        if errors:
+            raise IngestValidationError(errors)
+
+        to_create = []
+        to_update = []
+        for index, instance, validated_data in plan:
+            if instance is None:
+                to_create.append((index, JournalEntry(user=user, **validated_data)))
+            else:
+                for field, value in validated_data.items():
+                    setattr(instance, field, value)
+                to_update.append((index, instance, list(validated_data)))
+
+        bulk_write_entries(
+            user,
+            created=[entry for _, entry in to_create],
+            updated=[entry for _, entry, _ in to_update],
+            update_fields=[fields for _, _, fields in to_update],
+            chunk_size=chunk_size,
+        )
+
+    results = [{'index': index, 'id': entry.pk, 'status': 'created'} for index, entry in to_create]
+    results += [{'index': index, 'id': entry.pk, 'status': 'updated'} for index, entry, _ in to_update]
+    results.sort(key=lambda item: item['index'])
+    return results
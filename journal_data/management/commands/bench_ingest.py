@@ -0,0 +1,51 @@
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+
+from jobs.models import Job
+from journal_data.ingest import ingest_entries
+from journal_data.models import JournalEntry
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        '比较逐条 save() (每条自动提交) 与 SyncDataView.post 的批量写入 (ingest_entries, 一个事务) 的吞吐量; '
+        '写入真实提交到库中, 计入提交耗时, 条目写到临时用户下, 测量结束后删除'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=2000, help='每种方式写入的条目数')
+        parser.add_argument('--chunk-size', type=int, default=None, help='批量写入每个语句的条目数')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        start = datetime(2000, 1, 1)
+        entries_data = [
+            {'date': (start + timedelta(minutes=i)).isoformat(), 'text': f'bench entry {i}', 'location_name': 'bench'}
+            for i in range(count)
+        ]
+
+        def save_each(user):
+            for data in entries_data:
+                JournalEntry(user=user, date=start, text=data['text'], location_name=data['location_name']).save()
+
+        def ingest(user):
+            ingest_entries(user, entries_data, chunk_size=options['chunk_size'])
+
+        for label, write in (('逐条 save()', save_each), ('批量写入', ingest)):
+            elapsed = self.measure(write)
+            self.stdout.write(f'{label}: {count} 条, {elapsed:.2f}s, {count / elapsed:.0f} 条/秒')
+
+    def measure(self, write):
+        user = User.objects.create(username=f'bench-ingest-{uuid.uuid4().hex[:8]}')
+        try:
+            started = time.perf_counter()
+            write(user)
+            return time.perf_counter() - started
+        finally:
+            # 删除用户时级联删除条目, 墓碑和序号; 条目变更排入的快照重建任务一并删除
+            Job.objects.filter(unique_key=f'snapshot:{user.pk}').delete()
+            user.delete()
@@ -0,0 +1,80 @@
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from journal_data.cache import entry_cache, serialize_entries
+from journal_data.models import JournalEntry
+from journal_data.serializers import ENTRY_VALUE_FIELDS, EntrySerializer, entry_representation
+from users.models import User
+
+
+class Rollback(Exception):
+    """测量结束后回滚, 不在库中留下测试用户和条目"""
+
+
+class Command(BaseCommand):
+    help = (
+        '按不同的条目数比较读取路径的序列化耗时: 模型实例 + EntrySerializer, .values() + entry_representation, '
+        '以及 serialize_entries 缓存未命中和命中; 在回滚的事务中生成条目'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='条目数')
+        parser.add_argument('--repeat', type=int, default=3, help='每项重复次数, 取最快的一次')
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            try:
+                with transaction.atomic():
+                    self.bench(size, options['repeat'])
+                    raise Rollback
+            except Rollback:
+                pass
+
+    def bench(self, size, repeat):
+        user = User.objects.create(username=f'bench-serialize-{uuid.uuid4().hex[:8]}')
+        start = datetime(2000, 1, 1)
+        sha = 'ab' * 32
+        JournalEntry.objects.bulk_create([
+            JournalEntry(
+                user=user, uuid=uuid.uuid4(), seq=i + 1, date=start + timedelta(minutes=i), text=f'bench entry {i} ' * 8,
+                is_mark=i % 5 == 0, location_name='bench' if i % 2 else '',
+                latitude=31.230416 if i % 2 else None, longitude=121.473701 if i % 2 else None,
+                images_json=f'["{sha}"]' if i % 3 == 0 else None,
+            )
+            for i in range(size)
+        ], batch_size=1000)
+        entries = JournalEntry.objects.filter(user=user).order_by('-date', '-id')
+
+        def model_serializer():
+            return EntrySerializer(list(entries), many=True).data
+
+        def fast_path():
+            return [entry_representation(row) for row in entries.values(*ENTRY_VALUE_FIELDS)]
+
+        def cache_miss():
+            entry_cache().clear()
+            return serialize_entries(entries.values(*ENTRY_VALUE_FIELDS))
+
+        def cache_hit():
+            return serialize_entries(entries.values(*ENTRY_VALUE_FIELDS))
+
+        results = []
+        for label, read in (
+            ('EntrySerializer', model_serializer),
+            ('values()', fast_path),
+            ('缓存未命中', cache_miss),
+            ('缓存命中', cache_hit),
+        ):
+            elapsed = min(self.measure(read) for _ in range(repeat))
+            results.append(f'{label} {elapsed:.3f}s')
+        entry_cache().clear()
+        self.stdout.write(f'{size} 条: ' + ', '.join(results))
+
+    def measure(self, read):
+        started = time.perf_counter()
+        read()
+        return time.perf_counter() - started
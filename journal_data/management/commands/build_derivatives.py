@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from journal_data.derivatives import build_derivatives, derivatives_available
+from journal_data.models import Image
+
+
+class Command(BaseCommand):
+    help = '为已上传的图片生成缺失的缩略图'
+
+    def handle(self, *args, **options):
+        if not derivatives_available():
+            raise CommandError('生成缩略图需要安装 Pillow')
+        started = time.perf_counter()
+        hashes = Image.objects.values_list('sha256', flat=True).distinct().iterator()
+        submitted, failed = build_derivatives(hashes)
+        self.stdout.write(self.style.SUCCESS(
+            f'已为 {submitted - failed} 张图片生成缩略图, 失败 {failed} 张, 用时 {time.perf_counter() - started:.2f}s'
+        ))
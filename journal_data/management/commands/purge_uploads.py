@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from journal_data.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = '清理长时间没有新分块的分块上传会话及其临时文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=float, default=None,
+            help='超过该小时数没有新分块的会话被清理, 默认取 settings.JOURNAL_UPLOAD_SESSION_TTL',
+        )
+
+    def handle(self, *args, **options):
+        max_age = settings.JOURNAL_UPLOAD_SESSION_TTL
+        if options['hours'] is not None:
+            max_age = timedelta(hours=options['hours'])
+        purged = UploadSession.purge_expired(max_age)
+        self.stdout.write(self.style.SUCCESS(f'已清理 {purged} 个上传会话'))
@@ -0,0 +1,75 @@
+# Generated by Django 5.1.3 on 2026-10-18 22:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def adopt_entry_table(apps, schema_editor):
+    """
+    接管已有的条目表。
+    早期版本的库里已经有 journal_data_journalentry (直接沿用) 或
+    users_journalentry (改名接管, 数据随表保留), 都没有时才新建。
+    """
+    JournalEntry = apps.get_model("journal_data", "JournalEntry")
+    LegacyEntry = apps.get_model("users", "JournalEntry")
+
+    tables = schema_editor.connection.introspection.table_names()
+    table = JournalEntry._meta.db_table
+    legacy_table = LegacyEntry._meta.db_table
+    if table in tables:
+        return
+    if legacy_table in tables:
+        schema_editor.alter_db_table(JournalEntry, legacy_table, table)
+    else:
+        schema_editor.create_model(JournalEntry)
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("users", "0006_remove_user_last_sync_time"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name="JournalEntry",
+                    fields=[
+                        (
+                            "id",
+                            models.BigAutoField(
+                                auto_created=True,
+                                primary_key=True,
+                                serialize=False,
+                                verbose_name="ID",
+                            ),
+                        ),
+                        ("is_mark", models.BooleanField(default=False)),
+                        ("date", models.DateTimeField()),
+                        ("text", models.TextField(blank=True, null=True)),
+                        (
+                            "location_name",
+                            models.CharField(blank=True, max_length=255, null=True),
+                        ),
+                        ("latitude", models.FloatField(blank=True, null=True)),
+                        ("longitude", models.FloatField(blank=True, null=True)),
+                        ("images_json", models.TextField(blank=True, null=True)),
+                        (
+                            "user",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                related_name="journal_entries",
+                                to=settings.AUTH_USER_MODEL,
+                            ),
+                        ),
+                    ],
+                ),
+            ],
+        ),
+        migrations.RunPython(adopt_entry_table, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.1.3 on 2026-10-18 22:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_entry_seq(apps, schema_editor):
+    """按 id 顺序为已有条目分配变更序号, 并初始化每个用户的序列值"""
+    JournalEntry = apps.get_model("journal_data", "JournalEntry")
+    EntrySequence = apps.get_model("journal_data", "EntrySequence")
+
+    user_ids = JournalEntry.objects.values_list("user_id", flat=True).distinct()
+    for user_id in user_ids:
+        entries = list(JournalEntry.objects.filter(user_id=user_id).order_by("id").only("id"))
+        for seq, entry in enumerate(entries, start=1):
+            entry.seq = seq
+        JournalEntry.objects.bulk_update(entries, ["seq"], batch_size=500)
+        EntrySequence.objects.create(user_id=user_id, value=len(entries))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("journal_data", "0001_initial"),
+        ("users", "0007_delete_journalentry"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EntrySequence",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("value", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="journalentry",
+            name="seq",
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="journalentry",
+            index=models.Index(fields=["user", "seq"], name="entry_user_seq_idx"),
+        ),
+        migrations.AddField(
+            model_name="entrysequence",
+            name="user",
+            field=models.OneToOneField(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="entry_sequence",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.RunPython(backfill_entry_seq, migrations.RunPython.noop),
+    ]
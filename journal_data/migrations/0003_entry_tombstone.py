@@ -0,0 +1,52 @@
+# Generated by Django 5.1.3 on 2026-10-18 22:19
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("journal_data", "0002_entry_seq"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="entrysequence",
+            name="purged_seq",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="EntryTombstone",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("entry_id", models.BigIntegerField()),
+                ("seq", models.BigIntegerField()),
+                ("deleted_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="entry_tombstones",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["user", "seq"], name="tombstone_user_seq_idx")
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.3 on 2026-10-18 22:40
+
+import uuid
+
+from django.db import migrations, models
+
+
+def fill_entry_uuid(apps, schema_editor):
+    """为已有条目逐条生成不同的 uuid"""
+    JournalEntry = apps.get_model("journal_data", "JournalEntry")
+    entries = list(JournalEntry.objects.filter(uuid__isnull=True).only("id"))
+    for entry in entries:
+        entry.uuid = uuid.uuid4()
+    JournalEntry.objects.bulk_update(entries, ["uuid"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("journal_data", "0003_entry_tombstone"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="entrytombstone",
+            name="entry_uuid",
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="journalentry",
+            name="uuid",
+            field=models.UUIDField(null=True),
+        ),
+        migrations.RunPython(fill_entry_uuid, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="journalentry",
+            name="uuid",
+            field=models.UUIDField(default=uuid.uuid4, unique=True),
+        ),
+    ]
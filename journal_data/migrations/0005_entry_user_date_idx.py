@@ -0,0 +1,21 @@
+# Generated by Django 5.1.3 on 2026-10-18 22:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("journal_data", "0004_entry_uuid"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="journalentry",
+            index=models.Index(
+                fields=["user", "-date", "-id"], name="entry_user_date_idx"
+            ),
+        ),
+    ]
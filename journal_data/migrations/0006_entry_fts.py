@@ -0,0 +1,59 @@
+from django.db import migrations
+
+# 迁移中固定一份建表和触发器 SQL, journal_data.search 之后的修改不会影响已有的迁移
+FTS_TABLE_SQL = """
+CREATE VIRTUAL TABLE journal_data_entry_fts USING fts5(
+    text,
+    location_name,
+    content='journal_data_journalentry',
+    content_rowid='id',
+    tokenize='trigram'
+)
+"""
+
+INSERT_TRIGGER_SQL = """
+CREATE TRIGGER journal_data_entry_fts_insert AFTER INSERT ON journal_data_journalentry BEGIN
+    INSERT INTO journal_data_entry_fts(rowid, text, location_name) VALUES (new.id, new.text, new.location_name);
+END
+"""
+
+DELETE_TRIGGER_SQL = """
+CREATE TRIGGER journal_data_entry_fts_delete AFTER DELETE ON journal_data_journalentry BEGIN
+    INSERT INTO journal_data_entry_fts(journal_data_entry_fts, rowid, text, location_name)
+    VALUES ('delete', old.id, old.text, old.location_name);
+END
+"""
+
+UPDATE_TRIGGER_SQL = """
+CREATE TRIGGER journal_data_entry_fts_update AFTER UPDATE OF text, location_name ON journal_data_journalentry BEGIN
+    INSERT INTO journal_data_entry_fts(journal_data_entry_fts, rowid, text, location_name)
+    VALUES ('delete', old.id, old.text, old.location_name);
+    INSERT INTO journal_data_entry_fts(rowid, text, location_name) VALUES (new.id, new.text, new.location_name);
+END
+"""
+
+CREATE_SQL = [
+    FTS_TABLE_SQL,
+    INSERT_TRIGGER_SQL,
+    DELETE_TRIGGER_SQL,
+    UPDATE_TRIGGER_SQL,
+    "INSERT INTO journal_data_entry_fts(journal_data_entry_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS journal_data_entry_fts_insert",
+    "DROP TRIGGER IF EXISTS journal_data_entry_fts_delete",
+    "DROP TRIGGER IF EXISTS journal_data_entry_fts_update",
+    "DROP TABLE IF EXISTS journal_data_entry_fts",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("journal_data", "0005_entry_user_date_idx"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SQL, DROP_SQL),
+    ]
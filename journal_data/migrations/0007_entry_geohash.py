@@ -0,0 +1,86 @@
+# Generated by Django 5.1.3 on 2026-10-18 22:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+# 迁移中固定一份 geohash 编码, journal_data.geo 之后的修改不会影响回填结果
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 9
+
+
+def encode_geohash(latitude, longitude):
+    """计算坐标的 9 位 geohash"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < GEOHASH_PRECISION:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                value = value * 2 + 1
+                lon_range[0] = mid
+            else:
+                value = value * 2
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                value = value * 2 + 1
+                lat_range[0] = mid
+            else:
+                value = value * 2
+                lat_range[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = value = 0
+    return "".join(chars)
+
+
+def backfill_entry_geohash(apps, schema_editor):
+    """为已有坐标的条目计算 geohash, 按 id 分批处理"""
+    JournalEntry = apps.get_model("journal_data", "JournalEntry")
+
+    entries = JournalEntry.objects.filter(
+        latitude__isnull=False, longitude__isnull=False
+    ).order_by("id")
+    last_id = 0
+    while True:
+        batch = list(
+            entries.filter(id__gt=last_id).only("id", "latitude", "longitude")[:1000]
+        )
+        if not batch:
+            break
+        for entry in batch:
+            entry.geohash = encode_geohash(entry.latitude, entry.longitude)
+        JournalEntry.objects.bulk_update(batch, ["geohash"])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("journal_data", "0006_entry_fts"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="journalentry",
+            name="geohash",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=12
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="journalentry",
+            index=models.Index(
+                fields=["user", "geohash"], name="entry_user_geohash_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_entry_geohash, migrations.RunPython.noop),
+    ]
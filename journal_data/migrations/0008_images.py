@@ -0,0 +1,177 @@
+# Generated by Django 5.1.3 on 2026-10-18 22:46
+
+import json
+import re
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+# 迁移中固定一份 images_json 解析逻辑, journal_data.images 之后的修改不会影响回填结果
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+HASH_KEYS = ("sha256", "hash")
+SOURCE_KEYS = ("url", "path", "uri", "name")
+
+
+def is_sha256(value):
+    return isinstance(value, str) and bool(SHA256_PATTERN.match(value))
+
+
+def parse_reference(item):
+    if isinstance(item, str):
+        value = item.strip()
+        return (value.lower(), "") if is_sha256(value.lower()) else ("", value)
+    if isinstance(item, dict):
+        sha256 = next(
+            (str(item[key]).lower() for key in HASH_KEYS if item.get(key)), ""
+        )
+        source = next((str(item[key]) for key in SOURCE_KEYS if item.get(key)), "")
+        return (sha256 if is_sha256(sha256) else "", source)
+    return "", ""
+
+
+def parse_images_json(value):
+    """解析 images_json, 返回按出现顺序排列的 (sha256, source) 列表"""
+    if not value or not value.strip():
+        return []
+    try:
+        data = json.loads(value)
+    except ValueError:
+        return [("", value.strip())]
+    if isinstance(data, dict):
+        data = data.get("images", [data])
+    if not isinstance(data, list):
+        data = [data]
+    references = [parse_reference(item) for item in data]
+    return [(sha256, source) for sha256, source in references if sha256 or source]
+
+
+def backfill_entry_images(apps, schema_editor):
+    """把已有条目的 images_json 解析为图片引用, 按 id 分批处理"""
+    JournalEntry = apps.get_model("journal_data", "JournalEntry")
+    EntryImage = apps.get_model("journal_data", "EntryImage")
+
+    entries = (
+        JournalEntry.objects.exclude(images_json__isnull=True)
+        .exclude(images_json="")
+        .order_by("id")
+    )
+    last_id = 0
+    while True:
+        batch = list(
+            entries.filter(id__gt=last_id).only("id", "user_id", "images_json")[:1000]
+        )
+        if not batch:
+            break
+        EntryImage.objects.bulk_create(
+            [
+                EntryImage(
+                    entry_id=entry.id,
+                    user_id=entry.user_id,
+                    position=position,
+                    sha256=sha256,
+                    source=source,
+                )
+                for entry in batch
+                for position, (sha256, source) in enumerate(
+                    parse_images_json(entry.images_json)
+                )
+            ]
+        )
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("journal_data", "0007_entry_geohash"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EntryImage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("position", models.PositiveIntegerField()),
+                ("sha256", models.CharField(blank=True, default="", max_length=64)),
+                ("source", models.TextField(blank=True, default="")),
+                (
+                    "entry",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="image_refs",
+                        to="journal_data.journalentry",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="entry_images",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "sha256"], name="entry_image_user_sha256_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("entry", "position"), name="entry_image_position_uniq"
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="Image",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sha256", models.CharField(max_length=64)),
+                ("size", models.BigIntegerField()),
+                (
+                    "content_type",
+                    models.CharField(
+                        default="application/octet-stream", max_length=100
+                    ),
+                ),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="images",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "sha256"), name="image_user_sha256_uniq"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_entry_images, migrations.RunPython.noop),
+    ]
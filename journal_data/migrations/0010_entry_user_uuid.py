@@ -0,0 +1,28 @@
+# Generated by Django 5.1.3 on 2026-10-19 00:20
+
+import uuid
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("journal_data", "0009_upload_session"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="journalentry",
+            name="uuid",
+            field=models.UUIDField(default=uuid.uuid4),
+        ),
+        migrations.AddConstraint(
+            model_name="journalentry",
+            constraint=models.UniqueConstraint(
+                fields=("user", "uuid"), name="entry_user_uuid_uniq"
+            ),
+        ),
+    ]
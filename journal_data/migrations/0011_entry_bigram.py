@@ -0,0 +1,89 @@
+import re
+
+from django.db import migrations
+
+# 迁移中固定一份 bigram 索引的建表, 触发器 SQL 和分词函数, journal_data.search 之后的修改不会影响已有的迁移
+BIGRAM_FUNCTION = "journal_cjk_bigrams"
+CJK_RUN = re.compile("[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+
+
+def cjk_bigrams(value):
+    """把文本中每段连续的中日韩文字拆成以空格分隔的双字词"""
+    if not value:
+        return None
+    return " ".join(
+        run[i : i + 2]
+        for run in CJK_RUN.findall(value)
+        for i in range(max(len(run) - 1, 1))
+    )
+
+
+BIGRAM_TABLE_SQL = """
+CREATE VIRTUAL TABLE journal_data_entry_bigram USING fts5(
+    text,
+    location_name,
+    tokenize='unicode61'
+)
+"""
+
+INSERT_TRIGGER_SQL = """
+CREATE TRIGGER journal_data_entry_bigram_insert AFTER INSERT ON journal_data_journalentry BEGIN
+    INSERT INTO journal_data_entry_bigram(rowid, text, location_name)
+    VALUES (new.id, journal_cjk_bigrams(new.text), journal_cjk_bigrams(new.location_name));
+END
+"""
+
+DELETE_TRIGGER_SQL = """
+CREATE TRIGGER journal_data_entry_bigram_delete AFTER DELETE ON journal_data_journalentry BEGIN
+    DELETE FROM journal_data_entry_bigram WHERE rowid = old.id;
+END
+"""
+
+UPDATE_TRIGGER_SQL = """
+CREATE TRIGGER journal_data_entry_bigram_update AFTER UPDATE OF text, location_name ON journal_data_journalentry BEGIN
+    UPDATE journal_data_entry_bigram
+    SET text = journal_cjk_bigrams(new.text), location_name = journal_cjk_bigrams(new.location_name)
+    WHERE rowid = new.id;
+END
+"""
+
+CREATE_SQL = [
+    BIGRAM_TABLE_SQL,
+    INSERT_TRIGGER_SQL,
+    DELETE_TRIGGER_SQL,
+    UPDATE_TRIGGER_SQL,
+    "INSERT INTO journal_data_entry_bigram(rowid, text, location_name) "
+    "SELECT id, journal_cjk_bigrams(text), journal_cjk_bigrams(location_name) FROM journal_data_journalentry",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS journal_data_entry_bigram_insert",
+    "DROP TRIGGER IF EXISTS journal_data_entry_bigram_delete",
+    "DROP TRIGGER IF EXISTS journal_data_entry_bigram_update",
+    "DROP TABLE IF EXISTS journal_data_entry_bigram",
+]
+
+
+def create_bigram_index(apps, schema_editor):
+    """建立中文双字词索引并按已有条目填充"""
+    connection = schema_editor.connection
+    connection.ensure_connection()
+    connection.connection.create_function(BIGRAM_FUNCTION, 1, cjk_bigrams, deterministic=True)
+    for sql in CREATE_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_bigram_index(apps, schema_editor):
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("journal_data", "0010_entry_user_uuid"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_bigram_index, drop_bigram_index),
+    ]
@@ -1,11 +1,84 @@
-from django.db import models
+import uuid
+from collections import defaultdict
+
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
 from users.models import User
 
+from .geo import encode_geohash
+from .images import parse_images_json, upload_part_path
+from .signals import send_entries_changed
+
+class EntrySequence(models.Model):
+    """
+    条目变更序列模型
+    每个用户一行, 每次写入日记条目都会递增, 为条目分配单调递增的变更序号
+    purged_seq 记录已清理墓碑的最大序号, 游标落后于它的客户端需要全量重新同步
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="entry_sequence")
+    value = models.BigIntegerField(default=0)
+    purged_seq = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id} - {self.value}"
+
+    @classmethod
+    def current(cls, user_id):
+        """返回用户当前的变更序号, 从未写入过时为 0"""
+        value = cls.objects.filter(user_id=user_id).values_list("value", flat=True).first()
+        return value or 0
+
+    @classmethod
+    async def acurrent(cls, user_id):
+        """current() 的异步版本"""
+        value = await cls.objects.filter(user_id=user_id).values_list("value", flat=True).afirst()
+        return value or 0
+
+    @classmethod
+    def allocate(cls, user_id, count=1):
+        """
+        为用户分配 count 个连续的变更序号
+
+        必须在事务内调用: 递增语句会一直持有写锁到事务提交,
+        保证序号的提交顺序与分配顺序一致。
+
+        Returns:
+            分配到的最大序号, 分配区间为 (返回值 - count, 返回值]
+        """
+        updated = cls.objects.filter(user_id=user_id).update(value=F("value") + count)
+        if not updated:
+            sequence, created = cls.objects.get_or_create(user_id=user_id, defaults={"value": count})
+            if not created:
+                cls.objects.filter(user_id=user_id).update(value=F("value") + count)
+        return cls.objects.filter(user_id=user_id).values_list("value", flat=True).get()
+
+
+class JournalEntryQuerySet(models.QuerySet):
+    def delete(self, tombstones=True):
+        """
+        删除条目, 默认为每个条目写入墓碑
+        管理后台的批量删除和 filter().delete() 同样能通过增量拉取下发给其他设备;
+        已自行分配序号并写入墓碑的调用方 (bulk_write_entries) 传 tombstones=False
+        """
+        with transaction.atomic():
+            if tombstones:
+                EntryTombstone.record(self.values_list("pk", "user_id", "uuid"))
+            return super().delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class JournalEntry(models.Model):
     """
     日记条目模型
     记录用户的日记内容及相关信息
+    uuid 为客户端生成的标识, 在同一用户内唯一, 推送变更时以 (user, uuid) 定位条目
+    seq 为服务端分配的变更序号, 每次写入都会更新, 用于增量同步
+    geohash 由经纬度计算, 供地图视口和附近条目查询走索引
     """
+    uuid = models.UUIDField(default=uuid.uuid4)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="journal_entries")
     is_mark = models.BooleanField(default=False)
     date = models.DateTimeField()
@@ -14,7 +87,197 @@ class JournalEntry(models.Model):
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
     images_json = models.TextField(blank=True, null=True)
+    seq = models.BigIntegerField(default=0, editable=False)
+    geohash = models.CharField(max_length=12, blank=True, default="", editable=False)
+
+    objects = JournalEntryQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # 按用户限定唯一, 其他用户的 uuid 不影响推送, 也无法借推送探测
+            models.UniqueConstraint(fields=["user", "uuid"], name="entry_user_uuid_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "seq"], name="entry_user_seq_idx"),
+            # 列表、分页和全量同步都按用户过滤后以 (date, id) 倒序读取
+            models.Index(fields=["user", "-date", "-id"], name="entry_user_date_idx"),
+            models.Index(fields=["user", "geohash"], name="entry_user_geohash_idx"),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.date.strftime('%Y-%m-%d')}"
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = [*update_fields, *{"seq", "geohash"}.difference(update_fields)]
+        self.geohash = encode_geohash(self.latitude, self.longitude)
+        with transaction.atomic():
+            self.seq = EntrySequence.allocate(self.user_id)
+            super().save(*args, **kwargs)
+            if update_fields is None or "images_json" in update_fields:
+                EntryImage.replace_for([self])
+            send_entries_changed(self.user_id, [self.pk])
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            EntryTombstone.record([(self.pk, self.user_id, self.uuid)])
+            return super().delete(*args, **kwargs)
+
+
+class EntryTombstone(models.Model):
+    """
+    条目删除记录 (墓碑)
+    删除条目时写入, 随增量拉取下发给其他设备, 所有设备的游标越过后即可清理
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="entry_tombstones")
+    entry_id = models.BigIntegerField()
+    entry_uuid = models.UUIDField(blank=True, null=True)
+    seq = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "seq"], name="tombstone_user_seq_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.entry_id} @ {self.seq}"
+
+    @classmethod
+    def record(cls, entries):
+        """
+        为即将删除的条目写入墓碑, 必须在删除条目的同一事务内调用
+
+        Args:
+            entries: (pk, user_id, uuid) 的可迭代对象, 每个用户一次分配一段连续序号
+        """
+        by_user = defaultdict(list)
+        for pk, user_id, entry_uuid in entries:
+            by_user[user_id].append((pk, entry_uuid))
+        tombstones = []
+        for user_id, deleted in by_user.items():
+            seq = EntrySequence.allocate(user_id, len(deleted)) - len(deleted)
+            for pk, entry_uuid in deleted:
+                seq += 1
+                tombstones.append(cls(user_id=user_id, entry_id=pk, entry_uuid=entry_uuid, seq=seq))
+            send_entries_changed(user_id, [pk for pk, _ in deleted])
+        cls.objects.bulk_create(tombstones, batch_size=500)
+
+
+class Image(models.Model):
+    """
+    图片模型
+    按内容的 sha256 寻址, 同一用户相同内容的图片只保存一份;
+    内容文件按 sha256 存放在 JOURNAL_IMAGE_ROOT 下, 不同用户的相同内容共用一个文件
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="images")
+    sha256 = models.CharField(max_length=64)
+    size = models.BigIntegerField()
+    content_type = models.CharField(max_length=100, default="application/octet-stream")
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "sha256"], name="image_user_sha256_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.sha256}"
+
+
+class EntryImage(models.Model):
+    """
+    条目的图片引用
+    由条目的 images_json 解析而来, 每张图片一行, position 为在条目中的顺序;
+    sha256 引用对应的 Image, 客户端可以先同步条目、稍后再上传图片内容,
+    source 保留 images_json 中的原始地址 (旧数据没有 sha256 时只有它)
+    """
+    entry = models.ForeignKey(JournalEntry, on_delete=models.CASCADE, related_name="image_refs")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="entry_images")
+    position = models.PositiveIntegerField()
+    sha256 = models.CharField(max_length=64, blank=True, default="")
+    source = models.TextField(blank=True, default="")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["entry", "position"], name="entry_image_position_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "sha256"], name="entry_image_user_sha256_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.entry_id} #{self.position} - {self.sha256 or self.source}"
+
+    @classmethod
+    def build_for(cls, entry):
+        """按条目当前的 images_json 生成 (未保存的) 图片引用"""
+        return [
+            cls(entry_id=entry.pk, user_id=entry.user_id, position=position, sha256=sha256, source=source)
+            for position, (sha256, source) in enumerate(parse_images_json(entry.images_json))
+        ]
+
+    @classmethod
+    def replace_for(cls, entries, created=False, batch_size=None):
+        """
+        按 images_json 重建一组条目的图片引用
+
+        Args:
+            entries: 已保存的 JournalEntry 实例列表
+            created: 条目均为新建时为 True, 省去删除旧引用的语句
+        """
+        if not created:
+            cls.objects.filter(entry_id__in=[entry.pk for entry in entries]).delete()
+        refs = [ref for entry in entries for ref in cls.build_for(entry)]
+        if refs:
+            cls.objects.bulk_create(refs, batch_size=batch_size)
+
+
+class UploadSession(models.Model):
+    """
+    分块上传会话
+    客户端声明图片的 sha256 和大小后按偏移逐块上传, received 为已确认接收的字节数,
+    中断后查询会话即可从 received 处续传; 全部接收并提交后内容移入图片存储, 会话删除
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="upload_sessions")
+    sha256 = models.CharField(max_length=64)
+    size = models.BigIntegerField()
+    content_type = models.CharField(max_length=100, default="application/octet-stream")
+    received = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "sha256"], name="upload_user_sha256_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["updated_at"], name="upload_updated_at_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.sha256} {self.received}/{self.size}"
+
+    @property
+    def part_path(self):
+        return upload_part_path(self.pk)
+
+    def discard(self):
+        """删除会话及其临时文件"""
+        self.part_path.unlink(missing_ok=True)
+        self.delete()
+
+    @classmethod
+    def purge_expired(cls, max_age):
+        """
+        清理超过 max_age 没有新分块的会话
+
+        Returns:
+            清理的会话数
+        """
+        expired = list(cls.objects.filter(updated_at__lt=timezone.now() - max_age))
+        for session in expired:
+            session.discard()
+        return len(expired)
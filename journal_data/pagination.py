@@ -0,0 +1,115 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class EntryCursorPagination(BasePagination):
+    """
+    日记条目游标分页器
+
+    以 (date, id) 作为 keyset 向后翻页, 游标对客户端不透明。
+    每一页都是一次基于索引的范围查询, 翻到多深代价都与首页相同。
+
+    Attributes:
+        page_size: 默认每页条数, 取自 settings.JOURNAL_ENTRY_PAGE_SIZE
+        page_size_query_param: 客户端指定每页条数的查询参数
+        max_page_size: 客户端可指定的最大每页条数
+        cursor_query_param: 游标查询参数
+    """
+    page_size = getattr(settings, 'JOURNAL_ENTRY_PAGE_SIZE', 50)
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = '无效的游标'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self._set_page(list(self._page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        """paginate_queryset() 的异步版本, 使用异步 ORM 查询"""
+        return self._set_page([row async for row in self._page_queryset(queryset, request)])
+
+    def _page_queryset(self, queryset, request):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            date, pk = position
+            # date__lte 给出索引范围的上界, OR 条件只在边界上再过滤一次
+            queryset = queryset.filter(Q(date__lt=date) | Q(id__lt=pk), date__lte=date)
+
+        # 多取一条用于判断是否还有下一页
+        return queryset.order_by('-date', '-id')[:self.page_size + 1]
+
+    def _set_page(self, results):
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8')
+            date_str, pk_str = raw.rsplit('|', 1)
+            date = parse_datetime(date_str)
+            pk = int(pk_str)
+        except (TypeError, ValueError, UnicodeError):
+            raise ParseError(self.invalid_cursor_message)
+        # 超出 SQLite 整数范围的 id 会在查询时报错, 同样视为无效游标
+        if date is None or not -2**63 <= pk < 2**63:
+            raise ParseError(self.invalid_cursor_message)
+        return date, pk
+
+    def encode_cursor(self, entry):
+        if isinstance(entry, dict):
+            date, pk = entry['date'], entry['id']
+        else:
+            date, pk = entry.date, entry.pk
+        raw = f"{date.isoformat()}|{pk}"
+        encoded = urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_paginated_data(self, data):
+        return OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ])
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
@@ -0,0 +1,336 @@
+import html
+import re
+
+from django.db import connection, connections
+from django.db.models import Q
+
+from .models import JournalEntry
+from .serializers import ENTRY_VALUE_FIELDS, entry_representation
+
+FTS_TABLE = 'journal_data_entry_fts'
+
+# 以条目表为外部内容表的 FTS5 索引, trigram 分词可以按子串匹配中文
+FTS_TABLE_SQL = f"""
+CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+    text,
+    location_name,
+    content='journal_data_journalentry',
+    content_rowid='id',
+    tokenize='trigram'
+)
+"""
+
+# 由触发器同步索引, bulk_create / bulk_update / 查询集删除等绕过模型信号的写入也会被索引
+SEARCH_TRIGGERS = {
+    f'{FTS_TABLE}_insert': f"""
+CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON journal_data_journalentry BEGIN
+    INSERT INTO {FTS_TABLE}(rowid, text, location_name) VALUES (new.id, new.text, new.location_name);
+END
+""",
+    f'{FTS_TABLE}_delete': f"""
+CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON journal_data_journalentry BEGIN
+    INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text, location_name)
+    VALUES ('delete', old.id, old.text, old.location_name);
+END
+""",
+    f'{FTS_TABLE}_update': f"""
+CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF text, location_name ON journal_data_journalentry BEGIN
+    INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text, location_name)
+    VALUES ('delete', old.id, old.text, old.location_name);
+    INSERT INTO {FTS_TABLE}(rowid, text, location_name) VALUES (new.id, new.text, new.location_name);
+END
+""",
+}
+
+# trigram 分词只能匹配不少于 3 个字符的子串; 中文双字词走下面的 bigram 索引, 其余更短的词改用 LIKE 过滤
+TRIGRAM_MIN_LENGTH = 3
+
+BIGRAM_TABLE = 'journal_data_entry_bigram'
+# 条目中每段连续的中日韩文字拆成相邻的双字词, 以空格分隔存入 bigram 索引,
+# unicode61 分词把每个双字词作为一个词元, 双字关键词可以直接按词元查找
+BIGRAM_FUNCTION = 'journal_cjk_bigrams'
+CJK_RUN = re.compile('[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+')
+
+BIGRAM_TABLE_SQL = f"""
+CREATE VIRTUAL TABLE {BIGRAM_TABLE} USING fts5(
+    text,
+    location_name,
+    tokenize='unicode61'
+)
+"""
+
+# 与 trigram 索引由同样的触发器维护, 触发器调用的 journal_cjk_bigrams 在每个数据库连接上注册
+BIGRAM_TRIGGERS = {
+    f'{BIGRAM_TABLE}_insert': f"""
+CREATE TRIGGER {BIGRAM_TABLE}_insert AFTER INSERT ON journal_data_journalentry BEGIN
+    INSERT INTO {BIGRAM_TABLE}(rowid, text, location_name)
+    VALUES (new.id, {BIGRAM_FUNCTION}(new.text), {BIGRAM_FUNCTION}(new.location_name));
+END
+""",
+    f'{BIGRAM_TABLE}_delete': f"""
+CREATE TRIGGER {BIGRAM_TABLE}_delete AFTER DELETE ON journal_data_journalentry BEGIN
+    DELETE FROM {BIGRAM_TABLE} WHERE rowid = old.id;
+END
+""",
+    f'{BIGRAM_TABLE}_update': f"""
+CREATE TRIGGER {BIGRAM_TABLE}_update AFTER UPDATE OF text, location_name ON journal_data_journalentry BEGIN
+    UPDATE {BIGRAM_TABLE}
+    SET text = {BIGRAM_FUNCTION}(new.text), location_name = {BIGRAM_FUNCTION}(new.location_name)
+    WHERE rowid = new.id;
+END
+""",
+}
+
+# bm25 中 text 与 location_name 两列的权重
+BM25_WEIGHTS = (2.0, 1.0)
+
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_END = '</mark>'
+# 生成摘要时先用控制字符标记命中位置, 整体转义 HTML 后再替换为高亮标签,
+# 条目内容中的 HTML 不会原样进入摘要
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+SNIPPET_ELLIPSIS = '…'
+# 摘要长度, trigram 分词下约等于字符数
+SNIPPET_LENGTH = 32
+
+# 单次搜索最多使用的关键词数
+MAX_TERMS = 8
+
+
+def cjk_bigrams(value):
+    """把文本中每段连续的中日韩文字拆成以空格分隔的双字词, 只有一个字的段原样保留"""
+    if not value:
+        return None
+    return ' '.join(
+        run[i:i + 2]
+        for run in CJK_RUN.findall(value)
+        for i in range(max(len(run) - 1, 1))
+    )
+
+
+def register_search_functions(connection):
+    """在 SQLite 连接上注册 bigram 索引触发器使用的函数"""
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function(BIGRAM_FUNCTION, 1, cjk_bigrams, deterministic=True)
+
+
+def is_bigram_term(term):
+    return len(term) == 2 and CJK_RUN.fullmatch(term) is not None
+
+
+def parse_search_query(query):
+    """
+    把用户输入按空白拆成关键词, 所有关键词都必须出现 (AND)
+
+    Returns:
+        (fts_terms, bigram_terms, short_terms) 三元组, 分别为可以走 trigram 索引的关键词,
+        可以走 bigram 索引的中文双字词和需要 LIKE 过滤的其他短关键词
+    """
+    terms = list(dict.fromkeys(query.split()))[:MAX_TERMS]
+    fts_terms = [term for term in terms if len(term) >= TRIGRAM_MIN_LENGTH]
+    bigram_terms = [term for term in terms if len(term) < TRIGRAM_MIN_LENGTH and is_bigram_term(term)]
+    short_terms = [term for term in terms if len(term) < TRIGRAM_MIN_LENGTH and not is_bigram_term(term)]
+    return fts_terms, bigram_terms, short_terms
+
+
+def _fts_phrase(term):
+    # 每个关键词作为短语引用, 用户输入中的 FTS5 语法字符不会被解释
+    return '"%s"' % term.replace('"', '""')
+
+
+def _like_pattern(term):
+    return '%%%s%%' % re.sub(r'([\\%_])', r'\\\1', term)
+
+
+def _fts_query(terms):
+    return ' '.join(_fts_phrase(term) for term in terms)
+
+
+def _fts_hits(user, fts_terms, bigram_terms, short_terms, limit, offset):
+    sql = [
+        f'SELECT e.id, bm25({FTS_TABLE}, %s, %s) AS score, snippet({FTS_TABLE}, -1, %s, %s, %s, %s)',
+        f'FROM {FTS_TABLE} JOIN journal_data_journalentry AS e ON e.id = {FTS_TABLE}.rowid',
+        f'WHERE {FTS_TABLE} MATCH %s AND e.user_id = %s',
+    ]
+    params = [
+        *BM25_WEIGHTS, MATCH_START, MATCH_END, SNIPPET_ELLIPSIS, SNIPPET_LENGTH,
+        _fts_query(fts_terms), user.pk,
+    ]
+    if bigram_terms:
+        sql.append(f'AND e.id IN (SELECT rowid FROM {BIGRAM_TABLE} WHERE {BIGRAM_TABLE} MATCH %s)')
+        params.append(_fts_query(bigram_terms))
+    for term in short_terms:
+        sql.append("AND (e.text LIKE %s ESCAPE '\\' OR e.location_name LIKE %s ESCAPE '\\')")
+        params += [_like_pattern(term)] * 2
+    sql.append('ORDER BY score, e.id DESC LIMIT %s OFFSET %s')
+    params += [limit, offset]
+
+    with connection.cursor() as cursor:
+        cursor.execute('\n'.join(sql), params)
+        ranked = cursor.fetchall()
+
+    rows = JournalEntry.objects.filter(id__in=[entry_id for entry_id, rank, snippet in ranked]).values(*ENTRY_VALUE_FIELDS)
+    rows = {row['id']: row for row in rows}
+    return [
+        {'entry': entry_representation(rows[entry_id]), 'snippet': render_snippet(snippet), 'rank': rank}
+        for entry_id, rank, snippet in ranked
+        if entry_id in rows
+    ]
+
+
+def render_snippet(snippet):
+    """转义摘要中的 HTML, 再把命中标记替换为高亮标签"""
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(MATCH_START, HIGHLIGHT_START).replace(MATCH_END, HIGHLIGHT_END)
+
+
+def highlight_snippet(text, terms):
+    """为没有走 FTS 索引的结果生成与 FTS5 snippet() 格式相同的摘要"""
+    lowered = text.lower()
+    positions = [lowered.find(term.lower()) for term in terms]
+    positions = [position for position in positions if position >= 0]
+    if not positions:
+        return None
+    start = max(min(positions) - SNIPPET_LENGTH // 4, 0)
+    end = start + SNIPPET_LENGTH
+    pattern = '|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    snippet = re.sub(f'({pattern})', rf'{MATCH_START}\1{MATCH_END}', text[start:end], flags=re.IGNORECASE)
+    return render_snippet((SNIPPET_ELLIPSIS if start > 0 else '') + snippet + (SNIPPET_ELLIPSIS if end < len(text) else ''))
+
+
+def _bigram_hits(user, bigram_terms, short_terms, limit, offset):
+    sql = [
+        f'SELECT e.id, bm25({BIGRAM_TABLE}, %s, %s) AS score',
+        f'FROM {BIGRAM_TABLE} JOIN journal_data_journalentry AS e ON e.id = {BIGRAM_TABLE}.rowid',
+        f'WHERE {BIGRAM_TABLE} MATCH %s AND e.user_id = %s',
+    ]
+    params = [*BM25_WEIGHTS, _fts_query(bigram_terms), user.pk]
+    for term in short_terms:
+        sql.append("AND (e.text LIKE %s ESCAPE '\\' OR e.location_name LIKE %s ESCAPE '\\')")
+        params += [_like_pattern(term)] * 2
+    sql.append('ORDER BY score, e.id DESC LIMIT %s OFFSET %s')
+    params += [limit, offset]
+
+    with connection.cursor() as cursor:
+        cursor.execute('\n'.join(sql), params)
+        ranked = cursor.fetchall()
+
+    # bigram 索引中存的是拆开的双字词, 摘要按条目原文生成
+    terms = bigram_terms + short_terms
+    rows = JournalEntry.objects.filter(id__in=[entry_id for entry_id, rank in ranked]).values(*ENTRY_VALUE_FIELDS)
+    rows = {row['id']: row for row in rows}
+    return [
+        {
+            'entry': entry_representation(rows[entry_id]),
+            'snippet': highlight_snippet(rows[entry_id]['text'] or '', terms)
+            or highlight_snippet(rows[entry_id]['location_name'] or '', terms),
+            'rank': rank,
+        }
+        for entry_id, rank in ranked
+        if entry_id in rows
+    ]
+
+
+def _like_hits(user, short_terms, limit, offset):
+    queryset = JournalEntry.objects.filter(user=user)
+    for term in short_terms:
+        queryset = queryset.filter(Q(text__icontains=term) | Q(location_name__icontains=term))
+    # 没有相关度可以排序, 按时间倒序返回
+    rows = queryset.order_by('-date', '-id').values(*ENTRY_VALUE_FIELDS)[offset:offset + limit]
+    return [
+        {
+            'entry': entry_representation(row),
+            'snippet': highlight_snippet(row['text'] or '', short_terms)
+            or highlight_snippet(row['location_name'] or '', short_terms),
+            'rank': None,
+        }
+        for row in rows
+    ]
+
+
+def search_entries(user, query, limit, offset=0):
+    """
+    在用户的日记中全文搜索
+
+    关键词都不短于 3 个字符时完全走 trigram 索引, 按 bm25 相关度排序;
+    中文双字词走 bigram 索引, 与长关键词同时出现时作为索引结果的过滤条件;
+    其他短关键词在索引结果上以 LIKE 过滤, 全部是这类短关键词时只能按用户扫描条目, 按日期倒序返回。
+
+    Args:
+        user: 搜索的用户
+        query: 搜索关键词, 以空白分隔, 结果需包含全部关键词
+        limit: 最多返回的结果数
+        offset: 跳过的结果数
+
+    Returns:
+        结果列表, 每项包含 entry (与 EntrySerializer 相同的表示), snippet (高亮摘要) 和 rank
+        (bm25 分数, 越小越相关; 没有走索引时为 None)
+    """
+    fts_terms, bigram_terms, short_terms = parse_search_query(query)
+    if fts_terms:
+        return _fts_hits(user, fts_terms, bigram_terms, short_terms, limit, offset)
+    if bigram_terms:
+        return _bigram_hits(user, bigram_terms, short_terms, limit, offset)
+    if short_terms:
+        return _like_hits(user, short_terms, limit, offset)
+    return []
+
+
+# 按条目表重新生成各个索引的语句
+REBUILD_SQL = {
+    FTS_TABLE: [f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"],
+    BIGRAM_TABLE: [
+        f'DELETE FROM {BIGRAM_TABLE}',
+        f'INSERT INTO {BIGRAM_TABLE}(rowid, text, location_name) '
+        f'SELECT id, {BIGRAM_FUNCTION}(text), {BIGRAM_FUNCTION}(location_name) FROM journal_data_journalentry',
+    ],
+}
+
+
+def rebuild_search_index(using='default', tables=None):
+    """按条目表重建全文索引, 默认重建 trigram 和 bigram 两个索引"""
+    with connections[using].cursor() as cursor:
+        for table in tables or REBUILD_SQL:
+            for sql in REBUILD_SQL[table]:
+                cursor.execute(sql)
+
+
+def ensure_search_triggers(using='default'):
+    """
+    补上缺失的索引触发器并重建索引
+
+    SQLite 上大部分修改条目表的迁移 (AddField, AlterField 等) 会重建整张表,
+    触发器随旧表一起被删除, 因此每次 migrate 之后都需要检查一遍。
+
+    Returns:
+        补上的触发器名称列表
+    """
+    triggers = {FTS_TABLE: SEARCH_TRIGGERS, BIGRAM_TABLE: BIGRAM_TRIGGERS}
+    names = [*triggers, *SEARCH_TRIGGERS, *BIGRAM_TRIGGERS]
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"SELECT name, type FROM sqlite_master WHERE name IN ({', '.join(['%s'] * len(names))})", names
+        )
+        existing = dict(cursor.fetchall())
+        missing = {}
+        for table, table_triggers in triggers.items():
+            if existing.get(table) != 'table':
+                # 该索引的迁移尚未执行或已被回滚
+                continue
+            for name, sql in table_triggers.items():
+                if name not in existing:
+                    cursor.execute(sql)
+                    missing[name] = table
+    if missing:
+        # 触发器缺失期间的写入没有进入索引
+        rebuild_search_index(using, set(missing.values()))
+    return list(missing)
+
+
+def optimize_search_index():
+    """合并全文索引的 b-tree 段, 大量写入后可以提升查询速度"""
+    with connection.cursor() as cursor:
+        for table in (FTS_TABLE, BIGRAM_TABLE):
+            cursor.execute(f"INSERT INTO {table}({table}) VALUES ('optimize')")
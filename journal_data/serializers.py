@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from journal_data.derivatives import entry_images
 from journal_data.models import JournalEntry
 
 class EntrySerializer(serializers.ModelSerializer):
@@ -9,8 +10,50 @@ class EntrySerializer(serializers.ModelSerializer):
         model: 关联的JournalEntry模型
         fields: 包含所有模型字段
         read_only_fields: 防止用户修改的字段
+        images: images_json 中以 sha256 引用的图片, 带原图和缩略图地址
     """
+    images = serializers.SerializerMethodField()
+
     class Meta:
         model = JournalEntry
-        fields = ['id', 'user', 'is_mark', 'date', 'text', 'location_name', 'latitude', 'longitude', 'images_json']
-        read_only_fields = ['id', 'user']
\ No newline at end of file
+        fields = [
+            'id', 'uuid', 'user', 'is_mark', 'date', 'text', 'location_name', 'latitude', 'longitude', 'images_json',
+            'seq', 'images',
+        ]
+        read_only_fields = ['id', 'uuid', 'user', 'seq']
+
+    def get_images(self, obj):
+        return entry_images(obj.images_json)
+
+
+# 快速读取路径使用的 .values() 字段, 顺序与 EntrySerializer 的输出一致
+ENTRY_VALUE_FIELDS = (
+    'id', 'uuid', 'user_id', 'is_mark', 'date', 'text', 'location_name',
+    'latitude', 'longitude', 'images_json', 'seq',
+)
+
+_date_field = serializers.DateTimeField()
+
+
+def entry_representation(row):
+    """
+    把一行 .values(*ENTRY_VALUE_FIELDS) 结果转换为与 EntrySerializer 完全一致的输出
+
+    只读路径使用, 跳过 ModelSerializer 逐字段的开销; 写入校验仍然使用 EntrySerializer。
+    """
+    latitude = row['latitude']
+    longitude = row['longitude']
+    return {
+        'id': row['id'],
+        'uuid': str(row['uuid']),
+        'user': row['user_id'],
+        'is_mark': row['is_mark'],
+        'date': _date_field.to_representation(row['date']),
+        'text': row['text'],
+        'location_name': row['location_name'],
+        'latitude': None if latitude is None else float(latitude),
+        'longitude': None if longitude is None else float(longitude),
+        'images_json': row['images_json'],
+        'seq': row['seq'],
+        'images': entry_images(row['images_json']),
+    }
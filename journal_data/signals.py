@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.dispatch import Signal
+
+# 用户的日记条目发生变更且事务已提交时发送, 参数: user_id, entry_ids
+entries_changed = Signal()
+
+
+def send_entries_changed(user_id, entry_ids):
+    """在当前事务提交后发送 entries_changed, 没有事务时立即发送"""
+    entry_ids = list(entry_ids)
+    transaction.on_commit(
+        lambda: entries_changed.send(sender=None, user_id=user_id, entry_ids=entry_ids)
+    )
@@ -0,0 +1,21 @@
+from django.conf import settings
+
+from jobs.queue import task
+from .derivatives import render_missing_derivatives
+from .models import UploadSession
+from .search import optimize_search_index
+
+
+@task(concurrency=1)
+def optimize_search():
+    optimize_search_index()
+
+
+@task()
+def purge_expired_uploads():
+    UploadSession.purge_expired(settings.JOURNAL_UPLOAD_SESSION_TTL)
+
+
+@task()
+def generate_derivatives(sha256):
+    render_missing_derivatives(sha256)
@@ -1,3 +1,1114 @@
-from django.test import TestCase
+import hashlib
+import io
+import re
+import tempfile
+import threading
+import uuid
+from base64 import urlsafe_b64encode
+from datetime import datetime, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from jobs.models import Job
+from jobs.queue import Worker, registry
+from sync.maintenance import compact_sync_logs, purge_tombstones
+from sync.models import SyncLog, SyncRecord
+from sync.push import apply_push
+from sync.synclog import sync_log_buffer
+from users.models import User
+from .cache import cache_stats, entry_cache, entry_cache_key, serialize_entries
+from .changes import changes_since, parse_cursor
+from .derivatives import (
+    PILImage, derivative_path, derivatives_available, render_missing_derivatives, schedule_derivatives
+)
+from .geo import encode_geohash
+from .images import image_path, parse_images_json
+from .ingest import bulk_write_entries
+from .models import EntryImage, EntrySequence, EntryTombstone, Image, JournalEntry, UploadSession
+from .search import search_entries
+from .serializers import ENTRY_VALUE_FIELDS, EntrySerializer, entry_representation
+
+# 查询计划中出现这些内容说明没有用上索引: 全表扫描或额外的临时排序
+BAD_PLAN_PATTERN = re.compile(r'\bSCAN\b|USE TEMP B-TREE')
+SCAN_PATTERN = re.compile(r'\bSCAN\b')
+SORT_PATTERN = re.compile(r'USE TEMP B-TREE')
+
+# 测试生成的快照写到临时目录, 不影响也不读取开发环境的快照
+SNAPSHOT_ROOT = tempfile.mkdtemp(prefix='journal-snapshots-')
+IMAGE_ROOT = tempfile.mkdtemp(prefix='journal-images-')
+
+
+@override_settings(JOURNAL_SNAPSHOT_ROOT=SNAPSHOT_ROOT)
+class QueryPlanTests(TestCase):
+    """
+    热点查询的查询计划回归测试
+    在有一定数据量的库上请求各个视图, 对其执行的每条查询做 EXPLAIN QUERY PLAN,
+    出现全表扫描或临时 B 树排序即失败
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='plan', email='plan@example.com', password='plan-password')
+        other = User.objects.create_user(username='other', email='other@example.com', password='other-password')
+        start = datetime(2024, 1, 1)
+        for owner in (cls.user, other):
+            for i in range(200):
+                JournalEntry.objects.create(user=owner, date=start + timedelta(hours=i), text=f'entry {i}')
+        for entry in JournalEntry.objects.filter(user=cls.user)[:20]:
+            entry.delete()
+
+        cls.record = SyncRecord.objects.create(user=cls.user, device_id='plan-device')
+        SyncLog.objects.bulk_create([
+            SyncLog(
+                record=cls.record,
+                operation_type=i % 3,
+                entity_type='JournalEntry',
+                entity_id=str(i),
+                operation_time=start + timedelta(minutes=i),
+            )
+            for i in range(200)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexedQueries(self, queries, pattern=BAD_PLAN_PATTERN):
+        checked = 0
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            plan = self.explain(sql)
+            bad = [line for line in plan if pattern.search(line)]
+            self.assertFalse(bad, f'查询没有用上索引:\n{sql}\n' + '\n'.join(plan))
+            checked += 1
+        self.assertTrue(checked, '没有捕获到需要检查的查询')
+
+    def get_and_check(self, path, data=None, pattern=BAD_PLAN_PATTERN, **extra):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(path, data, **extra)
+        self.assertEqual(response.status_code, 200)
+        self.assertIndexedQueries(ctx.captured_queries, pattern)
+        return response
+
+    def test_entry_list(self):
+        response = self.get_and_check('/journals/entries/?page_size=20')
+        self.get_and_check(response.json()['next'])
+
+    def test_sync_data(self):
+        self.get_and_check('/journals/sync/')
+        self.get_and_check('/journals/sync/?cursor=100')
+
+    def test_sync_pull(self):
+        self.get_and_check('/sync/pull/', HTTP_X_DEVICE_ID='plan-device')
+        self.get_and_check('/sync/pull/?cursor=100', HTTP_X_DEVICE_ID='plan-device')
+
+    def test_sync_init(self):
+        self.get_and_check('/sync/init/', HTTP_X_DEVICE_ID='plan-device')
+
+    def test_geo_viewport(self):
+        # 每个 geohash 单元都应是一次索引范围查找; 合并后的排序 / 分组只涉及视口内的条目, 允许临时 B 树
+        self.get_and_check('/journals/geo/', {'bbox': '39,115,41,117', 'mode': 'entries'}, SCAN_PATTERN)
+        self.get_and_check('/journals/geo/', {'bbox': '39,115,41,117', 'mode': 'clusters'}, SCAN_PATTERN)
+
+    def test_sync_log_by_record(self):
+        logs = SyncLog.objects.filter(record=self.record).order_by('-operation_time')[:50]
+        with CaptureQueriesContext(connection) as ctx:
+            list(logs)
+        self.assertIndexedQueries(ctx.captured_queries)
+        # 管理后台的默认排序: 按索引顺序读取前几行, 不能有临时排序
+        with CaptureQueriesContext(connection) as ctx:
+            list(SyncLog.objects.order_by('-operation_time')[:100])
+        self.assertIndexedQueries(ctx.captured_queries, SORT_PATTERN)
+
+    def test_sync_log_compaction(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(compact_sync_logs(timedelta(0), batch_size=50, max_batches=2), 100)
+        self.assertIndexedQueries(ctx.captured_queries)
+
+
+@override_settings(JOURNAL_SNAPSHOT_ROOT=SNAPSHOT_ROOT)
+class ConcurrentPushTests(TransactionTestCase):
+    """
+    多个设备并发推送的压力测试
+    按 settings 中的 SQLite 生产配置 (WAL, BEGIN IMMEDIATE, busy timeout) 运行,
+    推送的同时有设备持续增量拉取, 所有写入都应排队完成而不是报 database is locked
+    """
+    pushers = 8
+    pullers = 4
+    batches = 10
+    batch_size = 20
+
+    def push(self, user, device_id, errors):
+        try:
+            record = SyncRecord.objects.get(user=user, device_id=device_id)
+            for _ in range(self.batches):
+                changes = [
+                    {'op': 'create', 'uuid': str(uuid.uuid4()), 'data': {'date': '2024-01-01T00:00:00', 'text': device_id}}
+                    for _ in range(self.batch_size)
+                ]
+                apply_push(user, record, changes)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def pull(self, user, done, errors, pulls):
+        try:
+            cursor = 0
+            while not done.is_set():
+                cursor = changes_since(user, cursor).cursor
+                pulls.append(cursor)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def test_parallel_pushers(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+        user = User.objects.create_user(username='pusher', email='pusher@example.com', password='pusher-password')
+        devices = [f'device-{i}' for i in range(self.pushers)]
+        for device_id in devices:
+            SyncRecord.objects.create(user=user, device_id=device_id)
+
+        errors = []
+        pulls = []
+        done = threading.Event()
+        pushers = [threading.Thread(target=self.push, args=(user, device_id, errors)) for device_id in devices]
+        pullers = [threading.Thread(target=self.pull, args=(user, done, errors, pulls)) for _ in range(self.pullers)]
+        for thread in pushers + pullers:
+            thread.start()
+        for thread in pushers:
+            thread.join()
+        done.set()
+        for thread in pullers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        total = self.pushers * self.batches * self.batch_size
+        self.assertEqual(JournalEntry.objects.filter(user=user).count(), total)
+        self.assertEqual(JournalEntry.objects.filter(user=user).values('seq').distinct().count(), total)
+        self.assertEqual(EntrySequence.current(user.pk), total)
+        # 同步日志经缓冲批量写入, 一条也不少
+        sync_log_buffer.flush()
+        self.assertEqual(SyncLog.objects.filter(record__user=user).count(), total)
+        # 推送期间的拉取都成功完成, 游标不会超过已分配的序号
+        self.assertTrue(pulls)
+        self.assertLessEqual(max(pulls), total)
+
+
+class PaginationTests(TestCase):
+    """条目列表的 (date, id) 游标分页"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='pages', email='pages@example.com', password='pages-password')
+        other = User.objects.create_user(username='pages-other', email='pages-other@example.com', password='x')
+        same_day = datetime(2024, 1, 1)
+        cls.entries = [JournalEntry.objects.create(user=cls.user, date=same_day, text=f'entry {i}') for i in range(5)]
+        cls.entries.append(JournalEntry.objects.create(user=cls.user, date=datetime(2023, 12, 31), text='older'))
+        JournalEntry.objects.create(user=other, date=same_day, text='other')
+
+    def setUp(self):
+        self.addCleanup(entry_cache().clear)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_same_date_pages(self):
+        # 日期相同的条目按 id 倒序衔接, 翻页时不重复也不遗漏
+        ids = []
+        url = '/journals/entries/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertLessEqual(len(data['results']), 2)
+            ids.extend(entry['id'] for entry in data['results'])
+            url = data['next']
+        expected = [entry.pk for entry in sorted(self.entries, key=lambda entry: (entry.date, entry.pk), reverse=True)]
+        self.assertEqual(ids, expected)
+
+    def test_invalid_cursor(self):
+        tampered = [b'2024-01-01T00:00:00|abc', b'2024-13-45T00:00:00|1', f'2024-01-01T00:00:00|{10**30}'.encode()]
+        for cursor in ['not-base64!', 'bm9waXBl'] + [urlsafe_b64encode(raw).decode() for raw in tampered]:
+            response = self.client.get('/journals/entries/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+
+    def test_page_size_cap(self):
+        bulk_write_entries(self.user, created=[
+            JournalEntry(user=self.user, date=datetime(2022, 1, 1) + timedelta(minutes=i), text=f'bulk {i}')
+            for i in range(600)
+        ])
+        data = self.client.get('/journals/entries/', {'page_size': 10000}).json()
+        self.assertEqual(len(data['results']), 500)
+        self.assertIsNotNone(data['next'])
+        data = self.client.get(data['next']).json()
+        self.assertEqual((len(data['results']), data['next']), (106, None))
+        # 无效的 page_size 使用默认值
+        self.assertEqual(len(self.client.get('/journals/entries/', {'page_size': 'x'}).json()['results']), 50)
+
+
+class ChangesTests(TestCase):
+    """变更序号和按游标增量拉取"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='changes', email='changes@example.com', password='x')
+        cls.other = User.objects.create_user(username='changes-other', email='changes-other@example.com', password='x')
+
+    def setUp(self):
+        self.addCleanup(entry_cache().clear)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create(self, text, user=None):
+        return JournalEntry.objects.create(user=user or self.user, date=datetime(2024, 1, 1), text=text)
+
+    def test_parse_cursor(self):
+        self.assertEqual([parse_cursor(None), parse_cursor(''), parse_cursor('5')], [0, 0, 5])
+        for value in ('abc', '-1', '1.5', str(2**63)):
+            with self.assertRaises(ValueError):
+                parse_cursor(value)
+        for path in ('/sync/pull/', '/journals/sync/'):
+            for value in ('abc', '-1', str(10**30)):
+                self.assertEqual(self.client.get(path, {'cursor': value}).status_code, 400, (path, value))
+
+    def test_seq_increases(self):
+        first = self.create('a')
+        second = self.create('b')
+        self.assertLess(first.seq, second.seq)
+        first.text = 'a2'
+        first.save()
+        self.assertGreater(first.seq, second.seq)
+        self.assertEqual(EntrySequence.current(self.user.pk), first.seq)
+        self.assertEqual(EntrySequence.allocate(self.user.pk, 3), first.seq + 3)
+        # 每个用户的序号独立
+        self.assertEqual(self.create('c', user=self.other).seq, 1)
+
+    def test_delta_after_cursor(self):
+        old = self.create('old')
+        cursor = EntrySequence.current(self.user.pk)
+        new = self.create('new')
+        old.text = 'old edited'
+        old.save()
+        self.create('not mine', user=self.other)
+
+        changes = changes_since(self.user, cursor)
+        self.assertEqual([entry['id'] for entry in changes.entries], [new.pk, old.pk])
+        self.assertTrue(all(entry['seq'] > cursor for entry in changes.entries))
+        self.assertEqual((changes.cursor, changes.has_more, changes.reset), (old.seq, False, False))
+        self.assertEqual(changes_since(self.user, changes.cursor).entries, [])
+        self.assertEqual(changes_since(self.user, changes.cursor).cursor, changes.cursor)
+
+    def test_pages(self):
+        created = [self.create(f'entry {i}').pk for i in range(5)]
+        seen = []
+        cursor = 0
+        pages = []
+        while True:
+            changes = changes_since(self.user, cursor, limit=2)
+            seen += [entry['id'] for entry in changes.entries]
+            pages.append((len(changes.entries), changes.has_more))
+            cursor = changes.cursor
+            if not changes.has_more:
+                break
+        self.assertEqual(pages, [(2, True), (2, True), (1, False)])
+        self.assertEqual((seen, cursor), (created, EntrySequence.current(self.user.pk)))
+
+        # 接口返回相同的分页, 且只包含自己的条目
+        self.create('other user', user=self.other)
+        with override_settings(JOURNAL_SYNC_PULL_LIMIT=3):
+            data = self.client.get('/sync/pull/', {'cursor': 0}).json()
+            self.assertEqual(([entry['id'] for entry in data['entries']], data['has_more']), (created[:3], True))
+            data = self.client.get('/sync/pull/', {'cursor': data['cursor']}).json()
+            self.assertEqual(([entry['id'] for entry in data['entries']], data['has_more']), (created[3:], False))
+
+
+class TombstoneTests(TestCase):
+    """删除墓碑: 各种删除方式都写入墓碑, 随拉取下发, 清理后落后的设备收到 reset"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tombs', email='tombs@example.com', password='x')
+        cls.admin = User.objects.create_superuser(username='tombs-admin', email='admin@example.com', password='x')
+
+    def setUp(self):
+        self.addCleanup(entry_cache().clear)
+        self.entries = [
+            JournalEntry.objects.create(user=self.user, date=datetime(2024, 1, 1), text=f'entry {i}') for i in range(5)
+        ]
+
+    def deleted_ids(self, cursor):
+        return sorted(item['id'] for item in changes_since(self.user, cursor).deleted)
+
+    def test_every_delete_path(self):
+        cursor = EntrySequence.current(self.user.pk)
+        expected = [(entry.pk, entry.uuid) for entry in self.entries[:4]]
+        first, second, third, fourth, _ = self.entries
+        first.delete()
+        JournalEntry.objects.filter(pk__in=[second.pk, third.pk]).delete()
+        client = APIClient()
+        client.force_login(self.admin)
+        response = client.post('/admin/journal_data/journalentry/', {
+            'action': 'delete_selected', '_selected_action': [fourth.pk], 'post': 'yes',
+        })
+        self.assertEqual(response.status_code, 302)
+
+        self.assertEqual(self.deleted_ids(cursor), [pk for pk, _ in expected])
+        tombstones = EntryTombstone.objects.filter(user=self.user).order_by('seq')
+        self.assertEqual(list(tombstones.values_list('entry_id', 'entry_uuid')), expected)
+        seqs = list(tombstones.values_list('seq', flat=True))
+        self.assertEqual(seqs, list(range(cursor + 1, cursor + 5)))
+        self.assertEqual(EntrySequence.current(self.user.pk), cursor + 4)
+
+    def test_purge_and_reset(self):
+        current, behind = (SyncRecord.objects.create(user=self.user, device_id=device_id) for device_id in ('a', 'b'))
+        behind_cursor = EntrySequence.current(self.user.pk)
+        SyncRecord.objects.filter(pk=behind.pk).update(
+            cursor=behind_cursor, last_sync_time=datetime.now() - timedelta(days=30)
+        )
+        JournalEntry.objects.filter(pk__in=[entry.pk for entry in self.entries[:2]]).delete()
+        self.assertEqual(self.deleted_ids(behind_cursor), [entry.pk for entry in self.entries[:2]])
+
+        # 还有设备没拉取到墓碑时不清理
+        self.assertEqual(purge_tombstones(), 0)
+        current_cursor = EntrySequence.current(self.user.pk)
+        SyncRecord.objects.filter(pk=current.pk).update(cursor=current_cursor, last_sync_time=datetime.now())
+        self.assertEqual(purge_tombstones(), 0)
+        # 长期未同步的设备不再阻止清理
+        self.assertEqual(purge_tombstones(stale_after=timedelta(days=1)), 2)
+        self.assertFalse(EntryTombstone.objects.exists())
+
+        changes = changes_since(self.user, current_cursor)
+        self.assertEqual((changes.entries, changes.deleted, changes.reset), ([], [], False))
+        # 游标落后于已清理水位的设备重新全量同步
+        changes = changes_since(self.user, behind_cursor)
+        self.assertTrue(changes.reset)
+        self.assertEqual([entry['id'] for entry in changes.entries], [entry.pk for entry in self.entries[2:]])
+        self.assertEqual(changes.deleted, [])
+        client = APIClient()
+        client.force_authenticate(self.user)
+        data = client.get('/sync/pull/', {'cursor': behind_cursor}, HTTP_X_DEVICE_ID='b').json()
+        self.assertEqual((data['reset'], len(data['entries'])), (True, 3))
+
+
+class IngestTests(TestCase):
+    """SyncDataView.post 的批量校验和写入"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='ingest', email='ingest@example.com', password='ingest-password')
+        cls.other = User.objects.create_user(username='ingest-other', email='ingest-other@example.com', password='x')
+
+    def setUp(self):
+        self.addCleanup(entry_cache().clear)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, entries):
+        return self.client.post('/journals/sync/', {'entries': entries}, format='json')
+
+    def test_create_and_update(self):
+        mine = JournalEntry.objects.create(user=self.user, date=datetime(2024, 1, 1), text='mine')
+        theirs = JournalEntry.objects.create(user=self.other, date=datetime(2024, 1, 1), text='theirs')
+        response = self.post([
+            {'id': mine.pk, 'date': '2024-01-01T00:00:00', 'text': 'edited'},
+            {'id': str(mine.pk), 'date': '2024-01-01T00:00:00', 'text': 'edited again'},
+            {'id': theirs.pk, 'date': '2024-01-02T00:00:00', 'text': 'not theirs'},
+            {'date': '2024-01-03T00:00:00', 'text': 'new'},
+        ])
+        self.assertEqual(response.status_code, 200, response.content)
+        statuses = [(item['index'], item['status']) for item in response.json()['results']]
+        self.assertEqual(statuses, [(0, 'updated'), (1, 'updated'), (2, 'created'), (3, 'created')])
+        mine.refresh_from_db()
+        theirs.refresh_from_db()
+        self.assertEqual((mine.text, theirs.text), ('edited again', 'theirs'))
+        self.assertEqual(JournalEntry.objects.filter(user=self.user).count(), 3)
+
+    def test_untouched_fields_kept(self):
+        # 更新只写入提交的字段, 不会用旧值覆盖其他字段
+        entry = JournalEntry.objects.create(user=self.user, date=datetime(2024, 1, 1), text='draft', location_name='Home')
+        real_is_valid = EntrySerializer.is_valid
+
+        def is_valid(serializer, *args, **kwargs):
+            # 读取条目之后其他字段被修改
+            JournalEntry.objects.filter(pk=entry.pk).update(is_mark=True)
+            return real_is_valid(serializer, *args, **kwargs)
+
+        with mock.patch.object(EntrySerializer, 'is_valid', autospec=True, side_effect=is_valid):
+            response = self.post([{'id': entry.pk, 'date': '2024-01-02T00:00:00', 'text': 'final'}])
+        self.assertEqual(response.status_code, 200, response.content)
+        entry.refresh_from_db()
+        self.assertEqual((entry.text, entry.is_mark, entry.location_name), ('final', True, 'Home'))
+
+    def test_invalid_batch(self):
+        count = JournalEntry.objects.count()
+        response = self.post([
+            {'date': '2024-01-01T00:00:00', 'text': 'ok'},
+            {'id': 'abc', 'date': '2024-01-01T00:00:00'},
+            {'id': [1], 'date': '2024-01-01T00:00:00'},
+            {'id': 10**30, 'date': '2024-01-01T00:00:00'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['details']], [1, 2, 3])
+        self.assertIn('id', response.json()['details'][0]['errors'])
+        response = self.post([{'date': 'not a date'}, 'not an object'])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['details']], [0, 1])
+        self.assertEqual(JournalEntry.objects.count(), count)
+        self.assertEqual(self.post({'date': '2024-01-01T00:00:00'}).status_code, 400)
+
+
+class ConditionalTests(TestCase):
+    """entries_condition: 按用户的条目版本生成 ETag, 未变化时返回 304"""
+    paths = ('/journals/entries/', '/journals/sync/', '/sync/pull/')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='etag', email='etag@example.com', password='x')
+        cls.other = User.objects.create_user(username='etag-other', email='etag-other@example.com', password='x')
+        cls.entries = [JournalEntry.objects.create(user=cls.user, date=datetime(2024, 1, 1), text=f'entry {i}') for i in range(3)]
+
+    def setUp(self):
+        self.addCleanup(entry_cache().clear)
+        self.addCleanup(sync_log_buffer.flush)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def etags(self):
+        return {path: self.client.get(path)['ETag'] for path in self.paths}
+
+    def assertChanged(self, before):
+        after = self.etags()
+        for path in self.paths:
+            self.assertNotEqual(after[path], before[path], path)
+            self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=before[path]).status_code, 200, path)
+        return after
+
+    def test_not_modified(self):
+        for path in self.paths:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+            self.assertIn('private', response['Cache-Control'])
+            # 匹配时只查询一次条目版本, 不读取条目
+            with self.assertNumQueries(1):
+                response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual((response.status_code, response['ETag'], response.content), (304, etag, b''))
+            for if_none_match in (f'"other", W/{etag}', '*'):
+                self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=if_none_match).status_code, 304)
+            self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+            # 不同的查询参数和 Accept 对应不同的响应
+            self.assertNotEqual(self.client.get(path, {'page_size': 1})['ETag'], etag)
+            self.assertNotEqual(self.client.get(path, HTTP_ACCEPT='application/json; indent=2')['ETag'], etag)
+
+    def test_etag_changes(self):
+        before = self.etags()
+        # 其他用户的写入不影响
+        JournalEntry.objects.create(user=self.other, date=datetime(2024, 1, 1), text='other')
+        self.assertEqual(self.etags(), before)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/sync/push/', {'changes': [
+                {'op': 'create', 'uuid': str(uuid.uuid4()), 'data': {'date': '2024-01-02T00:00:00', 'text': 'pushed'}},
+            ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        before = self.assertChanged(before)
+
+        self.entries[0].text = 'edited'
+        self.entries[0].save()
+        before = self.assertChanged(before)
+
+        self.assertEqual(self.client.delete(f'/journals/entries/{self.entries[1].pk}/').status_code, 204)
+        before = self.assertChanged(before)
+
+        # 清理墓碑不改变条目序号, 但会让落后的游标收到 reset
+        seq = EntrySequence.current(self.user.pk)
+        SyncRecord.objects.filter(user=self.user).update(cursor=seq)
+        self.assertEqual(purge_tombstones(), 1)
+        self.assertEqual(EntrySequence.current(self.user.pk), seq)
+        self.assertChanged(before)
+
+
+class EntryRepresentationTests(TestCase):
+    """只读快速路径 entry_representation 与 EntrySerializer 的输出一致"""
+
+    def test_matches_serializer(self):
+        user = User.objects.create_user(username='fields', email='fields@example.com', password='x')
+        sha = 'cd' * 32
+        variants = [
+            {},
+            {'date': datetime(2024, 2, 29, 23, 59, 59, 123456), 'is_mark': True},
+            {'location_name': 'Shanghai', 'latitude': 31.230416, 'longitude': 121.473701},
+            {'location_name': 'Null Island', 'latitude': 0.0, 'longitude': -0.0},
+            {'latitude': -33.8688197, 'longitude': 151.2092955},
+            {'images_json': None},
+            {'images_json': ''},
+            {'images_json': f'["{sha}", "file:///a.jpg"]'},
+            {'images_json': f'{{"images": [{{"hash": "{sha.upper()}", "path": "b.png"}}]}}'},
+            {'images_json': 'not json'},
+            {'text': '多行\n文本 "引号" \u2028 😀'},
+        ]
+        for fields in variants:
+            JournalEntry.objects.create(user=user, **{'date': datetime(2024, 1, 1), 'text': 'entry', **fields})
+
+        entries = JournalEntry.objects.filter(user=user).order_by('id')
+        rows = entries.values(*ENTRY_VALUE_FIELDS)
+        renderer = JSONRenderer()
+        for entry, row in zip(entries, rows):
+            expected = EntrySerializer(entry).data
+            actual = entry_representation(row)
+            self.assertEqual(actual, expected)
+            # 字段顺序和类型也一致, 渲染出的 JSON 逐字节相同
+            self.assertEqual(list(actual), list(expected))
+            self.assertEqual(renderer.render(actual), renderer.render(expected))
+
+
+class EntryCacheTests(TestCase):
+    """serialize_entries 的序列化结果缓存"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='cached', email='cached@example.com', password='x')
+        cls.admin = User.objects.create_superuser(username='cached-admin', email='cached-admin@example.com', password='x')
+        cls.entries = [JournalEntry.objects.create(user=cls.user, date=datetime(2024, 1, 1), text=f'entry {i}') for i in range(3)]
+
+    def setUp(self):
+        entry_cache().clear()
+        self.addCleanup(entry_cache().clear)
+
+    def rows(self):
+        return JournalEntry.objects.filter(user=self.user).order_by('id').values(*ENTRY_VALUE_FIELDS)
+
+    def serialize(self):
+        before = cache_stats()
+        data = serialize_entries(self.rows())
+        after = cache_stats()
+        return data, (after['hits'] - before['hits'], after['misses'] - before['misses'])
+
+    def test_hits_and_misses(self):
+        self.assertEqual(serialize_entries([]), [])
+        data, counts = self.serialize()
+        self.assertEqual(counts, (0, 3))
+        self.assertEqual(data, [EntrySerializer(entry).data for entry in self.entries])
+        cached, counts = self.serialize()
+        self.assertEqual((cached, counts), (data, (3, 0)))
+
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        stats = client.get('/journals/cache-stats/').json()
+        self.assertEqual(stats, cache_stats())
+        self.assertGreater(stats['hit_rate'], 0)
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/journals/cache-stats/').status_code, 403)
+
+    def test_reserialized_after_save(self):
+        self.serialize()
+        entry = self.entries[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            entry.text = 'saved'
+            entry.save()
+        # 提交后删除缓存项
+        self.assertIsNone(entry_cache().get(entry_cache_key(self.user.pk, entry.pk)))
+        data, counts = self.serialize()
+        self.assertEqual(counts, (2, 1))
+        self.assertEqual(data[0]['text'], 'saved')
+
+    def test_reserialized_after_bulk_write(self):
+        self.serialize()
+        first, second, third = self.entries
+        first.text = 'bulk'
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_write_entries(self.user, updated=[first], deleted=[third])
+        data, counts = self.serialize()
+        self.assertEqual(counts, (1, 1))
+        self.assertEqual([entry['text'] for entry in data], ['bulk', 'entry 1'])
+
+    def test_stale_value_ignored(self):
+        # 即使漏掉了失效通知, seq 不一致的缓存值也不会被使用
+        self.serialize()
+        JournalEntry.objects.filter(pk=self.entries[1].pk).update(text='raw update', seq=F('seq') + 100)
+        data, counts = self.serialize()
+        self.assertEqual(counts, (2, 1))
+        self.assertEqual(data[1]['text'], 'raw update')
+
+
+class SearchTests(TestCase):
+    """全文搜索: 触发器同步索引, 中文分词, 相关度排序和分页"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='search', email='search@example.com', password='search-password')
+        cls.other = User.objects.create_user(username='stranger', email='stranger@example.com', password='x')
+        cls.park = JournalEntry.objects.create(
+            user=cls.user, date=datetime(2024, 1, 1), text='今天去公园散步, 公园散步让人放松', location_name='北京'
+        )
+        cls.hike = JournalEntry.objects.create(
+            user=cls.user, date=datetime(2024, 1, 2), text='Went hiking in the mountains', location_name='Alps'
+        )
+        cls.dance = JournalEntry.objects.create(
+            user=cls.user, date=datetime(2024, 1, 3), text='公园里有很多人在跳舞', location_name='上海'
+        )
+        JournalEntry.objects.create(user=cls.other, date=datetime(2024, 1, 1), text='别人的公园散步')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def ids(self, query, **kwargs):
+        return [hit['entry']['id'] for hit in search_entries(self.user, query, 10, **kwargs)]
+
+    def test_ranked_chinese_and_english(self):
+        self.assertEqual(self.ids('公园散步'), [self.park.pk])
+        self.assertEqual(self.ids('HIKING'), [self.hike.pk])
+        self.assertEqual(self.ids('ountain Alps'), [self.hike.pk])
+        hit = search_entries(self.user, '公园散步', 10)[0]
+        self.assertIn('<mark>公园散步</mark>', hit['snippet'])
+        self.assertLess(hit['rank'], 0)
+
+    def test_short_terms(self):
+        # 两个字的中文词走 bigram 索引, 按相关度排序
+        self.assertEqual(self.ids('公园'), [self.park.pk, self.dance.pk])
+        self.assertEqual(self.ids('公园 跳舞'), [self.dance.pk])
+        self.assertEqual(self.ids('很多人 北京'), [])
+        self.assertEqual(self.ids('公园散步 北京'), [self.park.pk])
+        self.assertEqual(self.ids('上海'), [self.dance.pk])
+        hit = search_entries(self.user, '公园', 10)[0]
+        self.assertIn('<mark>公园</mark>', hit['snippet'])
+        self.assertLess(hit['rank'], 0)
+        # 其他短关键词仍以 LIKE 过滤, 按时间倒序
+        self.assertEqual(self.ids('园'), [self.dance.pk, self.park.pk])
+        self.assertEqual(self.ids('公园 Al'), [])
+
+    def test_bigram_terms_use_index(self):
+        for query in ('公园', '跳舞 公园', '公园散步 北京'):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertTrue(self.ids(query), query)
+            sql = '\n'.join(q['sql'] for q in ctx.captured_queries)
+            self.assertIn('journal_data_entry_bigram', sql, query)
+            self.assertNotIn('LIKE', sql, query)
+
+    def test_query_syntax_is_literal(self):
+        self.assertEqual(self.ids('"hiking" OR NEAR('), [])
+        self.assertEqual(self.ids('100%'), [])
+
+    def test_index_follows_writes(self):
+        self.hike.text = 'Went swimming in the lake'
+        self.hike.save()
+        self.assertEqual(self.ids('hiking'), [])
+        self.assertEqual(self.ids('swimming'), [self.hike.pk])
+        self.dance.delete()
+        self.assertEqual(self.ids('跳舞'), [])
+
+        self.hike.location_name = '瑞士'
+        self.hike.save()
+        self.assertEqual(self.ids('瑞士'), [self.hike.pk])
+
+        bulk_write_entries(self.user, created=[
+            JournalEntry(user=self.user, date=datetime(2024, 2, 1), text='批量导入的旅行日记')
+        ])
+        self.assertEqual(len(self.ids('旅行日记')), 1)
+        self.assertEqual(len(self.ids('旅行')), 1)
+        JournalEntry.objects.filter(user=self.user).delete()
+        self.assertEqual(self.ids('旅行日记'), [])
+        self.assertEqual(self.ids('旅行'), [])
+
+    def test_reindex_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO journal_data_entry_fts(journal_data_entry_fts) VALUES ('delete-all')")
+            cursor.execute('DELETE FROM journal_data_entry_bigram')
+        self.assertEqual((self.ids('公园散步'), self.ids('公园')), ([], []))
+        call_command('reindex_entries', '--optimize', stdout=io.StringIO())
+        self.assertEqual((self.ids('公园散步'), self.ids('公园')), ([self.park.pk], [self.park.pk, self.dance.pk]))
+
+    def test_search_view(self):
+        for i in range(5):
+            JournalEntry.objects.create(user=self.user, date=datetime(2024, 3, i + 1), text=f'第{i}次去海边散步')
+        response = self.client.get('/journals/search/', {'q': '去海边', 'page_size': 3})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data['results']), 3)
+        self.assertEqual(set(data['results'][0]), {'entry', 'snippet', 'rank'})
+        data = self.client.get(data['next']).json()
+        self.assertEqual(len(data['results']), 2)
+        self.assertIsNone(data['next'])
+
+        self.assertEqual(self.client.get('/journals/search/').status_code, 400)
+        self.assertEqual(self.client.get('/journals/search/', {'q': 'x', 'page': 0}).status_code, 400)
+
+
+    def test_snippet_escaped(self):
+        JournalEntry.objects.create(user=self.user, date=datetime(2024, 4, 1), text='<i>&</i>海边"散步"')
+        escaped = '&lt;i&gt;&amp;&lt;/i&gt;'
+        # 走 FTS 索引和 LIKE 过滤的摘要都先转义条目内容, 再插入高亮标签
+        self.assertEqual(search_entries(self.user, '海边"', limit=1)[0]['snippet'], f'{escaped}<mark>海边&quot;</mark>散步&quot;')
+        self.assertEqual(search_entries(self.user, '海边', limit=1)[0]['snippet'], f'{escaped}<mark>海边</mark>&quot;散步&quot;')
+        # 关键词本身含有 HTML 字符时, 高亮的也是转义后的文本
+        self.assertEqual(search_entries(self.user, '</i>', limit=1)[0]['snippet'], '&lt;i&gt;&amp;<mark>&lt;/i&gt;</mark>海边&quot;散步&quot;')
+        self.assertEqual(search_entries(self.user, '&', limit=1)[0]['snippet'], '&lt;i&gt;<mark>&amp;</mark>&lt;/i&gt;海边&quot;散步&quot;')
+
+
+class GeoTests(TestCase):
+    """地图查询: geohash 维护, 视口 / 半径查询和聚合"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='geo', email='geo@example.com', password='geo-password')
+        places = {
+            'beijing': (39.9042, 116.4074),
+            'tianjin': (39.3434, 117.3616),
+            'shanghai': (31.2304, 121.4737),
+            'fiji': (-17.7134, 178.0650),
+            'samoa': (-13.7590, -172.1046),
+        }
+        cls.entries = {
+            name: JournalEntry.objects.create(
+                user=cls.user, date=datetime(2024, 1, i + 1), text=name, latitude=latitude, longitude=longitude
+            )
+            for i, (name, (latitude, longitude)) in enumerate(places.items())
+        }
+        JournalEntry.objects.create(user=cls.user, date=datetime(2024, 2, 1), text='没有位置')
+        other = User.objects.create_user(username='geo-other', email='geo-other@example.com', password='x')
+        JournalEntry.objects.create(user=other, date=datetime(2024, 1, 1), latitude=39.9, longitude=116.4)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, **params):
+        response = self.client.get('/journals/geo/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def texts(self, data):
+        return sorted(result['text'] for result in data['results'])
+
+    def test_geohash_maintained(self):
+        self.assertEqual(encode_geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        entry = self.entries['beijing']
+        self.assertEqual(entry.geohash, encode_geohash(39.9042, 116.4074))
+        entry.latitude, entry.longitude = 31.2304, 121.4737
+        entry.save(update_fields=['latitude', 'longitude'])
+        entry.refresh_from_db()
+        self.assertEqual(entry.geohash, encode_geohash(31.2304, 121.4737))
+
+        created = JournalEntry(user=self.user, date=datetime(2024, 3, 1), latitude=1.0, longitude=2.0)
+        bulk_write_entries(self.user, created=[created])
+        self.assertEqual(JournalEntry.objects.get(pk=created.pk).geohash, encode_geohash(1.0, 2.0))
+
+    def test_bbox(self):
+        data = self.get(bbox='38,115,41,118')
+        self.assertEqual(data['type'], 'entries')
+        self.assertEqual(self.texts(data), ['beijing', 'tianjin'])
+        # 跨越 180 度经线的视口
+        self.assertEqual(self.texts(self.get(bbox='-20,170,-10,-170')), ['fiji', 'samoa'])
+        self.assertEqual(self.get(bbox='0,0,1,1')['results'], [])
+
+    def test_radius(self):
+        data = self.get(latitude=39.9, longitude=116.4, radius=150000)
+        self.assertEqual([result['text'] for result in data['results']], ['beijing', 'tianjin'])
+        self.assertLess(data['results'][0]['distance'], 1000)
+        self.assertEqual(self.texts(self.get(latitude=39.9, longitude=116.4, radius=50000)), ['beijing'])
+
+    def test_clusters(self):
+        data = self.get(bbox='20,100,45,125', mode='clusters')
+        self.assertEqual(data['type'], 'clusters')
+        self.assertEqual(sum(cluster['count'] for cluster in data['results']), 3)
+        # 超过 limit 时自动改为聚合
+        data = self.get(bbox='20,100,45,125', limit=2)
+        self.assertEqual(data['type'], 'clusters')
+        data = self.get(bbox='20,100,45,125', limit=2, mode='entries')
+        self.assertEqual((data['type'], data['truncated'], len(data['results'])), ('entries', True, 2))
+        data = self.get(bbox='-90,-180,90,180', mode='clusters', precision=1)
+        self.assertEqual(sum(cluster['count'] for cluster in data['results']), 5)
+
+    def test_invalid_area(self):
+        for params in ({}, {'bbox': '1,2,3'}, {'bbox': '50,0,40,10'}, {'latitude': 0, 'longitude': 0, 'radius': -1}):
+            self.assertEqual(self.client.get('/journals/geo/', params).status_code, 400)
+
+
+@override_settings(JOURNAL_IMAGE_ROOT=IMAGE_ROOT)
+class ImageTests(TestCase):
+    """图片: images_json 解析, 按哈希去重的上传和下载"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='images', email='images@example.com', password='images-password')
+        cls.other = User.objects.create_user(username='images-other', email='images-other@example.com', password='x')
+
+    def setUp(self):
+        # 缓存按 (用户, 条目, seq) 命中, 测试之间回滚后 id 和 seq 会重复
+        entry_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, content, sha256=None, client=None):
+        sha256 = sha256 or hashlib.sha256(content).hexdigest()
+        return (client or self.client).put(f'/journals/images/{sha256}/', content, content_type='image/jpeg')
+
+    def derivative_jobs(self, sha):
+        return Job.objects.filter(name='journal_data.generate_derivatives', unique_key=f'derivatives:{sha}')
+
+    def run_derivative_job(self, sha):
+        job = self.derivative_jobs(sha).get()
+        registry[job.name].func(*job.args)
+        job.delete()
+
+    def test_parse_images_json(self):
+        sha = 'ab' * 32
+        self.assertEqual(parse_images_json(None), [])
+        self.assertEqual(parse_images_json('[]'), [])
+        self.assertEqual(parse_images_json(f'["{sha.upper()}", "file:///a.jpg"]'), [(sha, ''), ('', 'file:///a.jpg')])
+        self.assertEqual(
+            parse_images_json(f'{{"images": [{{"hash": "{sha}", "path": "b.png"}}, {{"width": 1}}]}}'),
+            [(sha, 'b.png')],
+        )
+        self.assertEqual(parse_images_json('photos/c.jpg'), [('', 'photos/c.jpg')])
+
+    def test_entry_refs_follow_images_json(self):
+        sha = hashlib.sha256(b'photo').hexdigest()
+        entry = JournalEntry.objects.create(user=self.user, date=datetime(2024, 1, 1), images_json=f'["{sha}", "{sha}"]')
+        self.assertEqual(list(entry.image_refs.values_list('position', 'sha256')), [(0, sha), (1, sha)])
+
+        entry.images_json = '["a.jpg"]'
+        bulk_write_entries(self.user, updated=[entry])
+        self.assertEqual(list(entry.image_refs.values_list('sha256', 'source')), [('', 'a.jpg')])
+        entry.text = '只改文字'
+        entry.save(update_fields=['text'])
+        self.assertEqual(entry.image_refs.count(), 1)
+
+        self.upload(b'photo')
+        entry.images_json = f'["{sha}", "a.jpg"]'
+        entry.save()
+        data = self.client.get(f'/journals/entries/{entry.pk}/images/').json()['results']
+        self.assertEqual([(ref['sha256'], ref['uploaded']) for ref in data], [(sha, True), ('', False)])
+        self.assertEqual(data[0]['url'], f'/journals/images/{sha}/')
+
+        bulk_write_entries(self.user, deleted=[entry])
+        self.assertFalse(EntryImage.objects.exists())
+
+    def test_upload_dedup(self):
+        content = b'\xff\xd8jpeg bytes' * 100
+        sha = hashlib.sha256(content).hexdigest()
+        check = self.client.post('/journals/images/check/', {'hashes': [sha, sha, 'cd' * 32]}, format='json')
+        self.assertEqual(check.json()['missing'], [sha, 'cd' * 32])
+
+        response = self.upload(content)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['size'], len(content))
+        response = self.upload(content)
+        self.assertEqual((response.status_code, response.json()['created']), (200, False))
+        self.assertEqual(self.client.post('/journals/images/check/', {'hashes': [sha]}, format='json').json()['missing'], [])
+
+        # 其他用户看不到这张图片, 上传相同内容时共用同一个文件
+        other = APIClient()
+        other.force_authenticate(self.other)
+        self.assertEqual(other.get(f'/journals/images/{sha}/').status_code, 404)
+        self.assertEqual(self.upload(content, client=other).status_code, 201)
+        self.assertEqual(Image.objects.filter(sha256=sha).count(), 2)
+
+        response = self.client.get(f'/journals/images/{sha}/')
+        self.assertEqual(b''.join(response.streaming_content), content)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client.get(f'/journals/images/{sha}/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_upload_rejected(self):
+        self.assertEqual(self.upload(b'content', sha256='00' * 32).status_code, 400)
+        self.assertEqual(self.upload(b'', sha256=hashlib.sha256(b'').hexdigest()).status_code, 400)
+        with override_settings(JOURNAL_IMAGE_MAX_SIZE=10):
+            self.assertEqual(self.upload(b'x' * 11).status_code, 413)
+        self.assertFalse(Image.objects.exists())
+        self.assertEqual(self.client.post('/journals/images/check/', {'hashes': ['nope']}, format='json').status_code, 400)
+
+    def test_range_download(self):
+        content = bytes(range(256)) * 4
+        sha = hashlib.sha256(content).hexdigest()
+        self.upload(content)
+        url = f'/journals/images/{sha}/'
+        for header, expected in (('bytes=0-99', content[:100]), ('bytes=1000-', content[1000:]), ('bytes=-10', content[-10:])):
+            response = self.client.get(url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(b''.join(response.streaming_content), expected)
+            self.assertEqual(response['Content-Length'], str(len(expected)))
+        self.assertEqual(response['Content-Range'], f'bytes 1014-1023/{len(content)}')
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=5000-').status_code, 416)
+        # 多区间和 If-Range 不匹配时返回完整内容
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=0-1,5-6').status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"other"').status_code, 200)
+        # 支持 Range 的响应不压缩
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual((response['Accept-Ranges'], response.has_header('Content-Encoding')), ('bytes', False))
+
+    def test_entry_image_urls(self):
+        sha = hashlib.sha256(b'photo').hexdigest()
+        entry = JournalEntry.objects.create(user=self.user, date=datetime(2024, 1, 1), images_json=f'["{sha}", "a.jpg"]')
+        expected = [{
+            'sha256': sha,
+            'url': f'/journals/images/{sha}/',
+            'thumb': f'/journals/images/{sha}/thumb/',
+            'medium': f'/journals/images/{sha}/medium/',
+        }]
+        row = JournalEntry.objects.values(*ENTRY_VALUE_FIELDS).get(pk=entry.pk)
+        self.assertEqual(entry_representation(row), EntrySerializer(entry).data)
+        self.assertEqual(entry_representation(row)['images'], expected)
+        self.assertEqual(self.client.get('/journals/entries/').json()['results'][0]['images'], expected)
+        self.assertEqual(self.client.get('/journals/sync/').json()['entries'][0]['images'], expected)
+
+    @override_settings(JOURNAL_IMAGE_DERIVATIVES={'thumb': 64})
+    def test_derivative_fallback(self):
+        content = b'not really an image'
+        sha = hashlib.sha256(content).hexdigest()
+        self.upload(content)
+        self.assertEqual(self.client.get(f'/journals/images/{sha}/medium/').status_code, 404)
+        self.assertEqual(self.client.get(f"/journals/images/{'cd' * 32}/thumb/").status_code, 404)
+        response = self.client.get(f'/journals/images/{sha}/thumb/')
+        self.assertEqual((response.status_code, response['Location']), (302, f'/journals/images/{sha}/'))
+        self.assertEqual(response['Cache-Control'], 'no-store')
+        if derivatives_available():
+            # 上传和回退时安排的生成任务合并为一个
+            self.assertEqual(self.derivative_jobs(sha).count(), 1)
+            # 无法解码的图片不会生成缩略图, 任务失败后由队列重试
+            with self.assertRaises(Exception):
+                self.run_derivative_job(sha)
+        else:
+            self.assertFalse(Job.objects.exists())
+
+    @skipUnless(derivatives_available(), '生成缩略图需要 Pillow')
+    @override_settings(JOURNAL_IMAGE_DERIVATIVES={'thumb': 64, 'medium': 256})
+    def test_derivatives_generated(self):
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (1200, 600), (200, 30, 30)).save(buffer, 'JPEG')
+        content = buffer.getvalue()
+        sha = hashlib.sha256(content).hexdigest()
+        self.upload(content)
+        # 上传时只入队, 由 run_jobs 工作进程在进程池中生成
+        self.assertFalse(derivative_path(sha, 'thumb').exists())
+        self.assertIsNone(schedule_derivatives(sha))
+        self.run_derivative_job(sha)
+        for name, size in (('thumb', (64, 32)), ('medium', (256, 128))):
+            response = self.client.get(f'/journals/images/{sha}/{name}/')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('immutable', response['Cache-Control'])
+            with PILImage.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+                self.assertEqual(image.size, size)
+        # 缩略图都已存在时不再安排任务
+        self.assertIsNone(schedule_derivatives(sha))
+        self.assertFalse(self.derivative_jobs(sha).exists())
+        self.assertEqual(render_missing_derivatives(sha), 0)
+
+
+@skipUnless(derivatives_available(), '生成缩略图需要 Pillow')
+@override_settings(JOURNAL_IMAGE_ROOT=IMAGE_ROOT, JOURNAL_IMAGE_DERIVATIVES={'thumb': 32})
+class DerivativeJobTests(TransactionTestCase):
+    """缩略图由 run_jobs 工作进程执行的后台任务生成"""
+
+    def test_worker_generates(self):
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (100, 50), (30, 200, 30)).save(buffer, 'JPEG')
+        sha = hashlib.sha256(buffer.getvalue()).hexdigest()
+        image_path(sha).parent.mkdir(parents=True, exist_ok=True)
+        image_path(sha).write_bytes(buffer.getvalue())
+        self.assertIsNotNone(schedule_derivatives(sha))
+        self.assertIsNone(schedule_derivatives(sha))
+        self.assertEqual(Job.objects.count(), 1)
+
+        worker = Worker(poll_interval=0.01)
+        worker.run(once=True)
+        self.assertEqual(worker.failed, 0)
+        self.assertFalse(Job.objects.filter(name='journal_data.generate_derivatives').exists())
+        with PILImage.open(derivative_path(sha, 'thumb')) as image:
+            self.assertEqual(image.size, (32, 16))
+
+
+@override_settings(JOURNAL_IMAGE_ROOT=IMAGE_ROOT, JOURNAL_UPLOAD_CHUNK_MAX_SIZE=1000)
+class ChunkedUploadTests(TestCase):
+    """分块上传: 按偏移续传, 分块和整体校验"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='uploads', email='uploads@example.com', password='uploads-password')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.content = uuid.uuid4().bytes * 160
+        self.sha = hashlib.sha256(self.content).hexdigest()
+
+    def create(self, size=None):
+        response = self.client.post(
+            '/journals/uploads/', {'sha256': self.sha, 'size': size or len(self.content), 'content_type': 'image/png'},
+            format='json',
+        )
+        self.assertIn(response.status_code, (200, 201), response.content)
+        return response.json()
+
+    def put_chunk(self, session_id, offset, chunk, sha256=None):
+        return self.client.generic(
+            'PUT', f'/journals/uploads/{session_id}/', chunk, content_type='application/octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset), HTTP_UPLOAD_CHUNK_SHA256=sha256 or hashlib.sha256(chunk).hexdigest(),
+        )
+
+    def test_resumable_upload(self):
+        session = self.create()
+        self.assertEqual((session['offset'], session['chunk_size']), (0, 1000))
+        self.assertEqual(self.put_chunk(session['id'], 0, self.content[:1000]).json()['offset'], 1000)
+
+        # 分块损坏: 丢弃该分块, offset 不变
+        response = self.put_chunk(session['id'], 1000, self.content[1000:2000], sha256='00' * 32)
+        self.assertEqual((response.status_code, response.json()['offset']), (400, 1000))
+        # 偏移不一致: 返回当前 offset
+        response = self.put_chunk(session['id'], 2000, self.content[2000:2560])
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 1000))
+        self.assertEqual(self.put_chunk(session['id'], 1000, self.content[1000:2001]).status_code, 413)
+        commit = self.client.post(f"/journals/uploads/{session['id']}/commit/")
+        self.assertEqual(commit.status_code, 409)
+
+        # 客户端丢失会话 id 后重新声明, 得到同一会话并从 offset 续传
+        resumed = self.create()
+        self.assertEqual((resumed['id'], resumed['offset']), (session['id'], 1000))
+        self.assertEqual(self.put_chunk(session['id'], 1000, self.content[1000:2000]).status_code, 200)
+        self.assertEqual(self.put_chunk(session['id'], 2000, self.content[2000:]).json()['offset'], len(self.content))
+
+        commit = self.client.post(f"/journals/uploads/{session['id']}/commit/")
+        self.assertEqual(commit.status_code, 201, commit.content)
+        self.assertFalse(UploadSession.objects.exists())
+        response = self.client.get(f'/journals/images/{self.sha}/')
+        self.assertEqual((b''.join(response.streaming_content), response['Content-Type']), (self.content, 'image/png'))
+        # 已有的图片不再创建会话
+        self.assertEqual(self.create(), {'sha256': self.sha, 'size': len(self.content), 'content_type': 'image/png', 'created': False})
+
+    def test_commit_verifies_whole_file(self):
+        session = self.create(size=1000)
+        self.put_chunk(session['id'], 0, self.content[:1000])
+        commit = self.client.post(f"/journals/uploads/{session['id']}/commit/")
+        self.assertEqual(commit.status_code, 400)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(Image.objects.exists())
+
+    def test_purge_expired(self):
+        session = self.create()
+        self.put_chunk(session['id'], 0, self.content[:1000])
+        part_path = UploadSession.objects.get().part_path
+        self.assertTrue(part_path.exists())
+        UploadSession.objects.update(updated_at=datetime.now() - timedelta(days=2))
+        call_command('purge_uploads', stdout=io.StringIO())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(part_path.exists())
+        self.assertEqual(self.client.get(f"/journals/uploads/{session['id']}/").status_code, 404)
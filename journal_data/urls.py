@@ -1,8 +1,23 @@
 from django.urls import path
-from .views import EntryListCreateView, EntryRetrieveUpdateDestroyView, SyncDataView
+from .views import (
+    AsyncEntryListView, EntryListCreateView, EntryRetrieveUpdateDestroyView, EntrySearchView, EntryGeoView,
+    EntryImageListView, ImageCheckView, ImageDerivativeView, ImageView, UploadCommitView, UploadSessionCreateView, UploadSessionView,
+    SyncDataView, EntryCacheStatsView
+)
 
 urlpatterns = [
     path('entries/', EntryListCreateView.as_view(), name='entry-list-create'),
+    path('async/entries/', AsyncEntryListView.as_view(), name='entry-list-async'),
     path('entries/<int:pk>/', EntryRetrieveUpdateDestroyView.as_view(), name='entry-detail'),
+    path('entries/<int:pk>/images/', EntryImageListView.as_view(), name='entry-images'),
+    path('images/check/', ImageCheckView.as_view(), name='image-check'),
+    path('images/<str:sha256>/', ImageView.as_view(), name='image-detail'),
+    path('images/<str:sha256>/<str:name>/', ImageDerivativeView.as_view(), name='image-derivative'),
+    path('uploads/', UploadSessionCreateView.as_view(), name='upload-create'),
+    path('uploads/<uuid:pk>/', UploadSessionView.as_view(), name='upload-detail'),
+    path('uploads/<uuid:pk>/commit/', UploadCommitView.as_view(), name='upload-commit'),
+    path('search/', EntrySearchView.as_view(), name='entry-search'),
+    path('geo/', EntryGeoView.as_view(), name='entry-geo'),
     path('sync/', SyncDataView.as_view(), name='sync-data'),
+    path('cache-stats/', EntryCacheStatsView.as_view(), name='entry-cache-stats'),
 ]
\ No newline at end of file
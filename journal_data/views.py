@@ -1,25 +1,69 @@
+from django.conf import settings
+from django.http import FileResponse, HttpResponseNotModified, HttpResponseRedirect, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework import generics
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
-from .models import JournalEntry
-from .serializers import EntrySerializer
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.utils.urls import replace_query_param
+from journal_server.async_views import AsyncAPIView, AsyncTokenUserAuthentication, json_response
+from journal_server.metrics import record_entries
+from .cache import cache_stats, serialize_entries
+from .changes import changes_since, parse_cursor
+from .conditional import aentries_condition, entries_condition
+from .derivatives import derivative_path, schedule_derivatives
+from .geo import entries_in_boxes, entry_clusters, haversine_distance, radius_box, split_antimeridian
+from .images import (
+    UPLOAD_CHUNK_SIZE, ImageUploadError, commit_upload, image_path, is_sha256, iter_file_range,
+    parse_byte_range, store_image, write_chunk
+)
+from .ingest import IngestValidationError, ingest_entries
+from .models import EntryImage, Image, JournalEntry, UploadSession
+from .pagination import EntryCursorPagination
+from .search import search_entries
+from .serializers import ENTRY_VALUE_FIELDS, EntrySerializer
 
 class EntryListCreateView(generics.ListCreateAPIView):
     """
     日记条目列表创建视图
-    支持列出和创建用户日记条目
+    支持列出和创建用户日记条目, 列表按 (date, id) 游标分页并支持 If-None-Match
     """
     serializer_class = EntrySerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = EntryCursorPagination
 
     def get_queryset(self):
-        return JournalEntry.objects.filter(user=self.request.user).order_by('-date')
+        return JournalEntry.objects.filter(user=self.request.user).order_by('-date', '-id')
+
+    @entries_condition
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset().values(*ENTRY_VALUE_FIELDS))
+        return self.get_paginated_response(serialize_entries(page))
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+class AsyncEntryListView(AsyncAPIView):
+    """
+    日记条目列表的异步版本
+    分页、ETag 和响应格式与 EntryListCreateView 的 GET 相同, 查询使用异步 ORM;
+    只按 user_id 查询, 认证时不读取用户
+    """
+    authentication_class = AsyncTokenUserAuthentication
+    pagination_class = EntryCursorPagination
+
+    @aentries_condition
+    async def get(self, request):
+        paginator = self.pagination_class()
+        queryset = JournalEntry.objects.filter(user_id=request.user.pk).values(*ENTRY_VALUE_FIELDS)
+        page = await paginator.apaginate_queryset(queryset, request)
+        return json_response(paginator.get_paginated_data(serialize_entries(page)))
+
 class EntryRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
     """
     日记条目详情视图
@@ -31,32 +75,492 @@ class EntryRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
     def get_queryset(self):
         return JournalEntry.objects.filter(user=self.request.user)
 
+class EntrySearchView(APIView):
+    """
+    日记全文搜索视图
+    GET 参数 q 为空白分隔的关键词, 返回同时包含全部关键词的条目,
+    按相关度排序并带高亮摘要; page / page_size 分页
+    """
+    permission_classes = [IsAuthenticated]
+    page_size = 20
+    max_page_size = 100
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({
+                'error': '缺少搜索关键词',
+                'code': 400
+            }, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page = int(request.query_params.get('page', 1))
+            page_size = min(int(request.query_params.get('page_size', self.page_size)), self.max_page_size)
+        except ValueError:
+            page = page_size = 0
+        if page < 1 or page_size < 1:
+            return Response({
+                'error': '无效的分页参数',
+                'code': 400
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # 多取一条用于判断是否还有下一页
+        hits = search_entries(request.user, query, page_size + 1, (page - 1) * page_size)
+        next_link = None
+        if len(hits) > page_size:
+            next_link = replace_query_param(request.build_absolute_uri(), 'page', page + 1)
+        return Response({
+            'next': next_link,
+            'results': hits[:page_size]
+        })
+
+class EntryGeoView(APIView):
+    """
+    地图查询视图
+    GET 以 bbox=south,west,north,east 查询视口内的条目 (west 大于 east 表示跨越 180 度经线),
+    或以 latitude, longitude, radius (米) 查询附近的条目, 结果按距离排序并带 distance。
+    mode 为 entries 时返回条目, clusters 时按 geohash 单元返回数量和中心点,
+    默认 auto: 条目数不超过 limit 时返回条目, 否则返回聚合结果。
+    查询按 (user, geohash) 索引只读取视口内的条目, 代价与日记总量无关
+    """
+    permission_classes = [IsAuthenticated]
+    default_limit = 500
+    max_limit = 2000
+    max_radius = 1000 * 1000
+    modes = ('auto', 'entries', 'clusters')
+
+    def get(self, request):
+        try:
+            boxes, center = self.parse_area(request.query_params)
+            mode = request.query_params.get('mode', 'auto')
+            if mode not in self.modes:
+                raise ValueError(f'mode 必须是 {", ".join(self.modes)} 之一')
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+            precision = request.query_params.get('precision')
+            precision = int(precision) if precision else None
+            if limit < 1 or (precision is not None and precision < 1):
+                raise ValueError('limit 和 precision 必须是正整数')
+        except ValueError as e:
+            return Response({
+                'error': '无效的查询范围',
+                'details': str(e),
+                'code': 400
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        entries = JournalEntry.objects.filter(user=request.user)
+        if mode != 'clusters':
+            if center is None:
+                rows = entries_in_boxes(entries.values(*ENTRY_VALUE_FIELDS), boxes, limit + 1)
+            else:
+                rows = self.nearby(entries, boxes, center)
+            if len(rows) <= limit or mode == 'entries':
+                results = serialize_entries(rows[:limit])
+                if center is not None:
+                    results = [{**result, 'distance': round(row['distance'], 1)} for result, row in zip(results, rows)]
+                return Response({
+                    'type': 'entries',
+                    'truncated': len(rows) > limit,
+                    'results': results
+                })
+
+        return Response({
+            'type': 'clusters',
+            'results': entry_clusters(entries, boxes, precision)
+        })
+
+    def parse_area(self, params):
+        if 'bbox' in params:
+            try:
+                south, west, north, east = (float(value) for value in params['bbox'].split(','))
+            except ValueError:
+                raise ValueError('bbox 必须是 south,west,north,east 四个数')
+            if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+                raise ValueError('bbox 超出经纬度范围')
+            return split_antimeridian(south, west, north, east), None
+
+        try:
+            latitude = float(params['latitude'])
+            longitude = float(params['longitude'])
+            radius = float(params['radius'])
+        except KeyError:
+            raise ValueError('需要 bbox, 或 latitude, longitude 和 radius')
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180 and 0 < radius <= self.max_radius):
+            raise ValueError(f'坐标超出范围, 或 radius 不在 (0, {self.max_radius}] 内')
+        return split_antimeridian(*radius_box(latitude, longitude, radius)), (latitude, longitude, radius)
+
+    def nearby(self, entries, boxes, center):
+        """外接矩形内的条目中取出圆内的部分, 按距离排序"""
+        latitude, longitude, radius = center
+        rows = []
+        for row in entries_in_boxes(entries.values(*ENTRY_VALUE_FIELDS), boxes, None):
+            row['distance'] = haversine_distance(latitude, longitude, row['latitude'], row['longitude'])
+            if row['distance'] <= radius:
+                rows.append(row)
+        rows.sort(key=lambda row: row['distance'])
+        return rows
+
+def image_response(image, created):
+    return Response({
+        'sha256': image.sha256,
+        'size': image.size,
+        'content_type': image.content_type,
+        'created': created
+    }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+def upload_error_response(e, session=None):
+    data = {
+        'error': '图片上传失败',
+        'details': str(e),
+        'code': e.status
+    }
+    if session is not None:
+        data['offset'] = session.received
+    return Response(data, status=e.status)
+
+def upload_session_data(session):
+    return {
+        'id': session.pk,
+        'sha256': session.sha256,
+        'size': session.size,
+        'offset': session.received,
+        'chunk_size': settings.JOURNAL_UPLOAD_CHUNK_MAX_SIZE,
+        'expires_at': session.updated_at + settings.JOURNAL_UPLOAD_SESSION_TTL,
+    }
+
+def upload_session_not_found():
+    return Response({
+        'error': '上传会话不存在',
+        'code': 404
+    }, status=status.HTTP_404_NOT_FOUND)
+
+class ImageCheckView(APIView):
+    """
+    图片查重视图
+    POST hashes 为客户端待上传图片的 sha256 列表, 返回服务端还没有的部分,
+    客户端只需上传这些图片
+    """
+    permission_classes = [IsAuthenticated]
+    max_hashes = 1000
+
+    def post(self, request):
+        hashes = request.data.get('hashes')
+        if (
+            not isinstance(hashes, list) or len(hashes) > self.max_hashes
+            or not all(is_sha256(value) for value in hashes)
+        ):
+            return Response({
+                'error': '无效的图片哈希',
+                'details': f'hashes 必须是不超过 {self.max_hashes} 个小写十六进制 sha256 的列表',
+                'code': 400
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        hashes = list(dict.fromkeys(hashes))
+        existing = set(Image.objects.filter(user=request.user, sha256__in=hashes).values_list('sha256', flat=True))
+        return Response({
+            'missing': [value for value in hashes if value not in existing]
+        })
+
+class ImageView(APIView):
+    """
+    图片视图
+    PUT 以请求体上传 sha256 对应的图片内容, 服务端校验哈希后保存, 已有该图片时不再写入;
+    GET 下载图片, 内容由哈希决定永不改变, 因此带长期缓存头和以哈希为值的 ETag
+    """
+    permission_classes = [IsAuthenticated]
+
+    def not_found(self):
+        return Response({
+            'error': '图片不存在',
+            'code': 404
+        }, status=status.HTTP_404_NOT_FOUND)
+
+    def get(self, request, sha256):
+        image = Image.objects.filter(user=request.user, sha256=sha256).first()
+        if image is None:
+            return self.not_found()
+        etag = f'"{sha256}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        else:
+            try:
+                f = open(image_path(sha256), 'rb')
+            except FileNotFoundError:
+                return self.not_found()
+            response = self.file_response(request, f, image, etag)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+
+    def file_response(self, request, f, image, etag):
+        """按 Range 头返回整个文件或其中一段, 内容都从磁盘逐块读出"""
+        size = image.size
+        byte_range = None
+        if request.headers.get('If-Range', etag) == etag:
+            try:
+                byte_range = parse_byte_range(request.headers.get('Range'), size)
+            except ValueError:
+                f.close()
+                response = Response({
+                    'error': '无法满足的请求范围',
+                    'code': 416
+                }, status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+        if byte_range is None:
+            response = FileResponse(f, content_type=image.content_type)
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                iter_file_range(f, start, end - start + 1),
+                status=status.HTTP_206_PARTIAL_CONTENT,
+                content_type=image.content_type,
+            )
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    def put(self, request, sha256):
+        if not is_sha256(sha256):
+            return self.not_found()
+        image = Image.objects.filter(user=request.user, sha256=sha256).first()
+        created = image is None
+        if created:
+            try:
+                # 直接读取原始请求体, 不经过解析器, 内存中只保留一个块
+                size = store_image(iter(lambda: request.read(UPLOAD_CHUNK_SIZE), b''), sha256)
+            except ImageUploadError as e:
+                return Response({
+                    'error': '图片上传失败',
+                    'details': str(e),
+                    'code': e.status
+                }, status=e.status)
+            image, created = Image.objects.get_or_create(
+                user=request.user, sha256=sha256,
+                defaults={'size': size, 'content_type': (request.content_type or 'application/octet-stream')[:100]},
+            )
+            if created:
+                schedule_derivatives(sha256)
+        return image_response(image, created)
+
+class ImageDerivativeView(APIView):
+    """
+    图片缩略图视图
+    GET 返回 JOURNAL_IMAGE_DERIVATIVES 中指定尺寸的缩略图, 缩略图在上传时由后台任务生成,
+    与原图一样带长期缓存头; 尚未生成 (或未安装 Pillow) 时安排生成并临时重定向到原图
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, sha256, name):
+        if name not in settings.JOURNAL_IMAGE_DERIVATIVES or not Image.objects.filter(
+            user=request.user, sha256=sha256
+        ).exists():
+            return Response({
+                'error': '图片不存在',
+                'code': 404
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        etag = f'"{sha256}-{name}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        else:
+            try:
+                response = FileResponse(open(derivative_path(sha256, name), 'rb'), content_type='image/jpeg')
+            except FileNotFoundError:
+                schedule_derivatives(sha256)
+                response = HttpResponseRedirect(reverse('image-detail', args=[sha256]))
+                # 重定向只是临时的, 客户端不能缓存, 缩略图生成后下次请求即可拿到
+                response['Cache-Control'] = 'no-store'
+                return response
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+
+class UploadSessionCreateView(APIView):
+    """
+    分块上传会话创建视图
+    POST sha256, size 和可选的 content_type 声明要上传的图片:
+    用户已有该图片时直接返回图片信息 (200), 已有未完成的同一图片会话时返回该会话以便续传,
+    否则创建新会话 (201)。上传完成后图片与单次上传的图片相同, 在 images_json 中以 sha256 引用
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        sha256 = request.data.get('sha256')
+        size = request.data.get('size')
+        content_type = request.data.get('content_type') or 'application/octet-stream'
+        max_size = settings.JOURNAL_IMAGE_MAX_SIZE
+        if not is_sha256(sha256) or not isinstance(size, int) or not 0 < size <= max_size:
+            return Response({
+                'error': '无效的上传参数',
+                'details': f'需要小写十六进制的 sha256, 以及 1 到 {max_size} 之间的 size',
+                'code': 400
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        image = Image.objects.filter(user=request.user, sha256=sha256).first()
+        if image is not None:
+            return image_response(image, False)
+
+        session = UploadSession.objects.filter(user=request.user, sha256=sha256).first()
+        if session is not None and session.size == size:
+            return Response(upload_session_data(session))
+        if session is not None:
+            session.discard()
+        session = UploadSession.objects.create(
+            user=request.user, sha256=sha256, size=size, content_type=str(content_type)[:100]
+        )
+        return Response(upload_session_data(session), status=status.HTTP_201_CREATED)
+
+class UploadSessionView(APIView):
+    """
+    分块上传会话视图
+    GET 返回会话当前的 offset, 客户端中断后从这里续传;
+    PUT 上传一个分块, 请求头 Upload-Offset 必须等于当前 offset, Upload-Chunk-Sha256 为分块的 sha256,
+    校验不通过时该分块被丢弃, 偏移不一致时返回 409 和当前 offset;
+    DELETE 放弃上传
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_session(self, request, pk):
+        return UploadSession.objects.filter(user=request.user, pk=pk).first()
+
+    def get(self, request, pk):
+        session = self.get_session(request, pk)
+        if session is None:
+            return upload_session_not_found()
+        return Response(upload_session_data(session))
+
+    def put(self, request, pk):
+        session = self.get_session(request, pk)
+        if session is None:
+            return upload_session_not_found()
+        chunk_sha256 = request.headers.get('Upload-Chunk-Sha256', '').lower()
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            offset = None
+        if offset is None or not is_sha256(chunk_sha256):
+            return Response({
+                'error': '无效的分块',
+                'details': '需要 Upload-Offset 和 Upload-Chunk-Sha256 请求头',
+                'code': 400
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if offset != session.received or offset >= session.size:
+            return upload_error_response(ImageUploadError('上传偏移不一致', status=409), session)
+
+        max_size = min(settings.JOURNAL_UPLOAD_CHUNK_MAX_SIZE, session.size - offset)
+        try:
+            # 直接读取原始请求体, 不经过解析器, 内存中只保留一个块
+            size = write_chunk(
+                session.part_path, offset, iter(lambda: request.read(UPLOAD_CHUNK_SIZE), b''), chunk_sha256, max_size
+            )
+        except ImageUploadError as e:
+            if e.status == status.HTTP_409_CONFLICT:
+                # 临时文件丢失或被截断, 从文件实际的长度重新开始
+                actual = session.part_path.stat().st_size if session.part_path.exists() else 0
+                UploadSession.objects.filter(pk=session.pk).update(received=min(actual, session.received))
+                session.refresh_from_db()
+            return upload_error_response(e, session)
+
+        # 以 offset 为条件推进, 同一偏移的并发分块只有一个生效
+        updated = UploadSession.objects.filter(pk=session.pk, received=offset).update(
+            received=offset + size, updated_at=timezone.now()
+        )
+        session.refresh_from_db()
+        if not updated:
+            return upload_error_response(ImageUploadError('上传偏移不一致', status=409), session)
+        return Response(upload_session_data(session))
+
+    def delete(self, request, pk):
+        session = self.get_session(request, pk)
+        if session is None:
+            return upload_session_not_found()
+        session.discard()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class UploadCommitView(APIView):
+    """
+    分块上传提交视图
+    POST 在全部分块接收后校验整个文件的 sha256, 一致时移入图片存储并删除会话;
+    不一致时会话作废, 需要重新上传
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk):
+        session = UploadSession.objects.filter(user=request.user, pk=pk).first()
+        if session is None:
+            return upload_session_not_found()
+        if session.received != session.size:
+            return upload_error_response(ImageUploadError('上传尚未完成', status=409), session)
+        try:
+            commit_upload(session.part_path, session.sha256)
+        except ImageUploadError as e:
+            session.discard()
+            return upload_error_response(e)
+        image, created = Image.objects.get_or_create(
+            user=request.user, sha256=session.sha256,
+            defaults={'size': session.size, 'content_type': session.content_type},
+        )
+        session.delete()
+        if created:
+            schedule_derivatives(image.sha256)
+        return image_response(image, created)
+
+class EntryImageListView(APIView):
+    """
+    条目图片视图
+    返回条目 images_json 中引用的图片, 按顺序带 sha256、原始地址、是否已上传以及下载地址
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        if not JournalEntry.objects.filter(user=request.user, pk=pk).exists():
+            return Response({
+                'error': '条目不存在',
+                'code': 404
+            }, status=status.HTTP_404_NOT_FOUND)
+        refs = list(EntryImage.objects.filter(entry_id=pk).order_by('position').values('position', 'sha256', 'source'))
+        uploaded = set(Image.objects.filter(
+            user=request.user, sha256__in=[ref['sha256'] for ref in refs if ref['sha256']]
+        ).values_list('sha256', flat=True))
+        for ref in refs:
+            ref['uploaded'] = ref['sha256'] in uploaded
+            ref['url'] = reverse('image-detail', args=[ref['sha256']]) if ref['uploaded'] else None
+        return Response({'results': refs})
+
 class SyncDataView(APIView):
     """
     数据同步视图
     处理客户端与服务端之间的日记数据同步
+    GET 通过 cursor 参数增量拉取 seq 大于游标的条目和删除记录, 不带游标时从头拉取;
+    条目没有变化时按 If-None-Match 返回 304
     """
     permission_classes = [IsAuthenticated]
     
+    @entries_condition
     def get(self, request):
         try:
-            last_sync_time = request.query_params.get('last_sync_time')
+            try:
+                cursor = parse_cursor(request.query_params.get('cursor'))
+            except ValueError:
+                return Response({
+                    'error': '无效的同步游标',
+                    'code': 400
+                }, status=status.HTTP_400_BAD_REQUEST)
             user = request.user
             
-            if last_sync_time:
-                entries = JournalEntry.objects.filter(
-                    user=user,
-                    date__gt=last_sync_time
-                ).order_by('-date')
-            else:
-                entries = JournalEntry.objects.filter(user=user).order_by('-date')
+            changes = changes_since(user, cursor)
             
-            serializer = EntrySerializer(entries, many=True)
+            data = serialize_entries(changes.entries)
+            record_entries(request, len(data) + len(changes.deleted))
             user.last_data_sync_time = timezone.now()
-            user.save()
+            user.save(update_fields=['last_data_sync_time'])
             
             return Response({
-                'entries': serializer.data,
+                'entries': data,
+                'deleted': changes.deleted,
+                'cursor': changes.cursor,
+                'has_more': changes.has_more,
+                'reset': changes.reset,
                 'last_sync_time': user.last_data_sync_time
             })
             
@@ -76,24 +580,29 @@ class SyncDataView(APIView):
         try:
             user = request.user
             entries_data = request.data.get('entries', [])
-            
-            for entry_data in entries_data:
-                entry_data['user'] = user.id
-                serializer = EntrySerializer(data=entry_data)
-                if serializer.is_valid():
-                    serializer.save()
-                else:
-                    return Response({
-                        'error': '无效的条目数据',
-                        'details': serializer.errors,
-                        'code': 400
-                    }, status=status.HTTP_400_BAD_REQUEST)
-            
+            if not isinstance(entries_data, list):
+                return Response({
+                    'error': '无效的条目数据',
+                    'details': 'entries 必须是列表',
+                    'code': 400
+                }, status=status.HTTP_400_BAD_REQUEST)
+            record_entries(request, len(entries_data))
+
+            try:
+                results = ingest_entries(user, entries_data)
+            except IngestValidationError as e:
+                return Response({
+                    'error': '无效的条目数据',
+                    'details': e.errors,
+                    'code': 400
+                }, status=status.HTTP_400_BAD_REQUEST)
+
             user.last_data_sync_time = timezone.now()
-            user.save()
-            
+            user.save(update_fields=['last_data_sync_time'])
+
             return Response({
                 'message': '数据同步成功',
+                'results': results,
                 'last_sync_time': user.last_data_sync_time
             })
             
@@ -108,3 +617,13 @@ class SyncDataView(APIView):
                 'details': str(e),
                 'code': 500
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class EntryCacheStatsView(APIView):
+    """
+    条目缓存统计视图
+    返回本进程条目缓存的命中次数、未命中次数和命中率, 用于评估缓存容量
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(cache_stats())
@@ -0,0 +1,383 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+# 指标名到 (类型, 说明)
+METRICS = {
+    'journal_http_requests_total': ('counter', '按路由、方法和状态码统计的请求数'),
+    'journal_http_request_duration_seconds': ('histogram', '请求处理耗时 (秒)'),
+    'journal_http_db_queries': ('histogram', '每个请求执行的 SQL 语句数'),
+    'journal_http_db_query_duration_seconds': ('histogram', '每个请求的 SQL 执行总耗时 (秒)'),
+    'journal_http_request_size_bytes': ('histogram', '请求体字节数'),
+    'journal_http_response_size_bytes': ('histogram', '响应体字节数 (压缩后)'),
+    'journal_sync_entries': ('histogram', '同步接口每个请求收发的条目数 (含删除记录)'),
+}
+
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+ENTRY_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000)
+
+# 直方图的桶上界; 字符串表示从同名配置读取
+HISTOGRAM_BUCKETS = {
+    'journal_http_request_duration_seconds': 'JOURNAL_METRICS_LATENCY_BUCKETS',
+    'journal_http_db_queries': QUERY_BUCKETS,
+    'journal_http_db_query_duration_seconds': 'JOURNAL_METRICS_LATENCY_BUCKETS',
+    'journal_http_request_size_bytes': SIZE_BUCKETS,
+    'journal_http_response_size_bytes': SIZE_BUCKETS,
+    'journal_sync_entries': ENTRY_BUCKETS,
+}
+
+
+def histogram_buckets(name):
+    buckets = HISTOGRAM_BUCKETS[name]
+    return tuple(getattr(settings, buckets)) if isinstance(buckets, str) else buckets
+
+
+class MetricsStore:
+    """
+    进程内的指标, 定期写入 JOURNAL_METRICS_DIR 下以进程号命名的文件
+
+    计数器按 (指标名, 标签) 累加; 直方图只记录落入的桶, 导出时再累计成 Prometheus 的
+    le 桶, 每次观测只更新一个桶。有新数据时最多每 JOURNAL_METRICS_FLUSH_INTERVAL 秒
+    原子地重写一次本进程的文件, 进程退出时再写一次; /metrics 合并目录下所有进程的文件,
+    所以多个工作进程的数据能汇总到一起。已退出进程的文件保留, 计数不会因为进程重启而回退;
+    部署新版本 (启动工作进程前) 时应清空该目录。
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        self._pid = None
+
+    @property
+    def path(self):
+        return Path(settings.JOURNAL_METRICS_DIR) / f'metrics-{os.getpid()}.json'
+
+    def _check_process(self):
+        # fork 出的子进程不继承父进程的计数; 进程号被复用时接着之前同号进程的文件继续累加
+        pid = os.getpid()
+        if pid != self._pid:
+            self._pid = pid
+            self._timer = None
+            self._counters, self._histograms = {}, {}
+            merge_metrics(self._counters, self._histograms, read_metrics_file(self.path))
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self._lock:
+            self._check_process()
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._schedule_flush()
+
+    def observe(self, name, labels, value):
+        buckets = histogram_buckets(name)
+        index = bisect_left(buckets, value)
+        key = (name, labels)
+        with self._lock:
+            self._check_process()
+            counts = self._histograms.get(key)
+            if counts is None or len(counts) != len(buckets) + 2:
+                # 末尾两项为 +Inf 桶和总和
+                counts = self._histograms[key] = [0] * (len(buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._timer is None:
+            self._timer = threading.Timer(settings.JOURNAL_METRICS_FLUSH_INTERVAL, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def snapshot(self):
+        """返回本进程的 {'counters': [...], 'histograms': [...]}"""
+        with self._lock:
+            self._check_process()
+            return {
+                'counters': [
+                    [name, [list(pair) for pair in labels], value]
+                    for (name, labels), value in self._counters.items()
+                ],
+                'histograms': [
+                    [name, [list(pair) for pair in labels], list(counts)]
+                    for (name, labels), counts in self._histograms.items()
+                ],
+            }
+
+    def flush(self):
+        """把本进程的指标写入文件, 先写临时文件再替换, 读取方不会读到写了一半的文件"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._pid is None:
+                return
+        data = self.snapshot()
+        path = self.path
+        temp = path.with_name(f'.{path.name}.{threading.get_ident()}')
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp.write_text(json.dumps(data, separators=(',', ':')), encoding='utf-8')
+            os.replace(temp, path)
+        except OSError:
+            logger.exception(f"指标写入失败: {path}")
+
+    def clear(self):
+        """清空本进程的指标并删除它的文件"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._pid = None
+            self._timer = None
+            self._counters, self._histograms = {}, {}
+            self.path.unlink(missing_ok=True)
+
+
+def read_metrics_file(path):
+    try:
+        return json.loads(Path(path).read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logger.warning(f"指标文件无法读取, 已跳过: {path}")
+        return None
+
+
+def merge_metrics(counters, histograms, data):
+    """把一个进程的指标累加到 counters / histograms 中; 桶配置不一致的直方图被跳过"""
+    if not data:
+        return
+    for name, labels, value in data.get('counters', []):
+        key = (name, tuple(map(tuple, labels)))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, counts in data.get('histograms', []):
+        if name not in HISTOGRAM_BUCKETS or len(counts) != len(histogram_buckets(name)) + 2:
+            continue
+        key = (name, tuple(map(tuple, labels)))
+        total = histograms.get(key)
+        histograms[key] = counts if total is None else [a + b for a, b in zip(total, counts)]
+
+
+metrics_store = MetricsStore()
+atexit.register(metrics_store.flush)
+
+
+def collect_metrics():
+    """合并所有进程的指标, 返回 (counters, histograms); 本进程的指标直接取内存中的最新值"""
+    counters, histograms = {}, {}
+    directory = Path(settings.JOURNAL_METRICS_DIR)
+    own = metrics_store.path
+    merge_metrics(counters, histograms, metrics_store.snapshot())
+    for path in sorted(directory.glob('metrics-*.json')):
+        if path != own:
+            merge_metrics(counters, histograms, read_metrics_file(path))
+    return counters, histograms
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return repr(value)
+
+
+def render_metrics():
+    """以 Prometheus 文本格式 (0.0.4) 输出所有进程汇总后的指标"""
+    counters, histograms = collect_metrics()
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+            continue
+        bounds = [_format_value(float(bound)) for bound in histogram_buckets(name)] + ['+Inf']
+        for (metric, labels), counts in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(counts[-1])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+class RequestMetrics:
+    """一个请求执行过程中累计的数据库查询和同步条目数"""
+    __slots__ = ('started', 'request_size', 'queries', 'query_time', 'entries')
+
+    def __init__(self, request_size):
+        self.started = time.perf_counter()
+        self.request_size = request_size
+        self.queries = 0
+        self.query_time = 0.0
+        self.entries = None
+
+
+_current = ContextVar('request_metrics', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    """数据库执行包装: 把语句数和耗时计入当前请求; sync_to_async 的线程中同样能取到当前请求"""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.query_time += time.perf_counter() - started
+
+
+def install_query_counter(connection):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+@receiver(connection_created)
+def count_connection_queries(sender, connection, **kwargs):
+    install_query_counter(connection)
+
+
+def record_entries(request, count):
+    """
+    记录同步接口本次请求收发的条目数, 导出为 journal_sync_entries 直方图
+    流式响应可以在生成内容时分多次调用; 没有经过 MetricsMiddleware 的请求忽略
+    """
+    metrics = getattr(request, 'request_metrics', None)
+    if metrics is not None:
+        metrics.entries = (metrics.entries or 0) + count
+
+
+def route_label(request):
+    """按 URL 模式而不是实际路径分组, 避免 pk 等参数让序列数无限增长"""
+    match = getattr(request, 'resolver_match', None)
+    return match.route if match is not None else '<unmatched>'
+
+
+def start_request(request):
+    """开始统计一个请求, 返回 (RequestMetrics, 上下文变量的 token)"""
+    for connection in connections.all(initialized_only=True):
+        install_query_counter(connection)
+    try:
+        request_size = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        request_size = 0
+    metrics = RequestMetrics(request_size)
+    request.request_metrics = metrics
+    return metrics, _current.set(metrics)
+
+
+def end_request(token):
+    """视图返回后不再把查询计入这个请求"""
+    _current.reset(token)
+
+
+def record_response(request, response, metrics):
+    """
+    记录请求的指标
+    流式响应在内容生成完毕或客户端断开时才记录, 耗时和字节数包含整个发送过程;
+    FileResponse 保留 wsgi.file_wrapper 的零拷贝发送, 字节数取 Content-Length
+    """
+    if response.streaming and getattr(response, 'file_to_stream', None) is None:
+        wrap = _acount_sequence if response.is_async else _count_sequence
+        response.streaming_content = wrap(response.streaming_content, request, response, metrics)
+    elif response.streaming:
+        try:
+            size = int(response.get('Content-Length') or 0)
+        except ValueError:
+            size = 0
+        finish_request(request, response, metrics, size)
+    else:
+        finish_request(request, response, metrics, len(response.content))
+    return response
+
+
+def finish_request(request, response, metrics, response_size):
+    route = (('route', route_label(request)), ('method', request.method))
+    metrics_store.inc('journal_http_requests_total', route + (('status', str(response.status_code)),))
+    metrics_store.observe('journal_http_request_duration_seconds', route, time.perf_counter() - metrics.started)
+    metrics_store.observe('journal_http_db_queries', route, metrics.queries)
+    metrics_store.observe('journal_http_db_query_duration_seconds', route, metrics.query_time)
+    metrics_store.observe('journal_http_request_size_bytes', route, metrics.request_size)
+    metrics_store.observe('journal_http_response_size_bytes', route, response_size)
+    if metrics.entries is not None:
+        metrics_store.observe('journal_sync_entries', route, metrics.entries)
+
+
+def _count_sequence(sequence, request, response, metrics):
+    size = 0
+    iterator = iter(sequence)
+    try:
+        while True:
+            # 每取一块都重新设置当前请求, 生成内容时执行的查询同样计入
+            token = _current.set(metrics)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _current.reset(token)
+            size += len(chunk)
+            yield chunk
+    finally:
+        finish_request(request, response, metrics, size)
+
+
+async def _acount_sequence(sequence, request, response, metrics):
+    size = 0
+    iterator = aiter(sequence)
+    try:
+        while True:
+            token = _current.set(metrics)
+            try:
+                chunk = await anext(iterator)
+            except StopAsyncIteration:
+                return
+            finally:
+                _current.reset(token)
+            size += len(chunk)
+            yield chunk
+    finally:
+        finish_request(request, response, metrics, size)
+
+
+def metrics_view(request):
+    """
+    Prometheus 抓取端点, 返回所有工作进程汇总后的指标
+    只允许 JOURNAL_METRICS_ALLOWED_IPS 中的地址访问, 为 None 时不限制
+    """
+    allowed = settings.JOURNAL_METRICS_ALLOWED_IPS
+    if allowed is not None and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,289 @@
+import gzip
+import io
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+from .metrics import end_request, record_response, start_request
+
+try:
+    import zstandard
+except ImportError:  # zstd 为可选依赖, 未安装时只协商 gzip
+    zstandard = None
+
+DECOMPRESSION_ERRORS = (zlib.error, EOFError) + ((zstandard.ZstdError,) if zstandard else ())
+
+COMPRESSIBLE_CONTENT_TYPES = (
+    'application/json',
+    'application/x-ndjson',
+    'text/',
+)
+
+re_accept_encoding = _lazy_re_compile(r'\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*')
+
+
+def parse_accept_encoding(header):
+    """解析 Accept-Encoding, 返回客户端可接受的编码集合 (q=0 的编码除外)"""
+    accepted = set()
+    for part in header.split(','):
+        match = re_accept_encoding.fullmatch(part)
+        if not match:
+            continue
+        coding, q = match.groups()
+        try:
+            if q is not None and float(q) <= 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding.lower())
+    return accepted
+
+
+# zstd 解压对象不能限制单次输出的大小, 按小块输入压缩数据, 每块解压后检查是否超出上限
+ZSTD_INPUT_CHUNK_SIZE = 1024
+
+
+def _gunzip(data, max_size):
+    """
+    解压 gzip 请求体, 最多输出 max_size + 1 字节; 数据被截断时抛出 EOFError
+
+    请求体可以由多个 gzip 成员拼接而成 (RFC 1952), 逐个解压后拼接;
+    成员之后的数据不是完整的 gzip 成员时同样视为无效
+    """
+    chunks = []
+    size = 0
+    while True:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunk = decompressor.decompress(data, max_size + 1 - size)
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > max_size:
+            break
+        if not decompressor.eof:
+            raise EOFError('压缩数据不完整')
+        data = decompressor.unused_data
+        if not data:
+            break
+    return b''.join(chunks)
+
+
+def _unzstd(data, max_size):
+    """解压 zstd 请求体, 超出 max_size 后停止; 数据被截断时抛出 EOFError"""
+    decompressor = zstandard.ZstdDecompressor().decompressobj()
+    view = memoryview(data)
+    chunks = []
+    size = 0
+    for start in range(0, len(view), ZSTD_INPUT_CHUNK_SIZE):
+        chunk = decompressor.decompress(view[start:start + ZSTD_INPUT_CHUNK_SIZE])
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > max_size:
+            return b''.join(chunks)
+        if decompressor.eof:
+            break
+    if not decompressor.eof:
+        raise EOFError('压缩数据不完整')
+    return b''.join(chunks)
+
+
+def negotiate_encoding(request):
+    """按 Accept-Encoding 选择响应编码, 优先 zstd; 客户端不接受任何可用编码时返回 None"""
+    accepted = parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if 'zstd' in accepted and zstandard is not None:
+        return 'zstd'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def mark_compressible(response):
+    """
+    标记一个 304 响应对应的 200 响应内容可压缩
+
+    304 没有响应体和 Content-Type, 中间件无法判断; 标记后按同样的协商结果
+    加上 Vary 并把强 ETag 降为弱 ETag, 与压缩后的 200 响应保持一致
+    """
+    response.compressible = True
+    return response
+
+
+def _weaken_etag(response):
+    # 与 Django 的 GZipMiddleware 一致, 压缩后的强 ETag 降为弱 ETag
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response.headers['ETag'] = 'W/' + etag
+
+
+def _stream_compressor(encoding):
+    """返回 (compress, finish): compress 压缩一块并立即刷出, 让客户端能尽早开始处理流式数据"""
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor().compressobj()
+        return (
+            lambda chunk: compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+            compressor.flush,
+        )
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return (
+        lambda chunk: compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH),
+        compressor.flush,
+    )
+
+
+def _compress_sequence(sequence, encoding):
+    compress, finish = _stream_compressor(encoding)
+    for item in sequence:
+        data = compress(item)
+        if data:
+            yield data
+    yield finish()
+
+
+async def _acompress_sequence(sequence, encoding):
+    compress, finish = _stream_compressor(encoding)
+    async for item in sequence:
+        data = compress(item)
+        if data:
+            yield data
+    yield finish()
+
+
+class CompressionMiddleware:
+    """
+    请求/响应压缩中间件
+
+    响应: 按 Accept-Encoding 协商 zstd (需安装 zstandard) 或 gzip, 小于
+    RESPONSE_COMPRESSION_MIN_SIZE 字节的响应不压缩, 流式响应逐块压缩; 以 mark_compressible
+    标记的 304 响应按同样的协商结果处理 ETag, 客户端缓存的 ETag 与压缩后的 200 响应一致。
+    请求: REQUEST_DECOMPRESSION_PATHS 下的接口接受 Content-Encoding 为 gzip / zstd 的请求体,
+    解压后交给视图 (gzip 可以由多个成员拼接), 解压后大小超过 REQUEST_DECOMPRESSION_MAX_SIZE 时返回 413,
+    请求体无法解压、被截断或带有多余的数据时返回 400。
+    同时支持同步和异步调用, 在 ASGI 下不会让异步视图退回线程中执行。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.decompress_request(request)
+        if response is None:
+            response = self.get_response(request)
+        return self.compress_response(request, response)
+
+    async def __acall__(self, request):
+        response = self.decompress_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return self.compress_response(request, response)
+
+    def decompress_request(self, request):
+        encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if not encoding or encoding == 'identity':
+            return None
+        if not request.path.startswith(tuple(settings.REQUEST_DECOMPRESSION_PATHS)):
+            return None
+
+        max_size = settings.REQUEST_DECOMPRESSION_MAX_SIZE
+        try:
+            if encoding == 'gzip':
+                body = _gunzip(request.body, max_size)
+            elif encoding == 'zstd' and zstandard is not None:
+                body = _unzstd(request.body, max_size)
+            else:
+                return HttpResponse(status=415)
+        except DECOMPRESSION_ERRORS as e:
+            return HttpResponse(f'无效的压缩请求体: {e}', status=400)
+        if len(body) > max_size:
+            return HttpResponse(status=413)
+
+        request._body = body
+        request._stream = io.BytesIO(body)
+        request.META['CONTENT_LENGTH'] = str(len(body))
+        del request.META['HTTP_CONTENT_ENCODING']
+        return None
+
+    def compress_response(self, request, response):
+        if response.status_code == 304:
+            if getattr(response, 'compressible', False):
+                patch_vary_headers(response, ('Accept-Encoding',))
+                if negotiate_encoding(request) is not None:
+                    _weaken_etag(response)
+            return response
+        # 支持 Range 的响应按原始字节计算区间, 压缩后区间就对不上了
+        if response.has_header('Content-Encoding') or response.has_header('Accept-Ranges'):
+            return response
+        content_type = response.get('Content-Type', '')
+        if not content_type.startswith(COMPRESSIBLE_CONTENT_TYPES):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate_encoding(request)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = _acompress_sequence(response.streaming_content, encoding)
+            else:
+                response.streaming_content = _compress_sequence(response.streaming_content, encoding)
+            del response.headers['Content-Length']
+        else:
+            if len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE:
+                return response
+            if encoding == 'zstd':
+                compressed = zstandard.ZstdCompressor().compress(response.content)
+            else:
+                compressed = gzip.compress(response.content, compresslevel=6)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        _weaken_etag(response)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+class MetricsMiddleware:
+    """
+    请求指标中间件
+
+    按路由 (URL 模式) 和方法记录请求数、耗时、SQL 语句数和执行时间、请求/响应字节数,
+    同步接口另外记录每个请求的条目数 (见 metrics.record_entries), 由 /metrics 以
+    Prometheus 文本格式导出。应放在 MIDDLEWARE 的第一位: 耗时包含其他中间件,
+    响应字节数为压缩后实际发送的大小。同时支持同步和异步调用。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics, token = start_request(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        return record_response(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics, token = start_request(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        return record_response(request, response, metrics)
@@ -47,10 +47,13 @@ INSTALLED_APPS = [
     "users",
     "sync",
     "journal_data",
+    "jobs",
 ]
 
 MIDDLEWARE = [
+    "journal_server.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "journal_server.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -83,10 +86,34 @@ WSGI_APPLICATION = "journal_server.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# SQLite 生产配置:
+# - WAL 模式下读写互不阻塞, synchronous=NORMAL 在 WAL 下仍能保证崩溃后数据库一致
+# - 写事务以 BEGIN IMMEDIATE 开始, 并发写入在 timeout 秒内排队等待写锁,
+#   避免两个读事务同时升级为写事务时直接报 "database is locked"
+# - 持久连接省去每个请求重新打开数据库和执行 PRAGMA 的开销
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # 负数单位为 KiB, 即 64 MiB
+    "temp_store": "MEMORY",
+}
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            "transaction_mode": "IMMEDIATE",
+            "timeout": 20,
+            "init_command": ";".join(
+                f"PRAGMA {name}={value}" for name, value in SQLITE_PRAGMAS.items()
+            ),
+        },
+        # 测试库使用文件而不是内存库, 多线程测试才能按生产配置并发访问
+        "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
     }
 }
 
@@ -109,6 +136,19 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# 密码哈希器: 第一个用于新密码, 其余用于校验已有的哈希; 改用 scrypt 时把它放到第一位。
+# 哈希在有界线程池中计算, 同时最多占用 JOURNAL_PASSWORD_HASH_WORKERS 个 CPU 核,
+# 排队超过 JOURNAL_PASSWORD_HASH_QUEUE 个时登录和注册返回 503
+PASSWORD_HASHERS = [
+    "users.hashers.PooledPBKDF2PasswordHasher",
+    "users.hashers.PooledScryptPasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+]
+JOURNAL_PBKDF2_ITERATIONS = 870000
+JOURNAL_SCRYPT_WORK_FACTOR = 2**14
+JOURNAL_PASSWORD_HASH_WORKERS = 2
+JOURNAL_PASSWORD_HASH_QUEUE = 32
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -133,13 +173,25 @@ STATIC_ROOT = BASE_DIR / "static"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# 测试运行期间指标文件、快照、图片和限流桶写到临时目录
+TEST_RUNNER = "journal_server.test_runner.JournalTestRunner"
+
 AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ),
      'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
+    # 登录和注册的令牌桶限流速率 ("次数/周期"), 见 users.throttling
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': '30/min',
+        'login_username': '10/min',
+        'register_ip': '10/hour',
+    },
+    # 限流按客户端 IP 计数时信任的代理层数: 0 表示只用 REMOTE_ADDR, 忽略客户端可以伪造的 X-Forwarded-For;
+    # 部署在反向代理之后时设为代理层数
+    'NUM_PROXIES': 0,
 }
 
 SIMPLE_JWT = {
@@ -147,3 +199,108 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
 }
 
+# JWT 认证的进程内用户缓存: 缓存时长 (秒) 和最多缓存的用户数, TTL 为 0 时不缓存。
+# 用户保存后本进程立即失效, 其他进程最多在 TTL 内使用旧的用户数据
+JOURNAL_AUTH_USER_CACHE_TTL = 60
+JOURNAL_AUTH_USER_CACHE_SIZE = 10000
+
+# 日记条目列表每页默认条数
+JOURNAL_ENTRY_PAGE_SIZE = 50
+
+# 批量写入条目时每个 INSERT/UPDATE 语句处理的条目数
+JOURNAL_INGEST_CHUNK_SIZE = 500
+
+# 增量拉取单次最多返回的条目数
+JOURNAL_SYNC_PULL_LIMIT = 1000
+
+# 流式返回全量数据时每次从数据库读取并序列化的条目数
+JOURNAL_SYNC_STREAM_CHUNK_SIZE = 500
+
+# 新设备初始化使用的用户快照目录, 以及触发快照重建的最少变更数
+JOURNAL_SNAPSHOT_ROOT = BASE_DIR / "snapshots"
+JOURNAL_SNAPSHOT_MIN_CHANGES = 100
+# 条目变更后延迟多久检查快照, 期间同一用户的多次变更只触发一次检查
+JOURNAL_SNAPSHOT_REBUILD_DELAY = timedelta(seconds=30)
+
+# 图片内容的存储目录 (按 sha256 寻址), 以及单张图片的最大字节数
+JOURNAL_IMAGE_ROOT = BASE_DIR / "images"
+JOURNAL_IMAGE_MAX_SIZE = 20 * 1024 * 1024
+
+# 分块上传: 单个分块的最大字节数, 以及会话在没有新分块后保留的时长
+JOURNAL_UPLOAD_CHUNK_MAX_SIZE = 4 * 1024 * 1024
+JOURNAL_UPLOAD_SESSION_TTL = timedelta(days=1)
+
+# 图片缩略图: 名称到最长边像素数, 生成缩略图的进程数和 JPEG 质量; 需要安装 Pillow。
+# 缩略图由后台任务 journal_data.generate_derivatives 生成, 进程池在 run_jobs 工作进程中创建
+JOURNAL_IMAGE_DERIVATIVES = {"thumb": 256, "medium": 1024}
+JOURNAL_DERIVATIVE_WORKERS = 2
+JOURNAL_DERIVATIVE_QUALITY = 82
+
+# 同步日志先在进程内缓冲, 攒够条数或最早的一条等待超过间隔 (秒) 后批量写入
+JOURNAL_SYNC_LOG_BUFFER_SIZE = 500
+JOURNAL_SYNC_LOG_FLUSH_INTERVAL = 5.0
+# 同步日志的保留时长, 更早的日志归并为每日汇总 (compact_synclog 命令 / 周期任务)
+JOURNAL_SYNC_LOG_RETENTION = timedelta(days=30)
+
+# 后台任务队列 (jobs 应用): 任务存放在数据库中, 由 `python manage.py run_jobs` 工作进程执行,
+# 不依赖外部消息队列。必须至少运行一个工作进程: 设备游标 (墓碑清理水位)、快照重建、缩略图生成
+# 和周期清理都由它执行。`python manage.py check --database default` 会报告长时间无人领取的任务。
+# JOBS_EAGER 为 True 时, 设备同步记录等开销很小的任务在请求中直接执行, 快照和缩略图仍然入队
+JOBS_EAGER = False
+JOBS_WORKER_CONCURRENCY = 2
+# 队列为空时的轮询间隔 (秒), 以及执行超过多久视为工作进程已退出、重新排队
+JOBS_POLL_INTERVAL = 1.0
+JOBS_LOCK_TIMEOUT = timedelta(minutes=10)
+# 周期任务: 任务名到执行间隔
+JOBS_PERIODIC = {
+    "sync.purge_stale_tombstones": timedelta(hours=6),
+    "sync.compact_expired_sync_logs": timedelta(days=1),
+    "journal_data.purge_expired_uploads": timedelta(hours=1),
+    "journal_data.optimize_search": timedelta(days=1),
+}
+
+# 响应压缩的最小字节数, 以及接受压缩请求体的接口和解压后的大小上限
+RESPONSE_COMPRESSION_MIN_SIZE = 1024
+REQUEST_DECOMPRESSION_PATHS = [
+    "/sync/push/",
+    "/sync/resolve-conflict/",
+    "/journals/sync/",
+]
+REQUEST_DECOMPRESSION_MAX_SIZE = 50 * 1024 * 1024
+
+# 请求指标 (/metrics): 各工作进程每隔 JOURNAL_METRICS_FLUSH_INTERVAL 秒把指标写入目录下
+# 以进程号命名的文件, 抓取时合并; 部署时在启动工作进程前清空该目录。
+# 只允许 JOURNAL_METRICS_ALLOWED_IPS 中的地址抓取, None 表示不限制
+JOURNAL_METRICS_DIR = BASE_DIR / "metrics"
+JOURNAL_METRICS_FLUSH_INTERVAL = 1.0
+JOURNAL_METRICS_ALLOWED_IPS = ["127.0.0.1", "::1"]
+# 请求耗时和 SQL 耗时直方图的桶上界 (秒)
+JOURNAL_METRICS_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# 缓存: default 为本地内存; entries 存放序列化后的日记条目, 按 LRU 淘汰,
+# 多进程部署时可以把它换成 Redis / Memcached 等共享后端
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "entries": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "journal-entries",
+        "TIMEOUT": 24 * 60 * 60,
+        "OPTIONS": {
+            "MAX_ENTRIES": 20000,
+        },
+    },
+    # 登录和注册限流的令牌桶, 存放在文件缓存中, 同一台机器上的多个工作进程共享计数;
+    # 多台机器部署时需换成 Redis 等共享后端
+    "throttle": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "throttle",
+        "TIMEOUT": 60 * 60,
+        "OPTIONS": {
+            "MAX_ENTRIES": 10000,
+        },
+    },
+}
+JOURNAL_ENTRY_CACHE = "entries"
+JOURNAL_THROTTLE_CACHE = "throttle"
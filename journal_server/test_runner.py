@@ -0,0 +1,35 @@
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from .metrics import metrics_store
+
+
+class JournalTestRunner(DiscoverRunner):
+    """
+    测试运行器: 整个测试运行期间把指标文件、快照、图片和限流桶写到临时目录,
+    不在项目目录下留下文件; 各测试类仍可用 override_settings 指定自己的目录
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._runtime_dir = tempfile.TemporaryDirectory(prefix='journal-test-')
+        root = Path(self._runtime_dir.name)
+        throttle = settings.JOURNAL_THROTTLE_CACHE
+        self._runtime_settings = override_settings(
+            JOURNAL_METRICS_DIR=root / 'metrics',
+            JOURNAL_SNAPSHOT_ROOT=root / 'snapshots',
+            JOURNAL_IMAGE_ROOT=root / 'images',
+            CACHES={**settings.CACHES, throttle: {**settings.CACHES[throttle], 'LOCATION': root / 'throttle'}},
+        )
+        self._runtime_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        # 清空本进程的指标, 退出时不再把测试产生的指标写入正式目录
+        metrics_store.clear()
+        self._runtime_settings.disable()
+        self._runtime_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
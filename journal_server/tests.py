@@ -0,0 +1,225 @@
+import gzip
+import json
+import tempfile
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.test import AsyncClient, TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from journal_data.cache import entry_cache
+from journal_data.models import JournalEntry
+from sync.synclog import sync_log_buffer
+from users.models import User
+from .metrics import metrics_store
+from .middleware import parse_accept_encoding, zstandard
+
+# 测试生成的快照和指标文件写到临时目录
+SNAPSHOT_ROOT = tempfile.mkdtemp(prefix='journal-snapshots-')
+METRICS_DIR = tempfile.mkdtemp(prefix='journal-metrics-')
+
+
+class CompressionTests(TestCase):
+    """CompressionMiddleware 的响应压缩协商和请求体解压"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='compress', email='compress@example.com', password='x')
+        for i in range(30):
+            JournalEntry.objects.create(user=cls.user, date=datetime(2024, 1, 1), text=f'entry {i} ' * 10)
+
+    def setUp(self):
+        self.addCleanup(entry_cache().clear)
+        self.addCleanup(sync_log_buffer.flush)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, path='/journals/entries/', encoding=None, **extra):
+        if encoding is not None:
+            extra['HTTP_ACCEPT_ENCODING'] = encoding
+        return self.client.get(path, **extra)
+
+    def push(self, body, encoding, path='/sync/push/'):
+        return self.client.generic('POST', path, body, content_type='application/json', HTTP_CONTENT_ENCODING=encoding)
+
+    def test_parse_accept_encoding(self):
+        self.assertEqual(parse_accept_encoding('gzip, zstd;q=0.5, br;q=0, deflate;q=x'), {'gzip', 'zstd'})
+        self.assertEqual(parse_accept_encoding(''), set())
+
+    def test_negotiation(self):
+        plain = self.get()
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        response = self.get(encoding='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertFalse(self.get(encoding='gzip;q=0, identity').has_header('Content-Encoding'))
+
+        if zstandard is not None:
+            response = self.get(encoding='gzip, zstd')
+            self.assertEqual(response['Content-Encoding'], 'zstd')
+            self.assertEqual(zstandard.ZstdDecompressor().decompress(response.content), plain.content)
+            self.assertEqual(self.get(encoding='gzip, zstd;q=0')['Content-Encoding'], 'gzip')
+
+    def test_min_size(self):
+        with override_settings(RESPONSE_COMPRESSION_MIN_SIZE=10**6):
+            response = self.get(encoding='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        # 是否压缩取决于 Accept-Encoding, 未压缩的响应同样需要 Vary
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_streaming_and_etag(self):
+        response = self.get('/sync/init/', encoding='gzip', HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        lines = gzip.decompress(b''.join(response.streaming_content)).splitlines()
+        self.assertEqual(len(lines), 31)
+
+        # 压缩后的强 ETag 降为弱 ETag, 仍可用于条件请求
+        response = self.get('/sync/pull/', encoding='gzip')
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        # 304 与压缩后的 200 响应带相同的弱 ETag, 不接受压缩的客户端拿到强 ETag
+        for path in ('/sync/pull/', '/journals/entries/'):
+            etag = self.get(path, encoding='gzip')['ETag']
+            not_modified = self.get(path, encoding='gzip', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual((not_modified.status_code, not_modified['ETag']), (304, etag))
+            self.assertIn('Accept-Encoding', not_modified['Vary'])
+            not_modified = self.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual((not_modified.status_code, not_modified['ETag']), (304, etag.removeprefix('W/')))
+
+    def test_request_decompression(self):
+        body = json.dumps({'changes': []}).encode()
+        self.assertEqual(self.push(gzip.compress(body), 'gzip').status_code, 200)
+        self.assertEqual(self.push(gzip.compress(body), 'br').status_code, 415)
+        self.assertEqual(self.push(b'not gzip', 'gzip').status_code, 400)
+        # 被截断的请求体返回 400, 而不是当作不完整的数据处理
+        self.assertEqual(self.push(gzip.compress(body)[:-8], 'gzip').status_code, 400)
+        self.assertEqual(self.push(b'', 'gzip').status_code, 400)
+        # 多个 gzip 成员拼接的请求体整体解压, 成员之后的多余数据返回 400
+        half = len(body) // 2
+        self.assertEqual(self.push(gzip.compress(body[:half]) + gzip.compress(body[half:]), 'gzip').status_code, 200)
+        self.assertEqual(self.push(gzip.compress(body) + b'trailing', 'gzip').status_code, 400)
+        self.assertEqual(self.push(gzip.compress(body) + gzip.compress(body)[:-8], 'gzip').status_code, 400)
+        # 不在 REQUEST_DECOMPRESSION_PATHS 中的接口不解压
+        self.assertEqual(self.push(gzip.compress(body), 'gzip', path='/journals/entries/').status_code, 400)
+
+        if zstandard is not None:
+            compressed = zstandard.ZstdCompressor().compress(body)
+            self.assertEqual(self.push(compressed, 'zstd').status_code, 200)
+            self.assertEqual(self.push(compressed[:-4], 'zstd').status_code, 400)
+            self.assertEqual(self.push(b'not zstd', 'zstd').status_code, 400)
+
+    @override_settings(REQUEST_DECOMPRESSION_MAX_SIZE=1000)
+    def test_max_size(self):
+        small = json.dumps({'changes': []}).encode()
+        large = json.dumps({'changes': [], 'padding': ' ' * 10**6}).encode()
+        self.assertEqual(self.push(gzip.compress(small), 'gzip').status_code, 200)
+        self.assertEqual(self.push(gzip.compress(large), 'gzip').status_code, 413)
+        # 上限按所有成员解压后的总大小计算
+        self.assertEqual(self.push(gzip.compress(small) + gzip.compress(b' ' * 1000), 'gzip').status_code, 413)
+        if zstandard is not None:
+            self.assertEqual(self.push(zstandard.ZstdCompressor().compress(small), 'zstd').status_code, 200)
+            self.assertEqual(self.push(zstandard.ZstdCompressor().compress(large), 'zstd').status_code, 413)
+
+
+@override_settings(JOURNAL_METRICS_DIR=METRICS_DIR, JOURNAL_SNAPSHOT_ROOT=SNAPSHOT_ROOT)
+class MetricsTests(TestCase):
+    """请求指标中间件和 /metrics 导出"""
+
+    def setUp(self):
+        metrics_store.clear()
+        self.addCleanup(metrics_store.clear)
+        self.addCleanup(entry_cache().clear)
+        self.user = User.objects.create_user(username='metrics', email='metrics@example.com', password='metrics-password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        changes = [
+            {'op': 'create', 'uuid': str(uuid.uuid4()), 'data': {'date': '2024-01-01T00:00:00', 'text': f'entry {i}'}}
+            for i in range(3)
+        ]
+        self.assertEqual(self.client.post('/sync/push/', {'changes': changes}, format='json').status_code, 200)
+
+    def scrape(self):
+        """抓取 /metrics, 返回 {序列: 值}"""
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if line and not line.startswith('#'):
+                series, value = line.rsplit(' ', 1)
+                samples[series] = float(value)
+        return samples
+
+    def test_request_metrics(self):
+        response = self.client.get('/sync/pull/', {'cursor': 0})
+        self.assertEqual(response.status_code, 200)
+        samples = self.scrape()
+
+        pull = 'route="sync/pull/",method="GET"'
+        push = 'route="sync/push/",method="POST"'
+        self.assertEqual(samples[f'journal_http_requests_total{{{pull},status="200"}}'], 1)
+        self.assertEqual(samples[f'journal_http_request_duration_seconds_count{{{pull}}}'], 1)
+        self.assertEqual(samples[f'journal_http_request_duration_seconds_bucket{{{pull},le="+Inf"}}'], 1)
+        self.assertEqual(samples[f'journal_http_response_size_bytes_sum{{{pull}}}'], len(response.content))
+        self.assertEqual(samples[f'journal_sync_entries_sum{{{pull}}}'], 3)
+        self.assertEqual(samples[f'journal_sync_entries_sum{{{push}}}'], 3)
+        self.assertGreater(samples[f'journal_http_db_queries_sum{{{push}}}'], 0)
+        self.assertGreater(samples[f'journal_http_db_query_duration_seconds_sum{{{push}}}'], 0)
+        self.assertGreater(samples[f'journal_http_request_size_bytes_sum{{{push}}}'], 0)
+        # 非同步接口不记录条目数; 路由按 URL 模式分组
+        self.client.get('/journals/entries/')
+        self.client.get('/no-such-page/')
+        samples = self.scrape()
+        self.assertIn('journal_http_requests_total{route="journals/entries/",method="GET",status="200"}', samples)
+        self.assertIn('journal_http_requests_total{route="<unmatched>",method="GET",status="404"}', samples)
+        self.assertNotIn('journal_sync_entries_count{route="journals/entries/",method="GET"}', samples)
+
+    def test_streaming_response(self):
+        response = self.client.get('/sync/init/', HTTP_ACCEPT='application/x-ndjson')
+        self.assertTrue(response.streaming)
+        # 流式响应在内容发送完毕后才记录
+        self.assertNotIn('journal_sync_entries_count{route="sync/init/",method="GET"}', self.scrape())
+        body = b''.join(response.streaming_content)
+        samples = self.scrape()
+        self.assertEqual(samples['journal_sync_entries_sum{route="sync/init/",method="GET"}'], 3)
+        self.assertEqual(samples['journal_http_response_size_bytes_sum{route="sync/init/",method="GET"}'], len(body))
+        self.assertGreater(samples['journal_http_db_queries_sum{route="sync/init/",method="GET"}'], 0)
+
+    def test_multiple_processes(self):
+        # 本进程的文件与内存中的指标一致; 其他进程的文件在抓取时累加
+        metrics_store.flush()
+        snapshot = metrics_store.snapshot()
+        self.assertEqual(json.loads(metrics_store.path.read_text()), snapshot)
+        other = Path(METRICS_DIR) / 'metrics-999999999.json'
+        other.write_text(json.dumps(snapshot))
+        self.addCleanup(other.unlink)
+
+        samples = self.scrape()
+        push = 'route="sync/push/",method="POST"'
+        self.assertEqual(samples[f'journal_http_requests_total{{{push},status="200"}}'], 2)
+        self.assertEqual(samples[f'journal_sync_entries_count{{{push}}}'], 2)
+        self.assertEqual(samples[f'journal_sync_entries_sum{{{push}}}'], 6)
+
+    def test_access(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 403)
+        with override_settings(JOURNAL_METRICS_ALLOWED_IPS=None):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    async def test_async_view(self):
+        response = await AsyncClient().get(
+            '/sync/async/pull/', {'cursor': 0}, headers={'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        )
+        self.assertEqual(response.status_code, 200)
+        samples = await sync_to_async(self.scrape)()
+        pull = 'route="sync/async/pull/",method="GET"'
+        self.assertEqual(samples[f'journal_sync_entries_sum{{{pull}}}'], 3)
+        # 异步 ORM 在线程中执行的查询同样计入
+        self.assertGreater(samples[f'journal_http_db_queries_sum{{{pull}}}'], 0)
@@ -21,6 +21,8 @@ from rest_framework.documentation import include_docs_urls
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from .metrics import metrics_view
+
 schema_view = get_schema_view(
     openapi.Info(
         title="Journal API",
@@ -38,4 +40,5 @@ urlpatterns = [
     path('docs/', include_docs_urls(title='API接口文档')),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('metrics', metrics_view, name='metrics'),
 ]
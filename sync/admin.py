@@ -1,11 +1,11 @@
 from django.contrib import admin
-from .models import SyncRecord, SyncLog
+from .models import SyncRecord, SyncLog, SyncLogDaily
 
 @admin.register(SyncRecord)
 class SyncRecordAdmin(admin.ModelAdmin):
-    list_display = ('user', 'last_sync_time', 'sync_status', 'conflict_count')
+    list_display = ('user', 'device_id', 'cursor', 'last_sync_time', 'sync_status', 'conflict_count')
     list_filter = ('sync_status',)
-    search_fields = ('user__username',)
+    search_fields = ('user__username', 'device_id')
     ordering = ('-last_sync_time',)
 
 @admin.register(SyncLog)
@@ -13,4 +13,11 @@ class SyncLogAdmin(admin.ModelAdmin):
     list_display = ('record', 'operation_type', 'operation_time', 'entity_type')
     list_filter = ('operation_type',)
     search_fields = ('entity_type', 'entity_id')
-    ordering = ('-operation_time',)
\ No newline at end of file
+    ordering = ('-operation_time',)
+
+@admin.register(SyncLogDaily)
+class SyncLogDailyAdmin(admin.ModelAdmin):
+    list_display = ('record', 'day', 'operation_type', 'entity_type', 'count')
+    list_filter = ('operation_type',)
+    search_fields = ('record__user__username', 'record__device_id')
+    ordering = ('-day',)
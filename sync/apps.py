@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class SyncConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "sync"
+
+    def ready(self):
+        # 注册条目变更的信号处理
+        from . import snapshots  # noqa: F401
@@ -0,0 +1,93 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from journal_data.models import EntrySequence, EntryTombstone
+from .models import SyncLog, SyncLogDaily, SyncRecord
+
+
+def purge_tombstones(stale_after=None, batch_size=1000):
+    """
+    清理所有已知设备都已越过的墓碑
+
+    每个用户的清理水位为其设备同步记录中最小的 cursor; cursor 仍为 0 的设备
+    (例如只推送不拉取) 不参与计算, 否则该用户的墓碑永远无法清理。先把 purged_seq
+    推进到将被清理的最大序号, 游标落后于它的设备下次拉取会收到 reset; 再分批删除墓碑,
+    每批单独提交, 避免长时间持有写锁。
+
+    Args:
+        stale_after: timedelta, 超过该时长未同步的设备不再阻止清理, 为 None 时考虑所有设备
+        batch_size: 每批删除的墓碑数
+
+    Returns:
+        删除的墓碑总数
+    """
+    now = timezone.now()
+    purged = 0
+
+    user_ids = list(EntryTombstone.objects.values_list('user_id', flat=True).distinct())
+    for user_id in user_ids:
+        records = SyncRecord.objects.filter(user_id=user_id, cursor__gt=0)
+        if stale_after is not None:
+            records = records.filter(last_sync_time__gte=now - stale_after)
+        horizon = records.aggregate(horizon=Min('cursor'))['horizon']
+        if horizon is None:
+            # 没有需要等待的设备, 所有墓碑都可以清理
+            horizon = EntrySequence.current(user_id)
+
+        tombstones = EntryTombstone.objects.filter(user_id=user_id, seq__lte=horizon)
+        purged_seq = tombstones.aggregate(purged_seq=Max('seq'))['purged_seq']
+        if purged_seq is None:
+            continue
+
+        with transaction.atomic():
+            EntrySequence.objects.filter(user_id=user_id, purged_seq__lt=purged_seq).update(purged_seq=purged_seq)
+
+        while True:
+            with transaction.atomic():
+                pks = list(tombstones.values_list('pk', flat=True)[:batch_size])
+                if not pks:
+                    break
+                purged += EntryTombstone.objects.filter(pk__in=pks).delete()[0]
+
+    return purged
+
+
+def compact_sync_logs(retention=None, batch_size=1000, max_batches=None):
+    """
+    把超过保留期的同步日志归并为每日汇总后删除
+
+    保留期之前的整天的日志按 operation_time 从旧到新分批处理, 每批在一个事务中
+    累加到 SyncLogDaily 并删除原日志, 避免长时间持有写锁; 中途停止也不会重复计数。
+
+    Args:
+        retention: timedelta, 日志的保留时长, 默认取 settings.JOURNAL_SYNC_LOG_RETENTION
+        batch_size: 每批归并的日志数
+        max_batches: 最多处理的批数, 为 None 时处理完所有过期日志
+
+    Returns:
+        归并并删除的日志总数
+    """
+    retention = retention if retention is not None else settings.JOURNAL_SYNC_LOG_RETENTION
+    cutoff = (timezone.now() - retention).replace(hour=0, minute=0, second=0, microsecond=0)
+    expired = SyncLog.objects.filter(operation_time__lt=cutoff).order_by('operation_time', 'pk')
+    compacted = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            rows = list(
+                expired.values_list('pk', 'record_id', 'operation_time', 'entity_type', 'operation_type')[:batch_size]
+            )
+            if not rows:
+                break
+            SyncLogDaily.add_counts(Counter(
+                (record_id, operation_time.date(), entity_type, operation_type)
+                for _, record_id, operation_time, entity_type, operation_type in rows
+            ))
+            SyncLog.objects.filter(pk__in=[row[0] for row in rows]).delete()
+        compacted += len(rows)
+        batches += 1
+    return compacted
@@ -0,0 +1,84 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from journal_data.changes import changes_since
+from sync.models import SyncRecord
+from sync.push import apply_push
+from sync.synclog import sync_log_buffer
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        '多个设备并发推送的吞吐量测试: 每个推送设备一个线程和数据库连接, 同时有设备持续增量拉取; '
+        '写入一个临时用户, 结束后删除'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pushers', type=int, default=8, help='并发推送的设备数')
+        parser.add_argument('--pullers', type=int, default=4, help='同时持续拉取的设备数')
+        parser.add_argument('--batches', type=int, default=10, help='每个设备推送的批次数')
+        parser.add_argument('--batch-size', type=int, default=20, help='每批的变更数')
+
+    def handle(self, *args, **options):
+        user = User.objects.create(username=f'bench-push-{uuid.uuid4().hex[:8]}')
+        try:
+            self.bench(user, options)
+        finally:
+            user.delete()
+
+    def bench(self, user, options):
+        devices = [f'bench-{i}' for i in range(options['pushers'])]
+        records = [SyncRecord.objects.create(user=user, device_id=device_id) for device_id in devices]
+        errors = []
+        pulls = []
+        done = threading.Event()
+
+        def push(record):
+            try:
+                for _ in range(options['batches']):
+                    changes = [
+                        {'op': 'create', 'uuid': str(uuid.uuid4()), 'data': {'date': '2024-01-01T00:00:00', 'text': record.device_id}}
+                        for _ in range(options['batch_size'])
+                    ]
+                    apply_push(user, record, changes)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        def pull():
+            try:
+                cursor = 0
+                while not done.is_set():
+                    cursor = changes_since(user, cursor).cursor
+                    pulls.append(cursor)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        pushers = [threading.Thread(target=push, args=(record,)) for record in records]
+        pullers = [threading.Thread(target=pull) for _ in range(options['pullers'])]
+        started = time.perf_counter()
+        for thread in pushers + pullers:
+            thread.start()
+        for thread in pushers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        done.set()
+        for thread in pullers:
+            thread.join()
+        sync_log_buffer.flush()
+
+        if errors:
+            raise CommandError(f'{len(errors)} 个线程失败: {errors[0]!r}')
+        total = options['pushers'] * options['batches'] * options['batch_size']
+        self.stdout.write(
+            f'并发推送: {options["pushers"]} 个设备共 {total} 条, {elapsed:.2f}s, {total / elapsed:.0f} 条/秒; '
+            f'同时 {options["pullers"]} 个设备完成 {len(pulls)} 次拉取'
+        )
@@ -0,0 +1,112 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from users.models import User
+
+# 每个被测接口的同步和异步版本路径
+ENDPOINTS = {
+    'pull': ('/sync/pull/', '/sync/async/pull/'),
+    'entries': ('/journals/entries/', '/journals/async/entries/'),
+    'init': ('/sync/init/', '/sync/async/init/'),
+}
+
+
+async def fetch(host, port, path, headers, bandwidth):
+    """
+    发送一个 GET 请求并读完响应, 返回 (状态码, 首字节耗时)
+
+    bandwidth 不为 0 时按该速率 (字节/秒) 读取响应, 模拟慢速的移动网络
+    """
+    started = time.perf_counter()
+    first_byte = None
+    reader, writer = await asyncio.open_connection(host, port)
+    lines = [f'GET {path} HTTP/1.1', f'Host: {host}', 'Connection: close', *headers, '', '']
+    writer.write('\r\n'.join(lines).encode('latin-1'))
+    await writer.drain()
+    received = b''
+    chunk_size = 4096
+    while True:
+        chunk = await reader.read(chunk_size)
+        if not chunk:
+            break
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        received += chunk
+        if bandwidth:
+            await asyncio.sleep(len(chunk) / bandwidth)
+    writer.close()
+    status_line = received.split(b'\r\n', 1)[0]
+    status = int(status_line.split()[1]) if status_line else 0
+    return status, first_byte
+
+
+async def run_load(url, path, headers, concurrency, requests, bandwidth):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    latencies = []
+    first_bytes = []
+    errors = 0
+
+    async def client(client_index):
+        nonlocal errors
+        for _ in range(requests):
+            started = time.perf_counter()
+            try:
+                status, first_byte = await fetch(host, port, path, [*headers, f'X-Device-Id: bench-{client_index}'], bandwidth)
+            except OSError:
+                status = 0
+            if status != 200:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            first_bytes.append(first_byte)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    return time.perf_counter() - started, latencies, first_bytes, errors
+
+
+class Command(BaseCommand):
+    help = '对运行中的 ASGI 服务并发请求同步接口的同步版本和异步版本, 比较吞吐量和延迟'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='服务地址, 例如 uvicorn 监听的地址')
+        parser.add_argument('--user', required=True, help='用于请求的用户名, 直接签发该用户的访问令牌')
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='pull', help='被测接口')
+        parser.add_argument('--concurrency', type=int, default=50, help='并发客户端数')
+        parser.add_argument('--requests', type=int, default=20, help='每个客户端的请求数')
+        parser.add_argument(
+            '--bandwidth', type=int, default=0,
+            help='每个客户端读取响应的速率 (字节/秒), 0 表示不限速',
+        )
+        parser.add_argument('--accept', default='application/json', help='请求的 Accept 头')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f"用户不存在: {options['user']}")
+        headers = [
+            f'Authorization: Bearer {RefreshToken.for_user(user).access_token}',
+            f"Accept: {options['accept']}",
+        ]
+
+        for label, path in zip(('sync', 'async'), ENDPOINTS[options['endpoint']]):
+            elapsed, latencies, first_bytes, errors = asyncio.run(run_load(
+                options['url'], path, headers,
+                options['concurrency'], options['requests'], options['bandwidth'],
+            ))
+            if not latencies:
+                self.stdout.write(self.style.ERROR(f'{label:5} {path}: 全部 {errors} 个请求失败'))
+                continue
+            latencies.sort()
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            self.stdout.write(
+                f'{label:5} {path}: {len(latencies) / elapsed:.1f} req/s, '
+                f'p50 {statistics.median(latencies) * 1000:.0f}ms, p95 {p95 * 1000:.0f}ms, '
+                f'首字节 p50 {statistics.median(first_bytes) * 1000:.0f}ms, 失败 {errors}'
+            )
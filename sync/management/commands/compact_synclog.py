@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from sync.maintenance import compact_sync_logs
+
+
+class Command(BaseCommand):
+    help = '把超过保留期的同步日志归并为每日汇总并分批删除'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help='日志保留天数, 默认取 settings.JOURNAL_SYNC_LOG_RETENTION',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批归并的日志数')
+        parser.add_argument('--max-batches', type=int, default=None, help='最多处理的批数, 默认处理完所有过期日志')
+
+    def handle(self, *args, **options):
+        retention = timedelta(days=options['days']) if options['days'] is not None else None
+        compacted = compact_sync_logs(
+            retention=retention, batch_size=options['batch_size'], max_batches=options['max_batches'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'已归并 {compacted} 条同步日志'))
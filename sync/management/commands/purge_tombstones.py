@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from jobs.queue import oldest_overdue_job
+from sync.maintenance import purge_tombstones
+
+
+class Command(BaseCommand):
+    help = '清理所有设备都已同步越过的条目删除墓碑'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stale-days', type=int, default=None,
+            help='超过该天数未同步的设备不再阻止清理, 它们下次拉取时会收到 reset',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批删除的墓碑数')
+
+    def handle(self, *args, **options):
+        stale_after = timedelta(days=options['stale_days']) if options['stale_days'] is not None else None
+        purged = purge_tombstones(stale_after=stale_after, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'已清理 {purged} 条墓碑'))
+        # 设备游标由后台任务更新, 没有工作进程时清理水位不会前进
+        job = oldest_overdue_job()
+        if job is not None:
+            self.stderr.write(self.style.WARNING(
+                f'任务 {job.name} #{job.pk} 自 {job.run_at:%Y-%m-%d %H:%M:%S} 起仍未执行, '
+                'run_jobs 工作进程可能没有运行, 设备游标不会前进'
+            ))
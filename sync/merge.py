@@ -0,0 +1,89 @@
+from rest_framework import serializers
+
+from journal_data.serializers import EntrySerializer
+
+# 参与合并的字段分组, 同组字段作为一个整体合并, 避免拼出不成立的位置
+MERGE_GROUPS = (
+    ('text',),
+    ('is_mark',),
+    ('date',),
+    ('location_name', 'latitude', 'longitude'),
+    ('images_json',),
+)
+
+STRATEGY_MERGE = 'merge'
+STRATEGY_CLIENT = 'client'
+STRATEGY_SERVER = 'server'
+STRATEGIES = (STRATEGY_MERGE, STRATEGY_CLIENT, STRATEGY_SERVER)
+
+
+def _normalize(fields, values):
+    """
+    把字段值转换为 EntrySerializer 的输出表示
+
+    同一个值的不同写法 (例如带或不带微秒的时间、字符串形式的浮点数) 转换后相同;
+    无法解析的值原样保留, 由之后的序列化器校验报错
+    """
+    normalized = {}
+    for name, value in values.items():
+        field = fields[name]
+        if value is not None:
+            try:
+                value = field.to_representation(field.to_internal_value(value))
+            except serializers.ValidationError:
+                pass
+        normalized[name] = value
+    return normalized
+
+
+def three_way_merge(base, server, client):
+    """
+    按字段分组对条目做三方合并
+
+    以客户端修改前的快照 base 为共同祖先: 只有客户端改过的分组才会应用,
+    服务端也改过同一分组且结果不同时视为真正的冲突, 该分组保留服务端的值。
+    三方的值都先转换为 EntrySerializer 的输出表示再比较, 写法不同的相同值不会被当作修改。
+
+    Args:
+        base: 客户端修改前的条目快照, 为 None 时无法判断服务端改过什么,
+            客户端与服务端不同的分组都视为冲突
+        server: 服务端当前的条目表示
+        client: 客户端提交的字段, 只包含它修改过的字段
+
+    Returns:
+        (changes, conflicts) 二元组。changes 为可以直接应用的客户端字段,
+        conflicts 为冲突列表, 每项包含 fields, base, server 和 client
+    """
+    serializer_fields = EntrySerializer().fields
+    changes = {}
+    conflicts = []
+    for group in MERGE_GROUPS:
+        fields = [field for field in group if field in client]
+        if not fields:
+            continue
+        client_values = {field: client[field] for field in fields}
+        server_values = {field: server.get(field) for field in fields}
+        client_normalized = _normalize(serializer_fields, client_values)
+        server_normalized = _normalize(serializer_fields, server_values)
+        if client_normalized == server_normalized:
+            continue
+
+        if base is None:
+            client_changed = server_changed = True
+        else:
+            base_normalized = _normalize(serializer_fields, {field: base.get(field) for field in fields})
+            client_changed = client_normalized != base_normalized
+            server_changed = server_normalized != base_normalized
+
+        if not client_changed:
+            continue
+        if server_changed:
+            conflicts.append({
+                'fields': fields,
+                'base': None if base is None else {field: base.get(field) for field in fields},
+                'server': server_values,
+                'client': client_values,
+            })
+            continue
+        changes.update(client_values)
+    return changes, conflicts
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.3 on 2026-10-18 22:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sync", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="syncrecord",
+            name="cursor",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="syncrecord",
+            name="device_id",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name="syncrecord",
+            constraint=models.UniqueConstraint(
+                fields=("user", "device_id"), name="syncrecord_user_device_uniq"
+            ),
+        ),
+    ]
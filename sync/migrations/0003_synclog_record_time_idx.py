@@ -0,0 +1,19 @@
+# Generated by Django 5.1.3 on 2026-10-18 22:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sync", "0002_syncrecord_device"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="synclog",
+            index=models.Index(
+                fields=["record", "-operation_time"], name="synclog_record_time_idx"
+            ),
+        ),
+    ]
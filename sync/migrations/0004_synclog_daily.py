@@ -0,0 +1,61 @@
+# Generated by Django 5.1.3 on 2026-10-18 22:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sync", "0003_synclog_record_time_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncLogDaily",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("entity_type", models.CharField(max_length=50)),
+                (
+                    "operation_type",
+                    models.PositiveSmallIntegerField(
+                        choices=[(0, "创建"), (1, "更新"), (2, "删除")]
+                    ),
+                ),
+                ("count", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name": "同步日志每日汇总",
+                "verbose_name_plural": "同步日志每日汇总",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="synclog",
+            index=models.Index(fields=["operation_time"], name="synclog_time_idx"),
+        ),
+        migrations.AddField(
+            model_name="synclogdaily",
+            name="record",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="daily_logs",
+                to="sync.syncrecord",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="synclogdaily",
+            constraint=models.UniqueConstraint(
+                fields=("record", "day", "entity_type", "operation_type"),
+                name="synclogdaily_record_day_uniq",
+            ),
+        ),
+    ]
@@ -5,7 +5,10 @@ from users.models import User
 class SyncRecord(models.Model):
     """
     同步记录模型
-    记录用户最后一次同步状态和冲突数量
+    按设备记录用户最后一次同步状态和冲突数量
+    cursor 为该设备已确认应用的同步游标, 所有设备都越过的墓碑才会被清理;
+    推送时随同步记录一起前移; 拉取后由后台任务 sync.record_device_sync 更新,
+    需要运行 run_jobs 工作进程
     """
     SYNC_STATUS_CHOICES = (
         (0, '未同步'),
@@ -15,6 +18,8 @@ class SyncRecord(models.Model):
     )
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sync_records')
+    device_id = models.CharField(max_length=64, blank=True, default='')
+    cursor = models.BigIntegerField(default=0)
     last_sync_time = models.DateTimeField(default=timezone.now)
     sync_status = models.PositiveSmallIntegerField(choices=SYNC_STATUS_CHOICES, default=0)
     conflict_count = models.PositiveIntegerField(default=0)
@@ -22,6 +27,9 @@ class SyncRecord(models.Model):
     class Meta:
         verbose_name = '同步记录'
         verbose_name_plural = '同步记录'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'device_id'], name='syncrecord_user_device_uniq'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.get_sync_status_display()}"
@@ -47,6 +55,69 @@ class SyncLog(models.Model):
     class Meta:
         verbose_name = '同步日志'
         verbose_name_plural = '同步日志'
+        indexes = [
+            models.Index(fields=['record', '-operation_time'], name='synclog_record_time_idx'),
+            # 管理后台按时间倒序浏览, 以及按时间分批归并过期日志
+            models.Index(fields=['operation_time'], name='synclog_time_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.get_operation_type_display()} {self.entity_type}:{self.entity_id}"
\ No newline at end of file
+        return f"{self.get_operation_type_display()} {self.entity_type}:{self.entity_id}"
+
+
+class SyncLogDaily(models.Model):
+    """
+    同步日志每日汇总
+    超过保留期的 SyncLog 按同步记录、日期、实体类型和操作类型归并为计数后删除
+    """
+    record = models.ForeignKey(SyncRecord, on_delete=models.CASCADE, related_name='daily_logs')
+    day = models.DateField()
+    entity_type = models.CharField(max_length=50)
+    operation_type = models.PositiveSmallIntegerField(choices=SyncLog.OPERATION_CHOICES)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = '同步日志每日汇总'
+        verbose_name_plural = '同步日志每日汇总'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['record', 'day', 'entity_type', 'operation_type'], name='synclogdaily_record_day_uniq',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.get_operation_type_display()} {self.entity_type} x{self.count}"
+
+    @classmethod
+    def add_counts(cls, counts):
+        """
+        把计数累加到每日汇总, 没有的汇总行新建
+        需要在写事务中调用
+
+        Args:
+            counts: (record_id, day, entity_type, operation_type) 到条数的映射
+        """
+        if not counts:
+            return
+        existing = {
+            (row.record_id, row.day, row.entity_type, row.operation_type): row
+            for row in cls.objects.filter(
+                record_id__in={key[0] for key in counts},
+                day__in={key[1] for key in counts},
+            )
+        }
+        updated = []
+        created = []
+        for key, count in counts.items():
+            row = existing.get(key)
+            if row is None:
+                record_id, day, entity_type, operation_type = key
+                created.append(cls(
+                    record_id=record_id, day=day, entity_type=entity_type,
+                    operation_type=operation_type, count=count,
+                ))
+            else:
+                row.count += count
+                updated.append(row)
+        cls.objects.bulk_update(updated, ['count'])
+        cls.objects.bulk_create(created)
\ No newline at end of file
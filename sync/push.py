@@ -0,0 +1,248 @@
+import uuid
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from journal_data.ingest import bulk_write_entries
+from journal_data.models import JournalEntry
+from journal_data.serializers import EntrySerializer
+from .merge import STRATEGIES, STRATEGY_MERGE, STRATEGY_SERVER, three_way_merge
+from .models import SyncLog, SyncRecord
+from .synclog import log_operations
+
+OP_CREATE = 'create'
+OP_UPDATE = 'update'
+OP_DELETE = 'delete'
+PUSH_OPERATIONS = (OP_CREATE, OP_UPDATE, OP_DELETE)
+
+# SyncLog.OPERATION_CHOICES 中对应的操作类型
+LOG_OPERATION_TYPES = {
+    'created': 0,
+    'updated': 1,
+    'deleted': 2,
+}
+
+
+class PushValidationError(Exception):
+    """
+    推送批次校验失败
+    携带每个无效变更的下标和错误信息, 此时不会写入任何数据
+    """
+    def __init__(self, errors):
+        super().__init__('无效的变更数据')
+        self.errors = errors
+
+
+def _parse_change(change):
+    if not isinstance(change, dict):
+        raise ValueError('变更必须是对象')
+    op = change.get('op')
+    if op not in PUSH_OPERATIONS:
+        raise ValueError(f'op 必须是 {", ".join(PUSH_OPERATIONS)} 之一')
+    try:
+        entry_uuid = uuid.UUID(str(change.get('uuid')))
+    except ValueError:
+        raise ValueError('uuid 无效')
+    data = change.get('data') or {}
+    if op != OP_DELETE and not isinstance(data, dict):
+        raise ValueError('data 必须是对象')
+    strategy = change.get('strategy') or STRATEGY_MERGE
+    if strategy not in STRATEGIES:
+        raise ValueError(f'strategy 必须是 {", ".join(STRATEGIES)} 之一')
+    base_seq = change.get('base_seq')
+    if base_seq is not None and (not isinstance(base_seq, int) or isinstance(base_seq, bool)):
+        raise ValueError('base_seq 必须是整数')
+    base = change.get('base')
+    if base is not None and not isinstance(base, dict):
+        raise ValueError('base 必须是对象')
+    return {
+        'op': op,
+        'uuid': entry_uuid,
+        'data': data,
+        'strategy': strategy,
+        'base_seq': base_seq,
+        'base': base,
+    }
+
+
+def _apply_parsed(user, sync_record, parsed, errors, client_cursor):
+    """
+    在当前事务内读取条目、生成写入计划并写入
+
+    条目在写事务 (BEGIN IMMEDIATE) 内读取并锁定, 其他设备的写入不会插在读取和写入之间,
+    base_seq 的比较和三方合并都基于最新的服务端版本; 其他数据库由 select_for_update 锁定行
+
+    Returns:
+        (plan, cursor) 二元组
+    """
+    existing = {}
+    uuids = [change['uuid'] for _, change in parsed]
+    if uuids:
+        for entry in JournalEntry.objects.select_for_update().filter(user=user, uuid__in=uuids):
+            existing[entry.uuid] = entry
+
+    plan = []
+    for index, change in parsed:
+        instance = existing.get(change['uuid'])
+        item = {
+            'index': index,
+            'uuid': change['uuid'],
+            'entry': instance,
+            'action': None,
+            'status': None,
+            'fields': [],
+            'conflicts': [],
+        }
+        plan.append(item)
+
+        if change['op'] == OP_DELETE:
+            item['action'] = item['status'] = 'deleted' if instance else 'missing'
+            continue
+        if instance is not None and change['strategy'] == STRATEGY_SERVER:
+            item['status'] = 'unchanged'
+            continue
+
+        data = change['data']
+        stale = instance is not None and change['base_seq'] is not None and change['base_seq'] != instance.seq
+        if stale and change['strategy'] == STRATEGY_MERGE:
+            # 客户端修改的版本已不是服务端最新版本, 做三方合并; 不带 base_seq 时按最后写入为准
+            data, item['conflicts'] = three_way_merge(change['base'], EntrySerializer(instance).data, data)
+
+        serializer = EntrySerializer(instance=instance, data=data, partial=instance is not None)
+        if not serializer.is_valid():
+            errors.append({'index': index, 'errors': serializer.errors})
+            continue
+        if instance is None:
+            item['entry'] = JournalEntry(user=user, uuid=change['uuid'], **serializer.validated_data)
+            item['action'] = item['status'] = 'created'
+            continue
+        for field, value in serializer.validated_data.items():
+            setattr(instance, field, value)
+        if serializer.validated_data:
+            item['action'] = 'updated'
+            item['fields'] = list(serializer.validated_data)
+        if item['conflicts']:
+            item['status'] = 'conflict'
+        elif stale and change['strategy'] == STRATEGY_MERGE:
+            item['status'] = 'merged'
+        else:
+            item['status'] = item['action'] or 'unchanged'
+
+    if errors:
+        raise PushValidationError(errors)
+
+    def entries_with(action):
+        return [item['entry'] for item in plan if item['action'] == action]
+
+    conflict_count = sum(1 for item in plan if item['conflicts'])
+    now = timezone.now()
+    seq_range = bulk_write_entries(
+        user,
+        created=entries_with('created'),
+        updated=entries_with('updated'),
+        deleted=entries_with('deleted'),
+        update_fields=[item['fields'] for item in plan if item['action'] == 'updated'],
+    )
+    log_operations(
+        SyncLog(
+            record=sync_record,
+            operation_type=LOG_OPERATION_TYPES[item['action']],
+            entity_type='JournalEntry',
+            entity_id=str(item['uuid']),
+            operation_time=now,
+        )
+        for item in plan
+        if item['action'] in LOG_OPERATION_TYPES
+    )
+
+    # 只有本批序号紧接在客户端游标之后时, 客户端才能前移游标而不漏掉其他设备的变更
+    cursor = client_cursor
+    if seq_range is not None and client_cursor is not None and seq_range[0] == client_cursor + 1:
+        cursor = seq_range[1]
+
+    # 客户端带来的游标表示它已应用到该位置, 只推送不拉取的设备也不会阻止清理墓碑
+    record_updates = {}
+    if cursor is not None:
+        record_updates['cursor'] = Greatest(F('cursor'), cursor)
+    SyncRecord.objects.filter(pk=sync_record.pk).update(
+        sync_status=2,
+        last_sync_time=now,
+        conflict_count=F('conflict_count') + conflict_count,
+        **record_updates,
+    )
+    sync_record.sync_status = 2
+    sync_record.last_sync_time = now
+    sync_record.conflict_count += conflict_count
+    if cursor is not None:
+        sync_record.cursor = max(sync_record.cursor, cursor)
+    return plan, cursor
+
+
+def apply_push(user, sync_record, changes, client_cursor=None):
+    """
+    在一个事务内应用客户端推送的一批变更
+
+    变更以客户端生成的 uuid 在该用户的条目中定位: create / update 都按 uuid 做 upsert,
+    delete 删除条目并写入墓碑。整批先校验, 任何一条无效都不会写入。
+    update 携带的 base_seq 与服务端条目的 seq 不一致时, 以 base 快照做字段级三方合并,
+    不冲突的字段直接应用, 只有真正冲突的字段返回给客户端; strategy 为 client / server
+    时分别强制使用客户端或服务端版本。
+    查询数与批次大小无关: 一次查询已有条目, 一次分配序号, 然后是批量写入条目、
+    墓碑, 最后一次更新同步记录 (包括前移设备游标); SyncLog 在事务提交后进入缓冲, 批量写入。
+    update 只写回变更中带来的字段; 与并发推送同时新建同一个 uuid 时重新读取, 按更新处理。
+
+    Args:
+        user: 推送变更的用户
+        sync_record: 该设备的 SyncRecord
+        changes: 变更列表, 每项包含 op, uuid, data, 以及可选的 base_seq, base 和 strategy
+        client_cursor: 客户端推送前持有的游标, 用于判断能否直接前移游标
+
+    Returns:
+        (results, cursor) 二元组。results 与输入顺序一致, 每项包含 index, uuid, id, seq 和 status,
+        冲突的条目还包含 conflicts 和合并后的服务端版本 server;
+        cursor 为客户端可以安全使用的新游标, 如果期间有其他设备写入则保持客户端原游标
+
+    Raises:
+        PushValidationError: 任一变更无效
+    """
+    errors = []
+    parsed = []
+    seen = set()
+    for index, change in enumerate(changes):
+        try:
+            change = _parse_change(change)
+        except ValueError as e:
+            errors.append({'index': index, 'errors': {'non_field_errors': [str(e)]}})
+            continue
+        if change['uuid'] in seen:
+            errors.append({'index': index, 'errors': {'uuid': ['同一批次中 uuid 重复']}})
+            continue
+        seen.add(change['uuid'])
+        parsed.append((index, change))
+
+    try:
+        with transaction.atomic():
+            plan, cursor = _apply_parsed(user, sync_record, parsed, list(errors), client_cursor)
+    except IntegrityError:
+        # 并发的推送先新建了同一个 uuid 的条目, 重新读取后按更新处理
+        with transaction.atomic():
+            plan, cursor = _apply_parsed(user, sync_record, parsed, list(errors), client_cursor)
+
+    results = []
+    for item in plan:
+        entry = item['entry']
+        result = {
+            'index': item['index'],
+            'uuid': str(item['uuid']),
+            'id': entry.pk if entry is not None else None,
+            'seq': entry.seq if entry is not None and item['action'] != 'deleted' else None,
+            'status': item['status'],
+        }
+        if item['conflicts']:
+            # 返回合并后的服务端版本, 客户端以它为 base 重新提交解决结果
+            result['conflicts'] = item['conflicts']
+            result['server'] = EntrySerializer(entry).data
+        results.append(result)
+    return results, cursor
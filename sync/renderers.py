@@ -0,0 +1,25 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils import encoders
+
+
+def ndjson_line(data):
+    """把一个对象编码成一行 NDJSON"""
+    return json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    NDJSON 渲染器
+    客户端以 Accept: application/x-ndjson 请求流式响应时使用;
+    视图返回的普通数据 (例如错误信息) 渲染为单行 JSON
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return ndjson_line(data)
@@ -8,7 +8,7 @@ class SyncRecordSerializer(serializers.ModelSerializer):
     """
     class Meta:
         model = SyncRecord
-        fields = ['id', 'user', 'last_sync_time', 'sync_status', 'conflict_count']
+        fields = ['id', 'user', 'device_id', 'cursor', 'last_sync_time', 'sync_status', 'conflict_count']
         read_only_fields = ['id', 'user']
 
 class SyncLogSerializer(serializers.ModelSerializer):
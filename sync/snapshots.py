@@ -0,0 +1,184 @@
+import gzip
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.dispatch import receiver
+
+from journal_data.changes import changes_since
+from journal_data.models import EntrySequence, JournalEntry
+from journal_data.serializers import ENTRY_VALUE_FIELDS, entry_representation
+from journal_data.signals import entries_changed
+from jobs.queue import enqueue
+from users.models import User
+from .renderers import ndjson_line
+
+# 快照文件格式版本, 格式变化时递增, 旧版本快照会被整体重建
+SNAPSHOT_FORMAT_VERSION = 2
+
+def snapshot_path(user_id):
+    return Path(settings.JOURNAL_SNAPSHOT_ROOT) / f'{user_id}.ndjson.gz'
+
+
+def read_snapshot_header(user_id):
+    """
+    读取用户快照的头部信息
+
+    Returns:
+        包含 version 和 seq 的字典; 快照不存在或版本不符时为 None
+    """
+    try:
+        with gzip.open(snapshot_path(user_id), 'rb') as f:
+            header = json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+    if header.get('version') != SNAPSHOT_FORMAT_VERSION:
+        return None
+    return header
+
+
+def iter_snapshot_rows(user_id):
+    """顺序读取快照中的条目, 产出 (条目字典, 原始 NDJSON 行)"""
+    with gzip.open(snapshot_path(user_id), 'rb') as f:
+        f.readline()
+        for line in f:
+            yield json.loads(line), line
+
+
+def collect_delta(user, since):
+    """
+    收集快照之后的全部变更
+
+    Returns:
+        (entries, deleted_ids, cursor) 三元组; 快照之前的墓碑已被清理,
+        或快照比数据库还新 (例如数据库从备份恢复) 时为 None
+    """
+    if since > EntrySequence.current(user.pk):
+        return None
+    entries = []
+    deleted_ids = set()
+    cursor = since
+    while True:
+        changes = changes_since(user, cursor)
+        if changes.reset:
+            return None
+        entries += changes.entries
+        deleted_ids.update(item['id'] for item in changes.deleted)
+        cursor = changes.cursor
+        if not changes.has_more:
+            return entries, deleted_ids, cursor
+
+
+def _write_snapshot(user_id, seq, lines):
+    path = snapshot_path(user_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{user_id}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            f.write(ndjson_line({'version': SNAPSHOT_FORMAT_VERSION, 'seq': seq}))
+            for line in lines:
+                f.write(line)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _serialized_lines(entries):
+    for row in entries:
+        yield ndjson_line(entry_representation(row))
+
+
+def build_snapshot(user):
+    """
+    为用户生成或增量更新快照
+
+    已有同版本快照且其后的墓碑仍在时, 顺序读出旧快照、跳过变更过的条目再追加增量,
+    整个过程只持有增量在内存中; 否则从数据库全量生成。
+
+    Returns:
+        新快照覆盖到的变更序号
+    """
+    header = read_snapshot_header(user.pk)
+    delta = collect_delta(user, header['seq']) if header else None
+
+    if delta is None:
+        seq = EntrySequence.current(user.pk)
+        entries = JournalEntry.objects.filter(user=user).order_by('-date', '-id').values(*ENTRY_VALUE_FIELDS)
+        _write_snapshot(user.pk, seq, _serialized_lines(entries.iterator()))
+        return seq
+
+    entries, deleted_ids, seq = delta
+    if seq == header['seq']:
+        return seq
+    skip_ids = deleted_ids | {entry['id'] for entry in entries}
+
+    def lines():
+        for row, line in iter_snapshot_rows(user.pk):
+            if row['id'] not in skip_ids:
+                yield line
+        yield from _serialized_lines(entries)
+
+    _write_snapshot(user.pk, seq, lines())
+    return seq
+
+
+def snapshot_bootstrap(user):
+    """
+    用快照加增量准备新设备的全量数据
+
+    快照不可用时安排后台重建并返回 None, 由调用方回退到数据库查询;
+    增量已经超过 JOURNAL_SNAPSHOT_MIN_CHANGES 时同样安排重建。
+
+    Returns:
+        (cursor, rows) 二元组, rows 依次产出 (条目字典, NDJSON 行);
+        先是快照中未变更的条目, 然后是增量中的条目
+    """
+    header = read_snapshot_header(user.pk)
+    delta = collect_delta(user, header['seq']) if header else None
+    if delta is None:
+        schedule_snapshot_rebuild(user.pk)
+        return None
+
+    entries, deleted_ids, cursor = delta
+    if cursor - header['seq'] >= settings.JOURNAL_SNAPSHOT_MIN_CHANGES:
+        schedule_snapshot_rebuild(user.pk)
+    skip_ids = deleted_ids | {entry['id'] for entry in entries}
+
+    def rows():
+        for row, line in iter_snapshot_rows(user.pk):
+            if row['id'] not in skip_ids:
+                yield row, line
+        for entry in entries:
+            row = entry_representation(entry)
+            yield row, ndjson_line(row)
+
+    return cursor, rows()
+
+
+def rebuild_snapshot_if_stale(user_id):
+    """快照落后超过 JOURNAL_SNAPSHOT_MIN_CHANGES 个变更时重建"""
+    header = read_snapshot_header(user_id)
+    current = EntrySequence.current(user_id)
+    if header and current - header['seq'] < settings.JOURNAL_SNAPSHOT_MIN_CHANGES:
+        return
+    user = User.objects.filter(pk=user_id).first()
+    if user is not None:
+        build_snapshot(user)
+
+
+def schedule_snapshot_rebuild(user_id, delay=None):
+    """
+    安排后台任务检查并重建快照, 同一用户排队中的任务只保留一个
+
+    Args:
+        delay: timedelta, 延迟执行的时间, 期间同一用户的多次变更只触发一次检查
+    """
+    enqueue('sync.rebuild_snapshot', user_id, unique_key=f'snapshot:{user_id}', delay=delay)
+
+
+@receiver(entries_changed)
+def schedule_rebuild_on_change(sender, user_id, **kwargs):
+    schedule_snapshot_rebuild(user_id, delay=settings.JOURNAL_SNAPSHOT_REBUILD_DELAY)
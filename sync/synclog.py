@@ -0,0 +1,101 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+
+from .models import SyncLog, SyncRecord
+
+logger = logging.getLogger(__name__)
+
+
+class SyncLogBuffer:
+    """
+    进程内的同步日志缓冲
+
+    日志只追加不修改, 积累到 JOURNAL_SYNC_LOG_BUFFER_SIZE 条, 或最早的一条已等待
+    JOURNAL_SYNC_LOG_FLUSH_INTERVAL 秒时, 用一次 bulk_create 写入; 进程退出时写入剩余日志。
+    日志只用于审计和统计, 进程被强制结束时最多丢失一个缓冲周期的日志。
+    """
+
+    def __init__(self):
+        self._rows = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, rows):
+        """追加日志, 达到条数上限时在当前线程写入"""
+        rows = list(rows)
+        if not rows:
+            return
+        with self._lock:
+            self._rows.extend(rows)
+            full = len(self._rows) >= settings.JOURNAL_SYNC_LOG_BUFFER_SIZE
+            if not full and self._timer is None:
+                self._timer = threading.Timer(settings.JOURNAL_SYNC_LOG_FLUSH_INTERVAL, self._flush_in_background)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        写入缓冲中的所有日志
+        写入失败时记录错误并丢弃这批日志, 不影响已经提交的同步操作
+
+        Returns:
+            写入的日志条数
+        """
+        with self._lock:
+            rows, self._rows = self._rows, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not rows:
+            return 0
+        try:
+            return write_sync_logs(rows)
+        except Exception:
+            logger.exception(f"同步日志写入失败, 丢弃 {len(rows)} 条")
+            return 0
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            # 定时器线程结束后不会再用到它的数据库连接
+            connections.close_all()
+
+
+def write_sync_logs(rows):
+    """批量写入同步日志; 期间被删除的同步记录 (例如用户注销) 的日志被丢弃"""
+    try:
+        with transaction.atomic():
+            SyncLog.objects.bulk_create(rows, batch_size=settings.JOURNAL_INGEST_CHUNK_SIZE)
+        return len(rows)
+    except IntegrityError:
+        record_ids = set(
+            SyncRecord.objects.filter(pk__in={row.record_id for row in rows}).values_list('pk', flat=True)
+        )
+        rows = [row for row in rows if row.record_id in record_ids]
+        with transaction.atomic():
+            SyncLog.objects.bulk_create(rows, batch_size=settings.JOURNAL_INGEST_CHUNK_SIZE)
+        return len(rows)
+
+
+sync_log_buffer = SyncLogBuffer()
+atexit.register(sync_log_buffer.flush)
+
+
+def log_operations(rows):
+    """
+    记录同步操作日志
+    当前事务提交后才进入缓冲, 回滚的操作不会留下日志
+    """
+    rows = list(rows)
+    if rows:
+        transaction.on_commit(lambda: sync_log_buffer.add(rows))
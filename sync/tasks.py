@@ -0,0 +1,52 @@
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from jobs.queue import enqueue, task
+from .maintenance import compact_sync_logs, purge_tombstones
+from .models import SyncRecord
+from .snapshots import rebuild_snapshot_if_stale
+
+
+@task(eager=True)
+def record_device_sync(user_id, device_id, cursor, synced_at):
+    """
+    记录设备完成了一次拉取
+
+    同一设备排队中的更新由 unique_key 合并为最新的一次, 不同设备的更新可以并行执行。
+    合并后的更新与正在执行的旧更新偶尔交错时, 游标只会暂时偏小,
+    清理墓碑时更保守, 下次拉取即纠正。
+    """
+    SyncRecord.objects.update_or_create(
+        user_id=user_id, device_id=device_id,
+        defaults={'sync_status': 2, 'cursor': cursor, 'last_sync_time': parse_datetime(synced_at)},
+    )
+
+
+@task(concurrency=1)
+def rebuild_snapshot(user_id):
+    rebuild_snapshot_if_stale(user_id)
+
+
+@task(concurrency=1)
+def purge_stale_tombstones():
+    purge_tombstones()
+
+
+@task(concurrency=1)
+def compact_expired_sync_logs():
+    compact_sync_logs()
+
+
+def record_sync_later(user, device_id, cursor):
+    """
+    安排更新设备的同步记录, 同一设备排队中的更新合并为最新的一次
+
+    Returns:
+        本次同步的时间
+    """
+    synced_at = timezone.now()
+    enqueue(
+        record_device_sync, user.pk, device_id, cursor, synced_at.isoformat(),
+        unique_key=f'sync-record:{user.pk}:{device_id}', replace=True,
+    )
+    return synced_at
@@ -0,0 +1,760 @@
+import gzip
+import io
+import json
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+from decimal import Decimal
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from jobs.models import Job
+from journal_data.cache import entry_cache
+from journal_data.ingest import bulk_write_entries
+from journal_data.models import EntrySequence, EntryTombstone, JournalEntry
+from journal_data.serializers import EntrySerializer
+from users.authentication import user_cache
+from users.models import User
+from .maintenance import compact_sync_logs, purge_tombstones
+from .merge import three_way_merge
+from .models import SyncLog, SyncLogDaily, SyncRecord
+from .push import apply_push
+from .snapshots import (
+    SNAPSHOT_FORMAT_VERSION, build_snapshot, iter_snapshot_rows, read_snapshot_header, snapshot_bootstrap, snapshot_path
+)
+from .synclog import sync_log_buffer
+
+# 测试生成的快照写到临时目录, 不影响也不读取开发环境的快照
+SNAPSHOT_ROOT = tempfile.mkdtemp(prefix='journal-snapshots-')
+
+
+class PushTests(TestCase):
+    """SyncPushView 按客户端 uuid 批量应用变更"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='push', email='push@example.com', password='push-password')
+        cls.other = User.objects.create_user(username='push-other', email='push-other@example.com', password='x')
+
+    def setUp(self):
+        self.addCleanup(entry_cache().clear)
+        self.addCleanup(sync_log_buffer.flush)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def push(self, changes, cursor=None, device_id='phone'):
+        data = {'changes': changes}
+        if cursor is not None:
+            data['cursor'] = cursor
+        # 同步日志在事务提交后才进入缓冲
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/sync/push/', data, format='json', HTTP_X_DEVICE_ID=device_id)
+
+    def test_create_update_delete(self):
+        kept, edited, removed = (str(uuid.uuid4()) for _ in range(3))
+        response = self.push([
+            {'op': 'create', 'uuid': kept, 'data': {'date': '2024-01-01T00:00:00', 'text': 'kept'}},
+            {'op': 'create', 'uuid': edited, 'data': {'date': '2024-01-02T00:00:00', 'text': 'draft'}},
+            {'op': 'create', 'uuid': removed, 'data': {'date': '2024-01-03T00:00:00', 'text': 'removed'}},
+        ], cursor=0)
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertEqual([(item['index'], item['uuid'], item['status']) for item in data['results']], [
+            (0, kept, 'created'), (1, edited, 'created'), (2, removed, 'created'),
+        ])
+        self.assertEqual([item['seq'] for item in data['results']], [1, 2, 3])
+        self.assertEqual(data['cursor'], 3)
+        removed_id = data['results'][2]['id']
+
+        response = self.push([
+            {'op': 'update', 'uuid': edited, 'data': {'text': 'final'}},
+            {'op': 'delete', 'uuid': removed},
+            {'op': 'delete', 'uuid': str(uuid.uuid4())},
+        ], cursor=3)
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertEqual([(item['index'], item['status']) for item in data['results']], [
+            (0, 'updated'), (1, 'deleted'), (2, 'missing'),
+        ])
+        self.assertEqual((data['results'][0]['seq'], data['results'][1]['seq'], data['results'][2]['id']), (4, None, None))
+        self.assertEqual(data['cursor'], 5)
+
+        self.assertEqual(
+            dict(JournalEntry.objects.filter(user=self.user).values_list('uuid', 'text')),
+            {uuid.UUID(kept): 'kept', uuid.UUID(edited): 'final'},
+        )
+        tombstone = EntryTombstone.objects.get(user=self.user)
+        self.assertEqual((tombstone.entry_id, tombstone.seq), (removed_id, 5))
+        self.assertEqual(EntrySequence.current(self.user.pk), 5)
+        record = SyncRecord.objects.get(user=self.user, device_id='phone')
+        self.assertEqual(record.sync_status, 2)
+        sync_log_buffer.flush()
+        self.assertEqual(
+            sorted(SyncLog.objects.filter(record=record).values_list('operation_type', flat=True)),
+            [0, 0, 0, 1, 2],
+        )
+
+    def test_duplicate_create(self):
+        # 客户端重试同一个 create 时按 uuid 更新原条目, 不会产生重复条目
+        entry_uuid = str(uuid.uuid4())
+        change = {'op': 'create', 'uuid': entry_uuid, 'data': {'date': '2024-01-01T00:00:00', 'text': 'once'}}
+        first = self.push([change]).json()['results'][0]
+        second = self.push([change]).json()['results'][0]
+        self.assertEqual(first['status'], 'created')
+        self.assertEqual(second['id'], first['id'])
+        self.assertEqual(JournalEntry.objects.filter(uuid=entry_uuid).count(), 1)
+        self.assertEqual(JournalEntry.objects.get(uuid=entry_uuid).text, 'once')
+
+        # 同一批次中重复的 uuid 是无效的
+        response = self.push([change, change])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['details']], [1])
+
+    def test_invalid_item_rolls_back(self):
+        existing = JournalEntry.objects.create(user=self.user, date=datetime(2024, 1, 1), text='existing')
+        theirs = JournalEntry.objects.create(user=self.other, date=datetime(2024, 1, 1), text='theirs')
+        seq = EntrySequence.current(self.user.pk)
+        response = self.push([
+            {'op': 'create', 'uuid': str(uuid.uuid4()), 'data': {'date': '2024-01-02T00:00:00', 'text': 'new'}},
+            {'op': 'update', 'uuid': str(existing.uuid), 'data': {'text': 'changed'}},
+            {'op': 'delete', 'uuid': str(existing.uuid) + 'x'},
+            {'op': 'create', 'uuid': str(uuid.uuid4()), 'data': {'date': 'not a date'}},
+            {'op': 'update', 'uuid': str(theirs.uuid), 'data': {'text': 'hijacked'}},
+            {'op': 'rename', 'uuid': str(uuid.uuid4())},
+        ], cursor=seq)
+        self.assertEqual(response.status_code, 400)
+        details = response.json()['details']
+        self.assertEqual([error['index'] for error in details], [2, 5, 3, 4])
+        self.assertIn('date', details[2]['errors'])
+        # 其他用户的 uuid 与不存在的 uuid 一样按新建条目校验
+        self.assertIn('date', details[3]['errors'])
+
+        # 整批都没有写入: 条目, 序号和墓碑都不变
+        existing.refresh_from_db()
+        theirs.refresh_from_db()
+        self.assertEqual((existing.text, theirs.text), ('existing', 'theirs'))
+        self.assertEqual(JournalEntry.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(EntrySequence.current(self.user.pk), seq)
+        self.assertFalse(EntryTombstone.objects.exists())
+        sync_log_buffer.flush()
+        self.assertFalse(SyncLog.objects.exists())
+
+        self.assertEqual(self.push({'op': 'create'}).status_code, 400)
+        self.assertEqual(self.push([], cursor='abc').status_code, 400)
+
+    def test_foreign_uuid(self):
+        # uuid 只在同一用户内唯一: 推送其他用户已有的 uuid 时与全新的 uuid 结果相同
+        theirs = JournalEntry.objects.create(user=self.other, date=datetime(2024, 1, 1), text='theirs')
+        response = self.push([
+            {'op': 'create', 'uuid': str(theirs.uuid), 'data': {'date': '2024-01-02T00:00:00', 'text': 'mine'}},
+            {'op': 'delete', 'uuid': str(uuid.uuid4())},
+        ])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([item['status'] for item in response.json()['results']], ['created', 'missing'])
+        response = self.push([{'op': 'delete', 'uuid': str(theirs.uuid)}, {'op': 'delete', 'uuid': str(uuid.uuid4())}])
+        self.assertEqual([item['status'] for item in response.json()['results']], ['deleted', 'missing'])
+
+        theirs.refresh_from_db()
+        self.assertEqual(theirs.text, 'theirs')
+        self.assertFalse(JournalEntry.objects.filter(user=self.user).exists())
+
+    def test_untouched_fields_kept(self):
+        # 只写回变更中带来的字段, 其他设备同时修改的字段不会被旧值覆盖
+        entry = JournalEntry.objects.create(user=self.user, date=datetime(2024, 1, 1), text='draft')
+        stale = JournalEntry.objects.get(pk=entry.pk)
+        JournalEntry.objects.filter(pk=entry.pk).update(is_mark=True)
+        stale.text = 'final'
+        bulk_write_entries(self.user, updated=[stale], update_fields=[['text']])
+        entry.refresh_from_db()
+        self.assertEqual((entry.text, entry.is_mark), ('final', True))
+
+        response = self.push([{'op': 'update', 'uuid': str(entry.uuid), 'data': {'location_name': 'park'}}])
+        self.assertEqual(response.json()['results'][0]['status'], 'updated')
+        entry.refresh_from_db()
+        self.assertEqual((entry.text, entry.is_mark, entry.location_name), ('final', True, 'park'))
+
+    def test_concurrent_create(self):
+        # 其他推送在读取之后新建了同一个 uuid 的条目, 唯一约束冲突后重新读取并按更新处理
+        entry_uuid = uuid.uuid4()
+        JournalEntry.objects.create(user=self.user, uuid=entry_uuid, date=datetime(2024, 1, 1), text='tablet')
+        lookups = []
+        real_lookup = JournalEntry.objects.select_for_update
+
+        def lookup():
+            lookups.append(True)
+            return JournalEntry.objects.none() if len(lookups) == 1 else real_lookup()
+
+        with mock.patch.object(JournalEntry.objects, 'select_for_update', side_effect=lookup):
+            response = self.push([
+                {'op': 'create', 'uuid': str(entry_uuid), 'data': {'date': '2024-01-01T00:00:00', 'text': 'phone'}},
+            ])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(len(lookups), 2)
+        self.assertEqual(response.json()['results'][0]['status'], 'updated')
+        entry = JournalEntry.objects.get(user=self.user, uuid=entry_uuid)
+        self.assertEqual(entry.text, 'phone')
+
+    def test_cursor(self):
+        change = lambda text: {'op': 'create', 'uuid': str(uuid.uuid4()), 'data': {'date': '2024-01-01T00:00:00', 'text': text}}
+        data = self.push([change('a'), change('b')], cursor=0).json()
+        self.assertEqual(data['cursor'], 2)
+
+        # 本批序号紧接在客户端游标之后, 游标前移到本批末尾
+        data = self.push([change('c')], cursor=data['cursor']).json()
+        self.assertEqual(data['cursor'], 3)
+
+        # 其他设备在期间写入过, 游标保持不变, 客户端需要先拉取
+        self.push([change('tablet')], cursor=3, device_id='tablet')
+        data = self.push([change('d')], cursor=3).json()
+        self.assertEqual(data['cursor'], 3)
+        pulled = self.client.get('/sync/pull/', {'cursor': 3}).json()
+        self.assertEqual(sorted(entry['text'] for entry in pulled['entries']), ['d', 'tablet'])
+        self.assertEqual(pulled['cursor'], 5)
+
+        # 没有带游标时不返回游标
+        self.assertIsNone(self.push([change('e')]).json()['cursor'])
+
+    def test_push_only_device_allows_purge(self):
+        created = [str(uuid.uuid4()) for _ in range(3)]
+        self.push([
+            {'op': 'create', 'uuid': entry_uuid, 'data': {'date': '2024-01-01T00:00:00', 'text': 'x'}}
+            for entry_uuid in created
+        ], device_id='writer')
+        self.assertEqual(SyncRecord.objects.get(user=self.user, device_id='writer').cursor, 0)
+
+        # 推送时带的游标与本批序号相接, 同步记录的游标随之前移
+        data = self.push([{'op': 'delete', 'uuid': created[0]}], cursor=3).json()
+        self.assertEqual(data['cursor'], 4)
+        self.assertEqual(SyncRecord.objects.get(user=self.user, device_id='phone').cursor, 4)
+        self.push([{'op': 'delete', 'uuid': created[1]}], device_id='writer')
+
+        # 只推送不拉取的设备不阻止清理, 游标之后的墓碑仍要等其他设备拉取
+        self.assertEqual(purge_tombstones(), 1)
+        self.assertEqual(list(EntryTombstone.objects.filter(user=self.user).values_list('seq', flat=True)), [5])
+        self.push([{'op': 'delete', 'uuid': created[2]}], cursor=5)
+        self.assertEqual(purge_tombstones(), 2)
+
+
+class MergeTests(TestCase):
+    """推送和冲突解决中的字段级三方合并"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='merge', email='merge@example.com', password='merge-password')
+
+    def setUp(self):
+        self.addCleanup(entry_cache().clear)
+        self.addCleanup(sync_log_buffer.flush)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.record = SyncRecord.objects.create(user=self.user, device_id='phone')
+        self.entry = JournalEntry.objects.create(
+            user=self.user, date=datetime(2024, 1, 1), text='base', is_mark=False,
+            location_name='Home', latitude=Decimal('1.000000'), longitude=Decimal('2.000000'),
+        )
+        self.base = EntrySerializer(self.entry).data
+        self.base_seq = self.entry.seq
+
+    def server_edit(self, **fields):
+        for field, value in fields.items():
+            setattr(self.entry, field, value)
+        self.entry.save()
+
+    def post(self, path, items, key):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(path, {key: items}, format='json', HTTP_X_DEVICE_ID='phone')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def update(self, data, **extra):
+        change = {'op': 'update', 'uuid': str(self.entry.uuid), 'base_seq': self.base_seq, 'base': self.base, 'data': data, **extra}
+        return self.post('/sync/push/', [change], 'changes')['results'][0]
+
+    def test_three_way_merge(self):
+        base = {'text': 'a', 'is_mark': False, 'location_name': 'Home', 'latitude': '1.000000', 'longitude': '2.000000'}
+        server = {**base, 'text': 'server'}
+        # 不同分组各自修改, 直接合并
+        self.assertEqual(three_way_merge(base, server, {'is_mark': True}), ({'is_mark': True}, []))
+        # 客户端没有改动或与服务端改成相同的值, 无需应用
+        self.assertEqual(three_way_merge(base, server, {'text': 'a'}), ({}, []))
+        self.assertEqual(three_way_merge(base, server, {'text': 'server'}), ({}, []))
+        # 同一分组两边改成不同的值才是冲突, 保留服务端的值
+        changes, conflicts = three_way_merge(base, server, {'text': 'client', 'is_mark': True})
+        self.assertEqual(changes, {'is_mark': True})
+        self.assertEqual(conflicts, [{'fields': ['text'], 'base': {'text': 'a'}, 'server': {'text': 'server'}, 'client': {'text': 'client'}}])
+        # 位置字段作为一个整体合并
+        server = {**base, 'location_name': 'Cafe', 'latitude': '4.000000'}
+        changes, conflicts = three_way_merge(base, server, {'location_name': 'Office', 'latitude': '5.000000', 'longitude': '6.000000'})
+        self.assertEqual(changes, {})
+        self.assertEqual(conflicts[0]['fields'], ['location_name', 'latitude', 'longitude'])
+        # 没有 base 时与服务端不同的分组都视为冲突
+        changes, conflicts = three_way_merge(None, base, {'text': 'client', 'is_mark': False})
+        self.assertEqual((changes, [conflict['fields'] for conflict in conflicts]), ({}, [['text']]))
+        # 按序列化器的表示比较, 写法不同的相同值不算修改
+        base = {**base, 'date': '2024-01-01T08:00:00'}
+        server = {**base, 'date': '2024-01-02T08:00:00', 'latitude': 4.0}
+        client = {'date': '2024-01-01 08:00:00.000000', 'location_name': 'Home', 'latitude': '1.0', 'longitude': 2}
+        self.assertEqual(three_way_merge(base, server, client), ({}, []))
+        self.assertEqual(three_way_merge(base, server, {'date': '2024-01-02T08:00'}), ({}, []))
+
+    def test_non_overlapping_edits(self):
+        self.server_edit(text='server text')
+        result = self.update({'is_mark': True})
+        self.assertEqual(result['status'], 'merged')
+        self.assertNotIn('conflicts', result)
+        self.entry.refresh_from_db()
+        self.assertEqual((self.entry.text, self.entry.is_mark), ('server text', True))
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.conflict_count, 0)
+
+    def test_equivalent_values(self):
+        # 客户端以不同写法提交未修改的时间和坐标, 不会与服务端的修改冲突
+        self.server_edit(date=datetime(2024, 1, 5), latitude=3.5)
+        result = self.update({
+            'date': self.base['date'] + '.000000', 'latitude': str(self.base['latitude']),
+            'location_name': 'Home', 'longitude': int(self.base['longitude']), 'text': 'client text',
+        })
+        self.assertEqual(result['status'], 'merged')
+        self.entry.refresh_from_db()
+        self.assertEqual((self.entry.date, self.entry.latitude, self.entry.text), (datetime(2024, 1, 5), 3.5, 'client text'))
+
+    def test_overlapping_edits(self):
+        self.server_edit(text='server text')
+        result = self.update({'text': 'client text', 'is_mark': True})
+        self.assertEqual(result['status'], 'conflict')
+        self.assertEqual(result['conflicts'], [{
+            'fields': ['text'], 'base': {'text': 'base'}, 'server': {'text': 'server text'}, 'client': {'text': 'client text'},
+        }])
+        # 不冲突的字段已经应用, 冲突的字段保留服务端的值
+        self.assertEqual((result['server']['text'], result['server']['is_mark']), ('server text', True))
+        self.entry.refresh_from_db()
+        self.assertEqual((self.entry.text, self.entry.is_mark, self.entry.seq), ('server text', True, result['seq']))
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.conflict_count, 1)
+
+        # 以返回的服务端版本为 base 提交解决结果
+        data = self.post('/sync/resolve-conflict/', [{
+            'uuid': str(self.entry.uuid), 'base_seq': result['seq'], 'base': result['server'], 'data': {'text': 'resolved'},
+        }], 'resolutions')
+        self.assertEqual((data['results'][0]['status'], data['conflict_count']), ('updated', 1))
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.text, 'resolved')
+
+    def test_strategies(self):
+        self.server_edit(text='server text')
+        result = self.update({'text': 'client text'}, strategy='server')
+        self.assertEqual(result['status'], 'unchanged')
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.text, 'server text')
+
+        result = self.update({'text': 'client text'}, strategy='client')
+        self.assertEqual(result['status'], 'updated')
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.text, 'client text')
+
+        self.server_edit(text='server again')
+        result = self.update({'text': 'merged text'}, strategy='merge')
+        self.assertEqual(result['status'], 'conflict')
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.text, 'server again')
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.conflict_count, 1)
+
+        # 冲突解决端点使用同一个合并引擎
+        data = self.post('/sync/resolve-conflict/', [{
+            'uuid': str(self.entry.uuid), 'base_seq': self.base_seq, 'base': self.base, 'data': {'text': 'forced'}, 'strategy': 'client',
+        }], 'resolutions')
+        self.assertEqual(data['results'][0]['status'], 'updated')
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.text, 'forced')
+
+        response = self.client.post('/sync/push/', {'changes': [{
+            'op': 'update', 'uuid': str(self.entry.uuid), 'data': {}, 'strategy': 'newest',
+        }]}, format='json', HTTP_X_DEVICE_ID='phone')
+        self.assertEqual(response.status_code, 400)
+
+
+class ConcurrentMergeTests(TransactionTestCase):
+    """两个设备同时修改同一条目时, 后写入的一方基于先写入的版本合并"""
+
+    def setUp(self):
+        self.addCleanup(sync_log_buffer.flush)
+        self.user = User.objects.create_user(username='race', email='race@example.com', password='race-password')
+        self.phone = SyncRecord.objects.create(user=self.user, device_id='phone')
+        self.tablet = SyncRecord.objects.create(user=self.user, device_id='tablet')
+        self.entry = JournalEntry.objects.create(user=self.user, date=datetime(2024, 1, 1), text='base')
+
+    def change(self, text):
+        base = EntrySerializer(self.entry).data
+        return {'op': 'update', 'uuid': str(self.entry.uuid), 'base_seq': self.entry.seq, 'base': base, 'data': {'text': text}}
+
+    def test_version_checked_in_transaction(self):
+        phone_change, tablet_change = self.change('phone'), self.change('tablet')
+        reading = threading.Event()
+        results = {}
+        real_is_valid = EntrySerializer.is_valid
+
+        def is_valid(serializer, *args, **kwargs):
+            # 手机读取条目之后, 写入之前, 平板开始推送
+            if not reading.is_set():
+                reading.set()
+                time.sleep(0.3)
+            return real_is_valid(serializer, *args, **kwargs)
+
+        def push_tablet():
+            try:
+                reading.wait()
+                results['tablet'] = apply_push(self.user, self.tablet, [tablet_change])[0][0]
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=push_tablet)
+        thread.start()
+        with mock.patch.object(EntrySerializer, 'is_valid', autospec=True, side_effect=is_valid):
+            results['phone'] = apply_push(self.user, self.phone, [phone_change])[0][0]
+        thread.join()
+
+        # 平板的推送等到手机提交后才读取条目, 发现版本已变化并报告冲突, 不会静默覆盖
+        self.assertEqual((results['phone']['status'], results['tablet']['status']), ('updated', 'conflict'))
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.text, 'phone')
+
+
+@override_settings(JOURNAL_SNAPSHOT_ROOT=SNAPSHOT_ROOT, JOURNAL_SYNC_STREAM_CHUNK_SIZE=2)
+class InitStreamTests(TestCase):
+    """SyncInitView 的 NDJSON 流式响应"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='stream', email='stream@example.com', password='stream-password')
+        other = User.objects.create_user(username='stream-other', email='stream-other@example.com', password='x')
+        for i in range(5):
+            JournalEntry.objects.create(
+                user=cls.user, date=datetime(2024, 1, 1 + i % 3), text=f'第 {i} 条', is_mark=i % 2 == 0,
+                location_name='Home' if i else '', latitude=Decimal('31.230416') if i else None,
+                longitude=Decimal('121.473701') if i else None,
+            )
+        JournalEntry.objects.create(user=other, date=datetime(2024, 1, 1), text='other')
+
+    def setUp(self):
+        self.addCleanup(entry_cache().clear)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def stream(self, **params):
+        response = self.client.get('/sync/init/', params, HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_stream_matches_json(self):
+        expected = self.client.get('/sync/init/').json()
+        meta, *entries = self.stream()
+        self.assertEqual(meta['cursor'], expected['cursor'])
+        self.assertEqual(meta['cursor'], EntrySequence.current(self.user.pk))
+        self.assertIn('last_sync_time', meta)
+        # 每行一个条目, 跨越多个读取块, 内容与 JSON 响应完全一致
+        self.assertEqual(len(entries), 5)
+        self.assertEqual(entries, expected['entries'])
+        # 也可以用 format 参数选择 NDJSON
+        response = self.client.get('/sync/init/', {'format': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(b''.join(response.streaming_content).count(b'\n'), 6)
+
+    def test_empty_stream(self):
+        self.client.force_authenticate(User.objects.create_user(username='empty', email='empty@example.com', password='x'))
+        lines = self.stream()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]['cursor'], 0)
+
+
+@override_settings(JOURNAL_SNAPSHOT_ROOT=SNAPSHOT_ROOT)
+class SnapshotTests(TestCase):
+    """新设备全量同步: 快照加增量与直接查询数据库的结果一致"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='snapshot', email='snapshot@example.com', password='x')
+
+    def setUp(self):
+        self.addCleanup(entry_cache().clear)
+        self.addCleanup(snapshot_path(self.user.pk).unlink, missing_ok=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.entries = [
+            JournalEntry.objects.create(
+                user=self.user, date=datetime(2024, 1, 1 + i), text=f'entry {i}',
+                latitude=Decimal('31.230416') if i % 2 else None, longitude=Decimal('121.473701') if i % 2 else None,
+            )
+            for i in range(4)
+        ]
+
+    def expected(self):
+        entries = JournalEntry.objects.filter(user=self.user).order_by('-date', '-id')
+        return json.loads(json.dumps(EntrySerializer(entries, many=True).data, cls=DjangoJSONEncoder))
+
+    def edit(self):
+        first, second, third, _ = self.entries
+        first.text = 'edited'
+        first.save()
+        third.date = datetime(2023, 12, 31)
+        third.save()
+        second.delete()
+        JournalEntry.objects.create(user=self.user, date=datetime(2024, 2, 1), text='new')
+
+    def assertInitMatchesDatabase(self):
+        expected = self.expected()
+        data = self.client.get('/sync/init/').json()
+        self.assertEqual(data['entries'], expected)
+        self.assertEqual(data['cursor'], EntrySequence.current(self.user.pk))
+        response = self.client.get('/sync/init/', HTTP_ACCEPT='application/x-ndjson')
+        meta, *entries = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(meta['cursor'], data['cursor'])
+        self.assertEqual(sorted(entries, key=lambda entry: entry['id']), sorted(expected, key=lambda entry: entry['id']))
+
+    def test_snapshot_plus_delta(self):
+        self.assertEqual(build_snapshot(self.user), EntrySequence.current(self.user.pk))
+        self.edit()
+        cursor, rows = snapshot_bootstrap(self.user)
+        self.assertEqual(cursor, EntrySequence.current(self.user.pk))
+        self.assertEqual(sorted(row['id'] for row, line in rows), sorted(entry['id'] for entry in self.expected()))
+        self.assertInitMatchesDatabase()
+
+        # 增量更新快照: 跳过变更过的条目, 追加增量
+        self.assertEqual(build_snapshot(self.user), cursor)
+        self.assertEqual(read_snapshot_header(self.user.pk)['seq'], cursor)
+        rows = sorted((row for row, line in iter_snapshot_rows(self.user.pk)), key=lambda row: row['id'])
+        self.assertEqual(rows, sorted(self.expected(), key=lambda entry: entry['id']))
+        self.assertInitMatchesDatabase()
+
+    def assertFallback(self):
+        self.assertIsNone(snapshot_bootstrap(self.user))
+        self.assertTrue(Job.objects.filter(unique_key=f'snapshot:{self.user.pk}').exists())
+        self.assertInitMatchesDatabase()
+        Job.objects.all().delete()
+
+    def test_fallback(self):
+        # 快照格式版本不符
+        path = snapshot_path(self.user.pk)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(path, 'wb') as f:
+            f.write(json.dumps({'version': SNAPSHOT_FORMAT_VERSION - 1, 'seq': 0}).encode() + b'\n')
+        self.assertIsNone(read_snapshot_header(self.user.pk))
+        self.assertFallback()
+
+        # 快照之后的墓碑已被清理, 无法得知期间删除了哪些条目
+        build_snapshot(self.user)
+        self.edit()
+        self.assertGreater(purge_tombstones(), 0)
+        self.assertFallback()
+
+        # 快照比数据库还新, 例如数据库从备份恢复
+        build_snapshot(self.user)
+        EntrySequence.objects.filter(user=self.user).update(value=0)
+        self.assertFallback()
+
+
+@override_settings(JOURNAL_SNAPSHOT_ROOT=SNAPSHOT_ROOT, JOURNAL_SYNC_STREAM_CHUNK_SIZE=2)
+class AsyncEndpointTests(TestCase):
+    """异步版本的 init, pull 和条目列表与同步版本返回相同的内容"""
+    # (同步路径, 异步路径)
+    init = ('/sync/init/', '/sync/async/init/')
+    pull = ('/sync/pull/', '/sync/async/pull/')
+    entries = ('/journals/entries/', '/journals/async/entries/')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='async', email='async@example.com', password='x')
+        entries = [
+            JournalEntry.objects.create(
+                user=cls.user, date=datetime(2024, 1, 1 + i % 3), text=f'entry {i}',
+                latitude=31.230416 if i % 2 else None, longitude=121.473701 if i % 2 else None,
+            )
+            for i in range(5)
+        ]
+        entries[0].delete()
+
+    def setUp(self):
+        self.addCleanup(entry_cache().clear)
+        self.addCleanup(user_cache.clear)
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        self.async_client = AsyncClient()
+
+    def sync_get(self, path, params=None, **headers):
+        return APIClient().get(path, params, headers={**self.headers, **headers})
+
+    async def get(self, path, params=None, **headers):
+        return await self.async_client.get(path, params, headers={**self.headers, **headers})
+
+    def payload(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+        data = json.loads(response.content)
+        data.pop('last_sync_time', None)
+        # 分页链接指向各自的路径, 只比较查询参数
+        if data.get('next'):
+            data['next'] = urlsplit(data['next']).query
+        return data
+
+    async def assertSamePayload(self, paths, params=None):
+        sync_path, async_path = paths
+        expected = self.payload(await sync_to_async(self.sync_get)(sync_path, params))
+        actual = self.payload(await self.get(async_path, params))
+        self.assertEqual(actual, expected)
+        return actual
+
+    async def test_init(self):
+        data = await self.assertSamePayload(self.init)
+        self.assertEqual(len(data['entries']), 4)
+
+    async def test_init_stream(self):
+        async def lines(response):
+            body = b''.join([chunk async for chunk in response.streaming_content])
+            return [json.loads(line) for line in body.splitlines()]
+
+        def sync_lines():
+            response = self.sync_get(self.init[0], Accept='application/x-ndjson')
+            return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        expected = await sync_to_async(sync_lines)()
+        response = await self.get(self.init[1], Accept='application/x-ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertTrue(response.is_async)
+        meta, *entries = await lines(response)
+        self.assertEqual(meta['cursor'], expected[0]['cursor'])
+        self.assertEqual(entries, expected[1:])
+        self.assertEqual(len(entries), 4)
+        # 也可以用 format 参数选择 NDJSON
+        self.assertEqual(len(await lines(await self.get(self.init[1], {'format': 'ndjson'}))), 5)
+
+    async def test_pull(self):
+        data = await self.assertSamePayload(self.pull)
+        self.assertEqual((len(data['entries']), len(data['deleted'])), (4, 0))
+        data = await self.assertSamePayload(self.pull, {'cursor': 3})
+        self.assertEqual(len(data['deleted']), 1)
+        response = await self.get(self.pull[1], {'cursor': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_entries(self):
+        data = await self.assertSamePayload(self.entries, {'page_size': 3})
+        self.assertEqual(len(data['results']), 3)
+        cursor = parse_qs(data['next'])['cursor'][0]
+        data = await self.assertSamePayload(self.entries, {'page_size': 3, 'cursor': cursor})
+        self.assertEqual((len(data['results']), data['next']), (1, None))
+
+    async def test_unauthenticated(self):
+        for path in (self.init[1], self.pull[1], self.entries[1]):
+            response = await AsyncClient().get(path)
+            self.assertEqual(response.status_code, 401, path)
+            self.assertIn('detail', json.loads(response.content))
+            response = await AsyncClient().get(path, headers={'Authorization': 'Bearer invalid'})
+            self.assertEqual(response.status_code, 401, path)
+
+    async def test_not_modified(self):
+        for path in (self.pull[1], self.entries[1]):
+            response = await self.get(path)
+            etag = response['ETag']
+            response = await self.get(path, **{'If-None-Match': etag})
+            self.assertEqual((response.status_code, response['ETag'], response.content), (304, etag, b''), path)
+        await JournalEntry.objects.acreate(user=self.user, date=datetime(2024, 2, 1), text='new')
+        response = await self.get(self.pull[1], **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(JOURNAL_SNAPSHOT_ROOT=SNAPSHOT_ROOT)
+class SyncLogTests(TransactionTestCase):
+    """同步日志的缓冲写入和过期归并"""
+
+    def setUp(self):
+        sync_log_buffer.flush()
+        self.user = User.objects.create_user(username='logs', email='logs@example.com', password='logs-password')
+        self.record = SyncRecord.objects.create(user=self.user, device_id='phone')
+
+    def push(self, count):
+        changes = [
+            {'op': 'create', 'uuid': str(uuid.uuid4()), 'data': {'date': '2024-01-01T00:00:00', 'text': 'x'}}
+            for _ in range(count)
+        ]
+        apply_push(self.user, self.record, changes)
+
+    @override_settings(JOURNAL_SYNC_LOG_BUFFER_SIZE=5, JOURNAL_SYNC_LOG_FLUSH_INTERVAL=3600)
+    def test_buffer_size(self):
+        self.push(3)
+        self.assertEqual((SyncLog.objects.count(), len(sync_log_buffer)), (0, 3))
+        # 回滚的推送不留下日志
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.push(3)
+            raise RuntimeError
+        self.assertEqual(len(sync_log_buffer), 3)
+        self.push(3)
+        self.assertEqual((SyncLog.objects.count(), len(sync_log_buffer)), (6, 0))
+        self.assertEqual(sync_log_buffer.flush(), 0)
+
+    @override_settings(JOURNAL_SYNC_LOG_BUFFER_SIZE=1000, JOURNAL_SYNC_LOG_FLUSH_INTERVAL=0.05)
+    def test_flush_interval(self):
+        self.push(2)
+        deadline = time.monotonic() + 5
+        while not SyncLog.objects.exists() and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual((SyncLog.objects.count(), len(sync_log_buffer)), (2, 0))
+
+    def test_deleted_record(self):
+        other = SyncRecord.objects.create(user=self.user, device_id='tablet')
+        rows = [
+            SyncLog(record=record, operation_type=0, entity_type='JournalEntry', entity_id='1')
+            for record in (self.record, other)
+        ]
+        sync_log_buffer.add(rows)
+        SyncRecord.objects.filter(pk=other.pk).delete()
+        self.assertEqual(sync_log_buffer.flush(), 1)
+        self.assertEqual(list(SyncLog.objects.values_list('record_id', flat=True)), [self.record.pk])
+
+    def test_compaction(self):
+        now = datetime.now()
+        old = now - timedelta(days=40)
+        older = now - timedelta(days=41)
+
+        def log(day, operation_type, count):
+            SyncLog.objects.bulk_create([
+                SyncLog(
+                    record=self.record, operation_type=operation_type, entity_type='JournalEntry',
+                    entity_id=str(i), operation_time=day + timedelta(seconds=i),
+                )
+                for i in range(count)
+            ])
+
+        def daily():
+            return {
+                (row.day, row.operation_type): row.count
+                for row in SyncLogDaily.objects.filter(record=self.record)
+            }
+
+        log(old, 0, 10)
+        log(old, 1, 5)
+        log(older, 2, 4)
+        log(now, 0, 3)
+        out = io.StringIO()
+        call_command('compact_synclog', '--batch-size', '4', stdout=out)
+        self.assertIn('19', out.getvalue())
+        self.assertEqual(SyncLog.objects.count(), 3)
+        self.assertEqual(daily(), {(old.date(), 0): 10, (old.date(), 1): 5, (older.date(), 2): 4})
+
+        # 再次归并累加到已有的汇总; 限制批数时只处理最旧的部分
+        log(old, 0, 2)
+        log(older, 2, 6)
+        call_command('compact_synclog', '--batch-size', '3', '--max-batches', '2', stdout=io.StringIO())
+        self.assertEqual(daily()[(older.date(), 2)], 10)
+        self.assertEqual(SyncLog.objects.count(), 5)
+        self.assertEqual(compact_sync_logs(), 2)
+        self.assertEqual(daily()[(old.date(), 0)], 12)
+        self.assertEqual(SyncLog.objects.count(), 3)
@@ -1,43 +1,81 @@
+from itertools import chain, islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
-from django.utils import timezone
+from rest_framework.settings import api_settings
 from .models import SyncRecord, SyncLog
+from .push import PushValidationError, apply_push
+from .renderers import NDJSONRenderer, ndjson_line
 from .serializers import SyncRecordSerializer, SyncLogSerializer
-from journal_data.models import JournalEntry
-from journal_data.serializers import EntrySerializer
+from .snapshots import snapshot_bootstrap
+from .tasks import record_sync_later
+from journal_data.cache import serialize_entries
+from journal_data.changes import achanges_since, changes_since, parse_cursor
+from journal_data.conditional import aentries_condition, entries_condition
+from journal_data.models import JournalEntry, EntrySequence
+from journal_data.serializers import ENTRY_VALUE_FIELDS
+from journal_server.async_views import AsyncAPIView, AsyncTokenUserAuthentication, iterate_in_thread, json_response
+from journal_server.metrics import record_entries
+from users.authentication import TokenUserAuthentication
+
+
+def get_device_id(request):
+    """
+    获取客户端设备标识
+    优先读取 X-Device-Id 请求头, 其次是 device_id 查询参数, 都没有时为空字符串
+    """
+    device_id = request.headers.get('X-Device-Id') or request.query_params.get('device_id') or ''
+    return device_id[:64]
+
 
 class SyncInitView(APIView):
     """
     初始化同步端点
-    返回用户的基础数据
+    返回用户的基础数据, 以及后续增量拉取使用的游标
+    有预先生成的快照时顺序读取快照文件并补上其后的增量, 否则查询数据库。
+    以 Accept: application/x-ndjson 请求时流式返回: 第一行为包含 cursor 的元信息,
+    之后每行一个条目, 内存占用与日记大小无关
     """
     permission_classes = [IsAuthenticated]
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
     
     def get(self, request):
         try:
-            # 获取用户所有日记条目
-            entries = JournalEntry.objects.filter(user=request.user).order_by('-date')
-            entry_serializer = EntrySerializer(entries, many=True)
+            # 优先使用预先生成的快照加增量; 没有可用快照时查询数据库,
+            # 先读取游标再查询条目, 之后的写入都会在下次增量拉取中返回
+            snapshot = snapshot_bootstrap(request.user)
+            if snapshot is not None:
+                cursor, rows = snapshot
+                entries = None
+            else:
+                cursor = EntrySequence.current(request.user.pk)
+                entries = JournalEntry.objects.filter(user=request.user).order_by('-date', '-id').values(*ENTRY_VALUE_FIELDS)
             
-            # 创建或更新同步记录
-            sync_record, created = SyncRecord.objects.get_or_create(
-                user=request.user,
-                defaults={
-                    'sync_status': 2,  # 同步完成
-                    'last_sync_time': timezone.now()
-                }
-            )
+            # 全量数据已覆盖到 cursor, 设备游标直接前移; 同步记录由后台任务更新
+            synced_at = record_sync_later(request.user, get_device_id(request), cursor)
             
-            if not created:
-                sync_record.sync_status = 2
-                sync_record.last_sync_time = timezone.now()
-                sync_record.save()
+            if request.accepted_renderer.format == NDJSONRenderer.format:
+                meta = {'cursor': cursor, 'last_sync_time': synced_at}
+                lines = self.snapshot_lines(request, rows) if entries is None else self.stream_entries(request, entries)
+                return StreamingHttpResponse(
+                    chain([ndjson_line(meta)], lines),
+                    content_type=NDJSONRenderer.media_type
+                )
             
+            if entries is None:
+                data = sorted((row for row, line in rows), key=lambda row: (row['date'], row['id']), reverse=True)
+            else:
+                data = serialize_entries(entries)
+            record_entries(request, len(data))
             return Response({
-                'entries': entry_serializer.data,
-                'last_sync_time': sync_record.last_sync_time
+                'entries': data,
+                'cursor': cursor,
+                'last_sync_time': synced_at
             })
             
         except Exception as e:
@@ -45,37 +83,65 @@ class SyncInitView(APIView):
                 'error': '同步初始化失败',
                 'details': str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    def snapshot_lines(self, request, rows):
+        for row, line in rows:
+            record_entries(request, 1)
+            yield line
+    
+    def stream_entries(self, request, entries):
+        """逐块读取并序列化条目, 每个条目输出一行 NDJSON"""
+        chunk_size = getattr(settings, 'JOURNAL_SYNC_STREAM_CHUNK_SIZE', 500)
+        rows = entries.iterator(chunk_size=chunk_size)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            record_entries(request, len(chunk))
+            yield b''.join(ndjson_line(row) for row in serialize_entries(chunk))
 
 class SyncPushView(APIView):
     """
     客户端推送变更端点
-    处理客户端上传的变更数据
+    接收以客户端 uuid 标识的一批 create / update / delete 变更, 在一个事务内批量应用
     """
     permission_classes = [IsAuthenticated]
     
     def post(self, request):
         try:
-            # 获取或创建同步记录
+            changes = request.data.get('changes', [])
+            if not isinstance(changes, list):
+                return Response({
+                    'error': '无效的变更数据',
+                    'details': 'changes 必须是列表'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            record_entries(request, len(changes))
+            try:
+                client_cursor = request.data.get('cursor')
+                client_cursor = parse_cursor(client_cursor) if client_cursor is not None else None
+            except (TypeError, ValueError):
+                return Response({
+                    'error': '无效的同步游标'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            # 获取或创建同步记录, 状态在应用变更的事务内一次性更新
             sync_record, created = SyncRecord.objects.get_or_create(
                 user=request.user,
-                defaults={
-                    'sync_status': 1,  # 同步中
-                    'last_sync_time': timezone.now()
-                }
+                device_id=get_device_id(request),
             )
             
-            if not created:
-                sync_record.sync_status = 1
-                sync_record.save()
-            
-            # TODO: 实现具体的数据同步逻辑
-            
-            sync_record.sync_status = 2  # 同步完成
-            sync_record.last_sync_time = timezone.now()
-            sync_record.save()
+            try:
+                results, cursor = apply_push(request.user, sync_record, changes, client_cursor)
+            except PushValidationError as e:
+                return Response({
+                    'error': '无效的变更数据',
+                    'details': e.errors
+                }, status=status.HTTP_400_BAD_REQUEST)
             
             return Response({
                 'message': '数据同步成功',
+                'results': results,
+                'cursor': cursor,
                 'last_sync_time': sync_record.last_sync_time
             })
             
@@ -88,38 +154,37 @@ class SyncPushView(APIView):
 class SyncPullView(APIView):
     """
     客户端拉取变更端点
-    返回客户端需要的变更数据
+    返回 seq 大于客户端游标的变更数据和删除记录, 以及下一次拉取使用的游标;
+    没有新的变更时按 If-None-Match 返回 304, 不执行条目查询。
+    只按 user_id 查询, 认证时不读取用户
     """
+    authentication_classes = [TokenUserAuthentication]
     permission_classes = [IsAuthenticated]
     
+    @entries_condition
     def get(self, request):
         try:
-            last_sync_time = request.query_params.get('last_sync_time')
+            try:
+                cursor = parse_cursor(request.query_params.get('cursor'))
+            except ValueError:
+                return Response({
+                    'error': '无效的同步游标'
+                }, status=status.HTTP_400_BAD_REQUEST)
             
-            # 获取同步记录
-            sync_record = SyncRecord.objects.get(user=request.user)
-            
-            # 获取变更数据
-            if last_sync_time:
-                entries = JournalEntry.objects.filter(
-                    user=request.user,
-                    date__gt=last_sync_time
-                ).order_by('-date')
-            else:
-                entries = JournalEntry.objects.filter(
-                    user=request.user
-                ).order_by('-date')
-                
-            entry_serializer = EntrySerializer(entries, many=True)
+            # 获取游标之后的变更数据和删除记录
+            changes = changes_since(request.user, cursor)
             
-            # 更新同步记录
-            sync_record.sync_status = 2  # 同步完成
-            sync_record.last_sync_time = timezone.now()
-            sync_record.save()
+            # 客户端带来的游标表示它已应用到该位置, 同步记录由后台任务更新
+            synced_at = record_sync_later(request.user, get_device_id(request), 0 if changes.reset else cursor)
+            record_entries(request, len(changes.entries) + len(changes.deleted))
             
             return Response({
-                'entries': entry_serializer.data,
-                'last_sync_time': sync_record.last_sync_time
+                'entries': serialize_entries(changes.entries),
+                'deleted': changes.deleted,
+                'cursor': changes.cursor,
+                'has_more': changes.has_more,
+                'reset': changes.reset,
+                'last_sync_time': synced_at
             })
             
         except Exception as e:
@@ -131,28 +196,168 @@ class SyncPullView(APIView):
 class SyncResolveConflictView(APIView):
     """
     解决数据冲突端点
-    处理客户端和服务器之间的数据冲突
+    一次提交一批冲突的解决结果, 与推送使用同一个合并引擎:
+    每项包含 uuid, data, base_seq, base 以及可选的 strategy (merge / client / server)
     """
     permission_classes = [IsAuthenticated]
     
     def post(self, request):
         try:
-            # 获取同步记录
-            sync_record = SyncRecord.objects.get(user=request.user)
+            resolutions = request.data.get('resolutions', [])
+            if not isinstance(resolutions, list):
+                return Response({
+                    'error': '无效的冲突数据',
+                    'details': 'resolutions 必须是列表'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            record_entries(request, len(resolutions))
             
-            # TODO: 实现具体的冲突解决逻辑
+            # 获取同步记录
+            sync_record = SyncRecord.objects.get(user=request.user, device_id=get_device_id(request))
             
-            # 更新同步记录
-            sync_record.conflict_count += 1
-            sync_record.save()
+            changes = [
+                {**resolution, 'op': 'update'} if isinstance(resolution, dict) else resolution
+                for resolution in resolutions
+            ]
+            try:
+                results, cursor = apply_push(request.user, sync_record, changes)
+            except PushValidationError as e:
+                return Response({
+                    'error': '无效的冲突数据',
+                    'details': e.errors
+                }, status=status.HTTP_400_BAD_REQUEST)
             
             return Response({
                 'message': '冲突解决成功',
+                'results': results,
                 'conflict_count': sync_record.conflict_count
             })
             
+        except SyncRecord.DoesNotExist:
+            return Response({
+                'error': '冲突解决失败',
+                'details': '设备尚未同步'
+            }, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({
                 'error': '冲突解决失败',
                 'details': str(e)
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def wants_ndjson(request):
+    """异步视图没有 DRF 的内容协商, 按 Accept 或 format 参数判断是否返回 NDJSON"""
+    return (
+        NDJSONRenderer.media_type in request.headers.get('Accept', '')
+        or request.query_params.get('format') == NDJSONRenderer.format
+    )
+
+
+class AsyncSyncInitView(AsyncAPIView):
+    """
+    初始化同步端点的异步版本
+    返回内容与 SyncInitView 相同; NDJSON 流式响应由异步生成器产出,
+    在 ASGI 下向慢速客户端发送数据时不占用线程
+    """
+
+    async def get(self, request):
+        try:
+            snapshot = await sync_to_async(snapshot_bootstrap)(request.user)
+            if snapshot is not None:
+                cursor, rows = snapshot
+                entries = None
+            else:
+                cursor = await EntrySequence.acurrent(request.user.pk)
+                entries = JournalEntry.objects.filter(user=request.user).order_by('-date', '-id').values(*ENTRY_VALUE_FIELDS)
+
+            synced_at = await sync_to_async(record_sync_later)(request.user, get_device_id(request), cursor)
+
+            if wants_ndjson(request):
+                meta = {'cursor': cursor, 'last_sync_time': synced_at}
+                lines = self.snapshot_lines(request, rows) if entries is None else self.stream_entries(request, entries)
+                return StreamingHttpResponse(
+                    self.stream(ndjson_line(meta), lines),
+                    content_type=NDJSONRenderer.media_type
+                )
+
+            if entries is None:
+                data = [row async for row, line in iterate_in_thread(rows)]
+                data.sort(key=lambda row: (row['date'], row['id']), reverse=True)
+            else:
+                data = serialize_entries([row async for row in entries])
+            record_entries(request, len(data))
+            return json_response({
+                'entries': data,
+                'cursor': cursor,
+                'last_sync_time': synced_at
+            })
+
+        except Exception as e:
+            return json_response({
+                'error': '同步初始化失败',
+                'details': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    async def stream(self, first, lines):
+        yield first
+        async for line in lines:
+            yield line
+
+    async def snapshot_lines(self, request, rows):
+        async for row, line in iterate_in_thread(rows):
+            record_entries(request, 1)
+            yield line
+
+    async def stream_entries(self, request, entries):
+        """逐块读取并序列化条目, 每个条目输出一行 NDJSON"""
+        chunk_size = getattr(settings, 'JOURNAL_SYNC_STREAM_CHUNK_SIZE', 500)
+        chunk = []
+        async for row in entries.aiterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                record_entries(request, len(chunk))
+                yield b''.join(ndjson_line(entry) for entry in serialize_entries(chunk))
+                chunk = []
+        if chunk:
+            record_entries(request, len(chunk))
+            yield b''.join(ndjson_line(entry) for entry in serialize_entries(chunk))
+
+
+class AsyncSyncPullView(AsyncAPIView):
+    """
+    客户端拉取变更端点的异步版本
+    参数、响应和 304 行为与 SyncPullView 相同, 查询使用异步 ORM
+    """
+    authentication_class = AsyncTokenUserAuthentication
+
+    @aentries_condition
+    async def get(self, request):
+        try:
+            try:
+                cursor = parse_cursor(request.query_params.get('cursor'))
+            except ValueError:
+                return json_response({
+                    'error': '无效的同步游标'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            changes = await achanges_since(request.user, cursor)
+
+            # 客户端带来的游标表示它已应用到该位置, 同步记录由后台任务更新
+            synced_at = await sync_to_async(record_sync_later)(
+                request.user, get_device_id(request), 0 if changes.reset else cursor
+            )
+            record_entries(request, len(changes.entries) + len(changes.deleted))
+
+            return json_response({
+                'entries': serialize_entries(changes.entries),
+                'deleted': changes.deleted,
+                'cursor': changes.cursor,
+                'has_more': changes.has_more,
+                'reset': changes.reset,
+                'last_sync_time': synced_at
+            })
+
+        except Exception as e:
+            return json_response({
+                'error': '获取变更数据失败',
+                'details': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
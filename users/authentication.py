@@ -0,0 +1,147 @@
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+# 只修改了这些字段的保存与认证无关, 直接更新缓存中的用户而不是使其失效
+BOOKKEEPING_FIELDS = frozenset({'last_data_sync_time', 'last_login'})
+
+
+class UserCache:
+    """
+    进程内的用户对象缓存
+
+    按 user_id 保存用户对象 JOURNAL_AUTH_USER_CACHE_TTL 秒, 最多 JOURNAL_AUTH_USER_CACHE_SIZE 个,
+    超出时淘汰最早缓存的用户。取出的是浅拷贝, 视图修改 request.user 不会影响缓存和其他请求。
+    令牌中的 user_id 可能是字符串, 键统一转为字符串。
+    """
+
+    def __init__(self):
+        self._users = {}
+        self._lock = threading.Lock()
+        # 每次失效加一; 查询数据库期间发生过失效时不缓存查询结果, 以免写回旧数据
+        self.generation = 0
+
+    def get(self, user_id):
+        item = self._users.get(str(user_id))
+        if item is None or item[0] <= time.monotonic():
+            return None
+        return copy.copy(item[1])
+
+    def set(self, user, generation):
+        ttl = settings.JOURNAL_AUTH_USER_CACHE_TTL
+        if ttl <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            key = str(getattr(user, api_settings.USER_ID_FIELD))
+            self._users.pop(key, None)
+            self._users[key] = (time.monotonic() + ttl, copy.copy(user))
+            while len(self._users) > settings.JOURNAL_AUTH_USER_CACHE_SIZE:
+                del self._users[next(iter(self._users))]
+
+    def update(self, user_id, values):
+        """更新缓存中用户的部分字段, 不改变过期时间"""
+        key = str(user_id)
+        with self._lock:
+            item = self._users.get(key)
+            if item is not None:
+                user = copy.copy(item[1])
+                for field, value in values.items():
+                    setattr(user, field, value)
+                self._users[key] = (item[0], user)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self.generation += 1
+            self._users.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._users.clear()
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    带用户缓存的 JWT 认证
+
+    令牌的校验与 JWTAuthentication 相同, 用户对象优先从进程内缓存读取, 命中时不查询数据库。
+    用户保存或删除时 (修改密码、更新资料、停用) 本进程的缓存立即失效;
+    多进程部署时其他进程最多在 TTL 内仍使用旧的用户数据。
+    """
+
+    def get_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        user = user_cache.get(user_id)
+        if user is None:
+            user = self.load_user(user_id)
+        return self.check_user(user, validated_token)
+
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+    def load_user(self, user_id):
+        """从数据库读取用户并放入缓存"""
+        generation = user_cache.generation
+        try:
+            user = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist as e:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+        user_cache.set(user, generation)
+        return user
+
+    def check_user(self, user, validated_token):
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
+
+
+def token_user(validated_token):
+    """由令牌构造不查询数据库的 TokenUser"""
+    if api_settings.USER_ID_CLAIM not in validated_token:
+        raise InvalidToken(_("Token contained no recognizable user identification"))
+    return api_settings.TOKEN_USER_CLASS(validated_token)
+
+
+class TokenUserAuthentication(JWTAuthentication):
+    """
+    只解析令牌的 JWT 认证
+    request.user 为 TokenUser, 只有 pk / id 可用, 不查询数据库也不检查缓存;
+    供只按 user_id 过滤的读接口使用。停用的用户在令牌过期前仍能通过认证。
+    """
+
+    def get_user(self, validated_token):
+        return token_user(validated_token)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def refresh_cached_user(sender, instance, update_fields=None, **kwargs):
+    user_id = getattr(instance, api_settings.USER_ID_FIELD)
+    if update_fields and BOOKKEEPING_FIELDS.issuperset(update_fields):
+        user_cache.update(user_id, {field: getattr(instance, field) for field in update_fields})
+    else:
+        user_cache.invalidate(user_id)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user(sender, instance, **kwargs):
+    user_cache.invalidate(getattr(instance, api_settings.USER_ID_FIELD))
@@ -0,0 +1,77 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, ScryptPasswordHasher
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class PasswordHashBusy(Exception):
+    """
+    等待计算的密码哈希已达上限
+    视图应返回 503 让客户端稍后重试, 而不是让请求无限排队
+    """
+
+
+def _get_pool():
+    global _pool
+    size = (settings.JOURNAL_PASSWORD_HASH_WORKERS, settings.JOURNAL_PASSWORD_HASH_QUEUE)
+    with _pool_lock:
+        if _pool is None or _pool[0] != size:
+            if _pool is not None:
+                _pool[1].shutdown(wait=False)
+            workers, queue = size
+            _pool = (
+                size,
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash'),
+                threading.BoundedSemaphore(workers + queue),
+            )
+        return _pool[1], _pool[2]
+
+
+def run_password_hashing(func, *args):
+    """
+    在有界线程池中执行一次密码哈希计算并等待结果
+
+    hashlib 的 PBKDF2 和 scrypt 计算时释放 GIL, 线程池大小 JOURNAL_PASSWORD_HASH_WORKERS
+    即同时用于哈希的 CPU 核数上限, 登录和注册的高峰不会占满所有核心而拖慢同步接口;
+    已有 JOURNAL_PASSWORD_HASH_QUEUE 个计算在排队时直接拒绝。
+
+    Raises:
+        PasswordHashBusy: 排队已满
+    """
+    executor, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        raise PasswordHashBusy('密码哈希排队已满')
+    try:
+        return executor.submit(func, *args).result()
+    finally:
+        slots.release()
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    在有界线程池中计算的 PBKDF2-SHA256
+    算法名与 Django 默认的哈希器相同, 已有的密码哈希不受影响; 迭代次数由
+    JOURNAL_PBKDF2_ITERATIONS 配置, 修改后旧的哈希在用户下次登录时按新的次数重新计算
+    """
+
+    @property
+    def iterations(self):
+        return settings.JOURNAL_PBKDF2_ITERATIONS
+
+    def encode(self, password, salt, iterations=None):
+        return run_password_hashing(super().encode, password, salt, iterations)
+
+
+class PooledScryptPasswordHasher(ScryptPasswordHasher):
+    """在有界线程池中计算的 scrypt, 工作因子 (N) 由 JOURNAL_SCRYPT_WORK_FACTOR 配置"""
+
+    @property
+    def work_factor(self):
+        return settings.JOURNAL_SCRYPT_WORK_FACTOR
+
+    def encode(self, password, salt, n=None, r=None, p=None):
+        return run_password_hashing(super().encode, password, salt, n, r, p)
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from users.models import User
+
+
+async def send(host, port, method, path, headers, body=b''):
+    """发送一个 HTTP/1.1 请求并读完响应, 返回状态码"""
+    reader, writer = await asyncio.open_connection(host, port)
+    lines = [f'{method} {path} HTTP/1.1', f'Host: {host}', 'Connection: close', *headers]
+    if body:
+        lines += ['Content-Type: application/json', f'Content-Length: {len(body)}']
+    writer.write('\r\n'.join([*lines, '', '']).encode('latin-1') + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    status_line = response.split(b'\r\n', 1)[0]
+    return int(status_line.split()[1]) if status_line else 0
+
+
+def percentile(values, fraction):
+    return values[max(int(len(values) * fraction) - 1, 0)] if values else float('nan')
+
+
+async def run_load(url, duration, login_clients, pull_clients, credentials, pull_headers):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    deadline = time.perf_counter() + duration
+    results = {'login': [], 'pull': []}
+    statuses = {'login': {}, 'pull': {}}
+
+    async def client(kind, method, path, headers, body):
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status = await send(host, port, method, path, headers, body)
+            except OSError:
+                status = 0
+            statuses[kind][status] = statuses[kind].get(status, 0) + 1
+            if status == 200:
+                results[kind].append(time.perf_counter() - started)
+
+    body = json.dumps(credentials).encode()
+    await asyncio.gather(
+        *(client('login', 'POST', '/users/login/', [], body) for _ in range(login_clients)),
+        *(
+            client('pull', 'GET', '/sync/pull/?cursor=1000000000', [*pull_headers, f'X-Device-Id: bench-{i}'], b'')
+            for i in range(pull_clients)
+        ),
+    )
+    return results, statuses
+
+
+class Command(BaseCommand):
+    help = '对运行中的服务同时发起登录和增量拉取, 测量登录吞吐量与拉取延迟 (p99)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='服务地址, 例如 uvicorn 监听的地址')
+        parser.add_argument('--user', required=True, help='拉取使用的用户名, 直接签发该用户的访问令牌')
+        parser.add_argument('--login-user', required=True, help='登录使用的用户名')
+        parser.add_argument('--login-password', required=True, help='登录使用的密码')
+        parser.add_argument('--login-clients', type=int, default=8, help='并发登录的客户端数, 0 表示只测拉取')
+        parser.add_argument('--pull-clients', type=int, default=4, help='并发拉取的客户端数')
+        parser.add_argument('--duration', type=float, default=15, help='压测时长 (秒)')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f"用户不存在: {options['user']}")
+        pull_headers = [f'Authorization: Bearer {RefreshToken.for_user(user).access_token}']
+        credentials = {'username': options['login_user'], 'password': options['login_password']}
+        results, statuses = asyncio.run(run_load(
+            options['url'], options['duration'], options['login_clients'], options['pull_clients'],
+            credentials, pull_headers,
+        ))
+        for kind in ('login', 'pull'):
+            latencies = sorted(results[kind])
+            if not statuses[kind]:
+                continue
+            self.stdout.write(
+                f'{kind:5}: {len(latencies) / options["duration"]:.1f} req/s, '
+                f'p50 {statistics.median(latencies) * 1000 if latencies else float("nan"):.0f}ms, '
+                f'p99 {percentile(latencies, 0.99) * 1000:.0f}ms, 状态码 {dict(sorted(statuses[kind].items()))}'
+            )
@@ -0,0 +1,98 @@
+# Generated by Django 5.1.3 on 2026-10-18 22:20
+
+from django.db import migrations
+
+ENTRY_COLUMNS = (
+    "id",
+    "user_id",
+    "is_mark",
+    "date",
+    "text",
+    "location_name",
+    "latitude",
+    "longitude",
+    "images_json",
+)
+
+
+def copy_entries(schema_editor, source, target):
+    """
+    把 source 表中的条目复制到 target 表。
+    target 中没有的 id 原样写入; id 已存在但内容不同的行换新 id 写入, 不丢数据。
+    """
+    quote = schema_editor.quote_name
+    columns = ", ".join(quote(column) for column in ENTRY_COLUMNS)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"SELECT {columns} FROM {quote(target)}")
+        existing = {row[0]: tuple(row) for row in cursor.fetchall()}
+        cursor.execute(f"SELECT {columns} FROM {quote(source)}")
+        rows = [tuple(row) for row in cursor.fetchall()]
+
+        keep_id = [row for row in rows if row[0] not in existing]
+        new_id = [row[1:] for row in rows if existing.get(row[0], row) != row]
+        if keep_id:
+            placeholders = ", ".join(["%s"] * len(ENTRY_COLUMNS))
+            cursor.executemany(
+                f"INSERT INTO {quote(target)} ({columns}) VALUES ({placeholders})",
+                keep_id,
+            )
+        if new_id:
+            placeholders = ", ".join(["%s"] * (len(ENTRY_COLUMNS) - 1))
+            cursor.executemany(
+                f"INSERT INTO {quote(target)} "
+                f"({', '.join(quote(c) for c in ENTRY_COLUMNS[1:])}) "
+                f"VALUES ({placeholders})",
+                new_id,
+            )
+
+
+def retire_legacy_entries(apps, schema_editor):
+    """
+    旧的 users_journalentry 通常已被 journal_data.0001 改名接管。
+    两张表同时存在时, 先把旧表中的条目并入新表, 再删除旧表。
+    """
+    LegacyEntry = apps.get_model("users", "JournalEntry")
+    JournalEntry = apps.get_model("journal_data", "JournalEntry")
+
+    legacy_table = LegacyEntry._meta.db_table
+    if legacy_table not in schema_editor.connection.introspection.table_names():
+        return
+    copy_entries(schema_editor, legacy_table, JournalEntry._meta.db_table)
+    schema_editor.delete_model(LegacyEntry)
+
+
+def restore_legacy_entries(apps, schema_editor):
+    """回滚时重建 users_journalentry, 并把条目复制回去"""
+    LegacyEntry = apps.get_model("users", "JournalEntry")
+    JournalEntry = apps.get_model("journal_data", "JournalEntry")
+
+    legacy_table = LegacyEntry._meta.db_table
+    if legacy_table in schema_editor.connection.introspection.table_names():
+        return
+    schema_editor.create_model(LegacyEntry)
+    copy_entries(schema_editor, JournalEntry._meta.db_table, legacy_table)
+
+
+class Migration(migrations.Migration):
+    """
+    JournalEntry 已迁移到 journal_data 应用, 这里从 users 的迁移状态中移除它。
+    表本身由 journal_data.0001_initial 接管, 这里只处理两张表并存的旧库。
+    """
+
+    dependencies = [
+        ("users", "0006_remove_user_last_sync_time"),
+        ("journal_data", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.DeleteModel(
+                    name="JournalEntry",
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(retire_legacy_entries, restore_legacy_entries),
+            ],
+        ),
+    ]
@@ -0,0 +1,184 @@
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from journal_data.cache import entry_cache
+from journal_data.models import JournalEntry
+from .authentication import user_cache
+from .hashers import run_password_hashing
+from .models import User
+
+
+class AuthCacheTests(TestCase):
+    """JWT 认证的用户缓存和只解析令牌的读接口"""
+
+    def setUp(self):
+        user_cache.clear()
+        # 条目缓存按 id 和 seq 命中, 不能留给之后复用相同 id 的测试
+        self.addCleanup(entry_cache().clear)
+        self.user = User.objects.create_user(username='auth', email='auth@example.com', password='auth-password')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def request(self, method, path, data=None):
+        """发送请求, 返回响应和其中读取用户表的查询数"""
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(path, data, format='json')
+        user_queries = [
+            query for query in ctx.captured_queries
+            if query['sql'].startswith('SELECT') and 'FROM "users_user"' in query['sql']
+        ]
+        return response, len(user_queries)
+
+    def test_cached_user(self):
+        response, queries = self.request('get', '/users/profile/')
+        self.assertEqual((response.status_code, queries), (200, 1))
+        response, queries = self.request('get', '/users/profile/')
+        self.assertEqual((response.status_code, queries), (200, 0))
+
+        # 只更新同步时间的保存直接写入缓存
+        response, _ = self.request('get', '/journals/sync/')
+        synced_at = response.json()['last_sync_time']
+        response, queries = self.request('get', '/users/profile/')
+        self.assertEqual((response.json()['last_data_sync_time'], queries), (synced_at, 0))
+
+        # 更新资料和修改密码后重新读取
+        self.request('put', '/users/profile/', {'phone': '13800000000'})
+        response, queries = self.request('get', '/users/profile/')
+        self.assertEqual((response.json()['phone'], queries), ('13800000000', 1))
+        response, _ = self.request('put', '/users/change-password/', {
+            'old_password': 'auth-password', 'new_password': 'new-password',
+        })
+        self.assertEqual(response.status_code, 200)
+        response, queries = self.request('get', '/users/profile/')
+        self.assertEqual((response.status_code, queries), (200, 1))
+
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.request('get', '/users/profile/')[0].status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.request('get', '/users/profile/')[0].status_code, 401)
+
+    @override_settings(JOURNAL_AUTH_USER_CACHE_TTL=0)
+    def test_cache_disabled(self):
+        for _ in range(2):
+            response, queries = self.request('get', '/users/profile/')
+            self.assertEqual((response.status_code, queries), (200, 1))
+
+    def test_token_user(self):
+        JournalEntry.objects.create(user=self.user, date=datetime(2024, 1, 1), text='x')
+        for path in ('/sync/pull/', '/sync/async/pull/', '/journals/async/entries/'):
+            response, queries = self.request('get', path)
+            self.assertEqual((response.status_code, queries), (200, 0), path)
+        self.assertEqual(len(self.request('get', '/sync/pull/')[0].json()['entries']), 1)
+        self.client.credentials()
+        self.assertEqual(self.request('get', '/sync/pull/')[0].status_code, 401)
+        self.assertEqual(self.request('get', '/sync/async/pull/')[0].status_code, 401)
+
+
+THROTTLE_RATES = {'login_ip': '5/min', 'login_username': '2/min', 'register_ip': '1/hour'}
+# 限流桶写到临时目录, 不影响开发环境的限流计数
+THROTTLE_CACHES = {
+    **settings.CACHES,
+    settings.JOURNAL_THROTTLE_CACHE: {
+        **settings.CACHES[settings.JOURNAL_THROTTLE_CACHE], 'LOCATION': tempfile.mkdtemp(prefix='journal-throttle-'),
+    },
+}
+
+
+@override_settings(
+    JOURNAL_PBKDF2_ITERATIONS=1000,
+    CACHES=THROTTLE_CACHES,
+    REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': THROTTLE_RATES},
+)
+class PasswordTests(TestCase):
+    """密码哈希线程池、哈希器配置和登录注册限流"""
+
+    def setUp(self):
+        caches[settings.JOURNAL_THROTTLE_CACHE].clear()
+        self.user = User.objects.create_user(username='login', email='login@example.com', password='login-password')
+        self.client = APIClient()
+
+    def login(self, username='login', password='login-password', ip='10.0.0.1', **extra):
+        return self.client.post(
+            '/users/login/', {'username': username, 'password': password}, format='json', REMOTE_ADDR=ip, **extra,
+        )
+
+    def test_login_throttle(self):
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(self.login(password='wrong').status_code, 401)
+        # 同一用户名换 IP 也受限
+        response = self.login(ip='10.0.0.2')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        # 同一 IP 尝试其他用户名直到 IP 的桶耗尽
+        self.assertEqual([self.login(username=f'guess-{i}').status_code for i in range(4)], [401, 401, 401, 429])
+        self.assertEqual(self.login(username='other', ip='10.0.0.3').status_code, 401)
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'login_username': '2/s'}})
+    def test_bucket_refill(self):
+        self.assertEqual([self.login().status_code for _ in range(3)], [200, 200, 429])
+        time.sleep(0.6)
+        self.assertEqual([self.login().status_code for _ in range(2)], [200, 429])
+
+    def test_forwarded_for_ignored(self):
+        # 伪造的 X-Forwarded-For 不能换出新的 IP 桶
+        statuses = [
+            self.login(username=f'guess-{i}', HTTP_X_FORWARDED_FOR=f'192.0.2.{i}').status_code for i in range(6)
+        ]
+        self.assertEqual(statuses, [401] * 5 + [429])
+        # 部署在代理之后时按代理追加的地址计数
+        rest_framework = {**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}
+        with self.settings(REST_FRAMEWORK=rest_framework):
+            self.assertEqual(self.login(username='other', HTTP_X_FORWARDED_FOR='192.0.2.1').status_code, 401)
+
+    def test_register_throttle(self):
+        data = {'username': 'new', 'password': 'new-password', 'email': 'new@example.com'}
+        self.assertEqual(self.client.post('/users/register/', data, format='json').status_code, 201)
+        data = {'username': 'new2', 'password': 'new-password', 'email': 'new2@example.com'}
+        self.assertEqual(self.client.post('/users/register/', data, format='json').status_code, 429)
+
+    def test_hasher_cost(self):
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+        # 调整迭代次数后, 旧的哈希在下次登录时按新的次数重新计算
+        with self.settings(JOURNAL_PBKDF2_ITERATIONS=2000):
+            self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$2000$'))
+
+        hashers = ['users.hashers.PooledScryptPasswordHasher', 'users.hashers.PooledPBKDF2PasswordHasher']
+        with self.settings(PASSWORD_HASHERS=hashers, JOURNAL_SCRYPT_WORK_FACTOR=2**10):
+            self.user.set_password('scrypt-password')
+            self.assertTrue(self.user.password.startswith('scrypt$1024$'))
+            self.assertTrue(self.user.check_password('scrypt-password'))
+            self.assertFalse(self.user.check_password('login-password'))
+
+    @override_settings(JOURNAL_PASSWORD_HASH_WORKERS=1, JOURNAL_PASSWORD_HASH_QUEUE=0)
+    def test_hash_pool_busy(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def occupy():
+            started.set()
+            release.wait(5)
+
+        thread = threading.Thread(target=run_password_hashing, args=(occupy,))
+        thread.start()
+        try:
+            started.wait(5)
+            response = self.login()
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(self.login().status_code, 200)
@@ -0,0 +1,84 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+# 速率字符串中周期的单位
+RATE_PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """解析 "次数/周期" 形式的速率, 例如 "10/min", 返回 (次数, 周期秒数)"""
+    count, period = rate.split('/')
+    return int(count), RATE_PERIODS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    令牌桶限流
+
+    scope 对应 REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] 中 "次数/周期" 形式的速率:
+    桶容量为次数, 令牌在周期内匀速补满。与 DRF 的 SimpleRateThrottle 相比允许短时突发,
+    且每个键只保存 (令牌数, 更新时间)。桶保存在 settings.JOURNAL_THROTTLE_CACHE
+    指定的缓存中, 该缓存须为各工作进程共享的后端; 速率未配置时不限流。
+    锁只在进程内串行更新, 不同进程同时更新同一个桶时偶尔会多放行一次。
+    """
+    scope = None
+    _lock = threading.Lock()
+
+    def get_cache_key(self, request, view):
+        """返回限流的键, 为 None 时不限流"""
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        key = self.get_cache_key(request, view)
+        if rate is None or key is None:
+            return True
+        capacity, period = parse_rate(rate)
+        cache = caches[settings.JOURNAL_THROTTLE_CACHE]
+        key = f'throttle:{self.scope}:{key}'
+        now = time.time()
+        with self._lock:
+            tokens, updated = cache.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * capacity / period)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # 闲置一个周期后桶已补满, 不需要继续保存
+            cache.set(key, (tokens, now), period)
+        self.wait_seconds = 0 if allowed else (1 - tokens) * period / capacity
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class LoginIPThrottle(TokenBucketThrottle):
+    """按客户端 IP 限制登录尝试; 客户端 IP 按 REST_FRAMEWORK['NUM_PROXIES'] 确定, 不信任伪造的转发头"""
+    scope = 'login_ip'
+
+    def get_cache_key(self, request, view):
+        return self.get_ident(request)
+
+
+class LoginUsernameThrottle(TokenBucketThrottle):
+    """按用户名限制登录尝试, 分散在多个 IP 上的猜测密码同样受限"""
+    scope = 'login_username'
+
+    def get_cache_key(self, request, view):
+        username = request.data.get('username') if hasattr(request.data, 'get') else None
+        if not isinstance(username, str) or not username:
+            return None
+        return username.strip().lower()[:150]
+
+
+class RegisterIPThrottle(TokenBucketThrottle):
+    """按客户端 IP 限制注册"""
+    scope = 'register_ip'
+
+    def get_cache_key(self, request, view):
+        return self.get_ident(request)
@@ -5,11 +5,24 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
 
+from .hashers import PasswordHashBusy
 from .models import User
 from .serializers import UserSerializer
+from .throttling import LoginIPThrottle, LoginUsernameThrottle, RegisterIPThrottle
+
+
+def password_hash_busy():
+    """密码哈希排队已满时的响应, 客户端应稍后重试"""
+    response = Response({
+        'error': 'Server busy, please retry later',
+        'code': 503
+    }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    response['Retry-After'] = '1'
+    return response
 
 class RegisterView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [RegisterIPThrottle]
     
     def post(self, request):
         try:
@@ -27,6 +40,8 @@ class RegisterView(APIView):
                 'details': serializer.errors,
                 'code': 400
             }, status=status.HTTP_400_BAD_REQUEST)
+        except PasswordHashBusy:
+            return password_hash_busy()
         except Exception as e:
             import traceback
             import logging
@@ -42,6 +57,7 @@ class RegisterView(APIView):
 
 class LoginView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [LoginIPThrottle, LoginUsernameThrottle]
     
     def post(self, request):
         try:
@@ -64,6 +80,8 @@ class LoginView(APIView):
                 'error': 'Invalid credentials',
                 'code': 401
             }, status=status.HTTP_401_UNAUTHORIZED)
+        except PasswordHashBusy:
+            return password_hash_busy()
         except Exception as e:
             import traceback
             import logging
@@ -101,6 +119,8 @@ class ChangePasswordView(APIView):
                 'message': 'Password updated successfully',
                 'code': 200
             }, status=status.HTTP_200_OK)
+        except PasswordHashBusy:
+            return password_hash_busy()
         except Exception as e:
             import traceback
             import logging